@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'medtrack.settings')
+# Under ASGI the read-heavy endpoints are served by their async views (medtrack_app/async_views.py)
+os.environ.setdefault('MEDTRACK_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
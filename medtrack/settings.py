@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'medtrack_app.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +90,15 @@ DATABASES = {
     }
 }
 
+# Set MEDTRACK_DATABASE=sqlite to run locally (for example the test suite) without PostgreSQL
+if os.environ.get('MEDTRACK_DATABASE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'medtrack.sqlite',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -128,6 +139,14 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Procedure reports are stored under MEDIA_ROOT by content hash, so identical uploads share
+# one file (see medtrack_app/storage.py)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'reports': {'BACKEND': 'medtrack_app.storage.ContentAddressedStorage'},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -150,6 +169,79 @@ SIMPLE_JWT = {
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES':[
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'medtrack_app.authentication.CachedJWTAuthentication',
     ],
-}
\ No newline at end of file
+}
+
+# Number of rows each AdminStat counter is spread over to avoid write contention
+MEDTRACK_COUNTER_SHARDS = 8
+
+# Background threads moving notifications from the outbox; 0 leaves them there until
+# dispatcher.drain() is called. Workers also check the outbox every OUTBOX_POLL seconds.
+MEDTRACK_NOTIFICATION_WORKERS = 2
+MEDTRACK_NOTIFICATION_BATCH_SIZE = 100
+MEDTRACK_NOTIFICATION_OUTBOX_POLL = 5
+
+# Notification push (medtrack_app/notifications.py): longest a long-poll waits (seconds), idle
+# seconds before an event stream checks the database for notifications of other processes,
+# and notifications held per waiting client before it falls back to reading the database
+MEDTRACK_NOTIFICATION_POLL_TIMEOUT = 25
+MEDTRACK_NOTIFICATION_STREAM_RESYNC = 30
+MEDTRACK_NOTIFICATION_STREAM_BUFFER = 100
+
+# Retention (`manage.py apply_retention`, see medtrack_app/retention.py): notifications older
+# than the given number of days are deleted, procedures dated before it moved to the archive
+# table (listed with ?archived=true); None keeps them. Rows are processed in batches of
+# BATCH_SIZE, SLEEP seconds apart.
+MEDTRACK_NOTIFICATION_RETENTION_DAYS = 180
+MEDTRACK_PROCEDURE_ARCHIVE_DAYS = 730
+MEDTRACK_RETENTION_BATCH_SIZE = 1000
+MEDTRACK_RETENTION_SLEEP = 0.1
+
+# Report garbage collection (`manage.py collect_reports`): report files no procedure refers to
+# any more are deleted GRACE seconds after their last reference went, BATCH_SIZE at a time
+MEDTRACK_REPORT_GC_GRACE = 3600
+MEDTRACK_REPORT_GC_BATCH_SIZE = 500
+
+# Cache shared by every process: Redis at MEDTRACK_CACHE_URL (e.g. redis://localhost:6379/0),
+# or a per-process memory cache when it is not set
+if os.environ.get('MEDTRACK_CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['MEDTRACK_CACHE_URL'],
+        }
+    }
+
+# Cache alias holding the auth versions of users (see medtrack_app/authentication.py), so a
+# cached user or a token's roles claim is checked without a query. It must be shared by
+# every process and must not evict the versions, so it is only set with MEDTRACK_CACHE_URL
+# (Redis with a noeviction or volatile-* maxmemory policy); without it users and roles are
+# read from the database on every request.
+MEDTRACK_AUTH_CACHE = os.environ.get('MEDTRACK_AUTH_CACHE', 'default' if os.environ.get('MEDTRACK_CACHE_URL') else '') or None
+
+# In-process cache of authenticated users (entries, seconds). Only used with
+# MEDTRACK_AUTH_CACHE, whose versions invalidate it in every process; the TTL bounds how long
+# an entry lives even so
+MEDTRACK_USER_CACHE_SIZE = 1024
+MEDTRACK_USER_CACHE_TTL = 60
+
+# Seconds a caught-up delta sync watermark is held back, to cover in-flight transactions
+MEDTRACK_SYNC_OVERLAP = 5
+
+# Serve the read-heavy list endpoints with their async views (set by medtrack/asgi.py)
+MEDTRACK_ASYNC_VIEWS = os.environ.get('MEDTRACK_ASYNC_VIEWS', '0') == '1'
+
+# Server-side cache of the patient and procedure list responses (see medtrack_app/caching.py):
+# an in-process LRU by default, or medtrack_app.caching.DjangoResponseCache with
+# {'alias': ..., 'timeout': ...} options to share a Django cache. None (or an empty
+# MEDTRACK_RESPONSE_CACHE_BACKEND environment variable) disables it.
+MEDTRACK_RESPONSE_CACHE_BACKEND = os.environ.get(
+    'MEDTRACK_RESPONSE_CACHE_BACKEND', 'medtrack_app.caching.LRUResponseCache'
+) or None
+MEDTRACK_RESPONSE_CACHE_OPTIONS = {'max_size': 512}
+
+# Opt-in per endpoint latency, SQL and serializer metrics (see medtrack_app/instrumentation.py),
+# returned as Server-Timing headers when MEDTRACK_SERVER_TIMING is set
+MEDTRACK_INSTRUMENTATION = os.environ.get('MEDTRACK_INSTRUMENTATION', '0') == '1'
+MEDTRACK_SERVER_TIMING = True
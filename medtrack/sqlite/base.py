@@ -0,0 +1,19 @@
+from django.db.backends.sqlite3 import base, features
+
+
+def _char_type(data):
+    # Some choice CharFields have no max_length (PostgreSQL allows unbounded varchar);
+    # SQLite takes a bare varchar
+    if data.get('max_length') is None:
+        return 'varchar'
+    return 'varchar(%(max_length)s)' % data
+
+
+class DatabaseFeatures(features.DatabaseFeatures):
+    supports_unlimited_charfield = True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # SQLite backend for MEDTRACK_DATABASE=sqlite that accepts the schema PostgreSQL runs
+    data_types = {**base.DatabaseWrapper.data_types, 'CharField': _char_type}
+    features_class = DatabaseFeatures
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Patient, Procedure, AdminStat, Notification
+from django.contrib.admin.views.main import ORDER_VAR
+from .models import Patient, Procedure, ArchivedProcedure, AdminStat, Notification
+from .search import search_patients
 
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
@@ -9,14 +11,37 @@ class PatientAdmin(admin.ModelAdmin):
     list_filter = ('gender', 'city', 'state', 'created_date')
     ordering = ('first_name', 'last_name')
 
+    def get_search_results(self, request, queryset, search_term):
+        # Use the same indexed search backend as the patient API
+        if not search_term:
+            return queryset, False
+        results = search_patients(queryset, search_term)
+        # Most relevant patients first, unless a column is sorted on
+        if ORDER_VAR not in request.GET:
+            results = results.order_by('-rank', '-pk')
+        return results, False
+
 @admin.register(Procedure)
 class ProcedureAdmin(admin.ModelAdmin):
     list_display = ('procedure_name', 'patient', 'status', 'created_by', 'created_date', 'updated_date')
     readonly_fields = ('created_by', 'created_date', 'updated_date')
     list_filter = ('status', 'created_date', 'updated_date')
     search_fields = ('procedure_name', 'patient__first_name', 'patient__last_name')
+    list_select_related = ('patient', 'created_by')
     ordering = ('-created_date',)
 
+@admin.register(ArchivedProcedure)
+class ArchivedProcedureAdmin(admin.ModelAdmin):
+    list_display = ('procedure_name', 'patient', 'status', 'procedure_datetime', 'archived_date')
+    list_filter = ('status', 'archived_date')
+    search_fields = ('procedure_name', 'patient__first_name', 'patient__last_name')
+    list_select_related = ('patient',)
+    ordering = ('-procedure_datetime',)
+
+    def has_add_permission(self, request):
+        # Rows only get here through the retention command
+        return False
+
 @admin.register(AdminStat)
 class AdminStatAdmin(admin.ModelAdmin):
     list_display = ('total_patients', 'total_procedures', 'front_desk_users', 'doctor_users', 'admin_users', 'last_updated')
@@ -25,6 +50,7 @@ class AdminStatAdmin(admin.ModelAdmin):
 
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
-    list_display = ('user', 'message', 'timestamp')
+    list_display = ('user', 'message', 'timestamp', 'is_read')
+    list_filter = ('is_read',)
     search_fields = ('user__username', 'message')
     ordering = ('-timestamp',)
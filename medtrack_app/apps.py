@@ -7,3 +7,4 @@ class MedtrackAppConfig(AppConfig):
 
     def ready(self):
         import medtrack_app.signals
+        import medtrack_app.checks
@@ -0,0 +1,288 @@
+import asyncio
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import status, permissions
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+from . import caching, counters, instrumentation
+from .fast_serializers import PatientValuesSerializer, ProcedureValuesSerializer
+from .models import Notification, Procedure
+from .notifications import broker
+from .pagination import KeysetPagination
+from .permissions import IsAdmin, IsDoctor, IsFrontDesk
+from .renderers import EventStreamRenderer, FastJSONRenderer
+from .serializers import NotificationSerializer, AdminStatSerializer, read_report_base64
+from .streaming import server_sent_event
+from .views import AdminStatView, NotificationStreamView, NotificationUnreadCountView, NotificationView
+from .views import PatientView, ProcedureView
+from .views import get_field_selection, get_ordering_columns, get_patient_queryset, get_procedure_context
+from .views import get_latest_notification_id, get_missed_notifications, get_poll_data, get_procedure_queryset
+from .views import NOTIFICATION_STREAM_BATCH_SIZE, get_stream_position, render_notifications
+from .views import get_notification_queryset, get_notification_selection
+
+# Async variants of the read-heavy endpoints, served in place of the views in views.py when
+# the app runs under ASGI (see medtrack/asgi.py). A request waiting on the database or on
+# report files then suspends a coroutine instead of holding a worker thread.
+#
+# Everything a serializer renders has to be loaded up front: lazy loading a relation from
+# async code raises SynchronousOnlyOperation.
+
+
+class AsyncAPIView(APIView):
+    # APIView with coroutine handlers. Authentication, permission checks and throttling
+    # may touch the database and run through a single sync_to_async() call per request;
+    # the handler itself uses the async ORM. Methods without an async handler (the writes)
+    # are passed to `sync_view` in a worker thread.
+    view_is_async = True
+    sync_view = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        if self.sync_view is not None and not hasattr(type(self), method):
+            view = self.sync_view.as_view()
+            return await sync_to_async(view)(request, *args, **kwargs)
+
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if method in self.http_method_names:
+                handler = getattr(self, method, self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def options(self, request, *args, **kwargs):
+        return super().options(request, *args, **kwargs)
+
+
+async def encode_reports(rows):
+    # Read and base64 encode the reports of a page of procedure rows concurrently, in
+    # worker threads, so the event loop is never blocked on disk
+    storage = Procedure._meta.get_field('report').storage
+    with_report = [row for row in rows if row['report']]
+    encoded = await asyncio.gather(*(
+        asyncio.to_thread(read_report_base64, storage.path(row['report'])) for row in with_report
+    ))
+    return {row['id']: report for row, report in zip(with_report, encoded)}
+
+
+class AsyncNotificationView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+    sync_view = NotificationView
+
+    async def get(self, request):
+        # Retrieve a page of notifications for the authenticated user, newest first, loading
+        # only the selected fields (with the user joined in when it is expanded)
+        selection = get_notification_selection(request)
+        queryset = NotificationSerializer(**selection).setup_eager_loading(
+            get_notification_queryset(request), 'timestamp', 'id',
+        )
+        paginator = KeysetPagination()
+        page_queryset = paginator.get_page_queryset(queryset, request)
+        page = paginator.get_page([notification async for notification in page_queryset])
+
+        if not page and paginator.position is None:
+            return Response({"detail": "No notifications available."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Serialize and return the page
+        serializer = NotificationSerializer(page, many=True, **selection)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class AsyncNotificationUnreadCountView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+    sync_view = NotificationUnreadCountView
+
+    async def get(self, request):
+        # Counted from the partial index on unread notifications, without touching the rows
+        unread = await Notification.objects.filter(user=request.user, is_read=False).acount()
+        return Response({"unread": unread}, status=status.HTTP_200_OK)
+
+
+class AsyncNotificationStreamView(AsyncAPIView):
+    # NotificationStreamView's long-poll, and a server-sent event stream of the same
+    # notifications for clients accepting text/event-stream (EventSource). The stream sends
+    # the notifications after Last-Event-ID, then each new one as the broker pushes it,
+    # with the notification id as the event id so reconnecting clients resume where they
+    # left off. Every MEDTRACK_NOTIFICATION_STREAM_RESYNC idle seconds it checks the
+    # database for notifications written by other processes, or sends a keep-alive comment.
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer]
+    sync_view = NotificationStreamView
+
+    async def get(self, request):
+        try:
+            last_event_id, timeout = get_stream_position(request)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        # Reject unknown fields before waiting
+        selection = get_notification_selection(request)
+        NotificationSerializer(**selection)
+
+        if isinstance(request.accepted_renderer, EventStreamRenderer):
+            response = StreamingHttpResponse(
+                self.stream(request.user, last_event_id, selection), content_type=EventStreamRenderer.media_type,
+            )
+            # Keep caches and proxies (e.g. nginx) from holding the events back
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        # Subscribe before reading the database, so nothing written in between is missed
+        subscription = broker.subscribe(request.user.id, asyncio.get_running_loop())
+        try:
+            if last_event_id is None:
+                last_event_id = await get_latest_notification_id(request.user).afirst() or 0
+                entries = []
+            else:
+                entries = [entry async for entry in get_missed_notifications(request.user, last_event_id)]
+
+            if not entries and timeout and await subscription.wait_async(timeout):
+                entries, stale = subscription.take()
+                if stale:
+                    entries = [entry async for entry in get_missed_notifications(request.user, last_event_id)]
+        finally:
+            broker.unsubscribe(subscription)
+
+        data = get_poll_data(request.user, entries, last_event_id, selection)
+        return Response(data, status=status.HTTP_200_OK)
+
+    @staticmethod
+    async def stream(user, last_event_id, selection):
+        resync = getattr(settings, 'MEDTRACK_NOTIFICATION_STREAM_RESYNC', 30)
+        renderer = FastJSONRenderer()
+        # Ids recently sent, as pushed notifications may also have been read from the database
+        sent = deque(maxlen=2 * broker.max_pending)
+
+        async def read_missed():
+            # Everything after last_event_id, in batches
+            entries = []
+            while True:
+                after = max([last_event_id, *(entry[0] for entry in entries)])
+                batch = [entry async for entry in get_missed_notifications(user, after)]
+                entries += batch
+                if len(batch) < NOTIFICATION_STREAM_BATCH_SIZE:
+                    return entries
+
+        subscription = broker.subscribe(user.id, asyncio.get_running_loop())
+        try:
+            # Ask EventSource to reconnect after 5 seconds when the connection drops
+            yield b'retry: 5000\n\n'
+            if last_event_id is None:
+                last_event_id = await get_latest_notification_id(user).afirst() or 0
+                entries = []
+            else:
+                entries = await read_missed()
+
+            while True:
+                entries = [entry for entry in entries if entry[0] not in sent]
+                for entry, data in zip(entries, render_notifications(user, entries, selection)):
+                    sent.append(entry[0])
+                    last_event_id = max(last_event_id, entry[0])
+                    yield server_sent_event(renderer.render(data), event='notification', event_id=entry[0])
+
+                if await subscription.wait_async(resync):
+                    entries, stale = subscription.take()
+                    if stale:
+                        entries = await read_missed()
+                else:
+                    entries = await read_missed()
+                    if not entries:
+                        yield b': keep-alive\n\n'
+        finally:
+            broker.unsubscribe(subscription)
+
+
+class AsyncAdminStatView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+    sync_view = AdminStatView
+
+    async def get(self, request):
+        # Sum the sharded counters into an AdminStat object
+        admin_stat = await counters.aget_admin_stat()
+        if admin_stat is None:
+            return Response({"detail": "No admin stats available."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Answer conditional requests without serializing
+        etag, last_updated = caching.get_admin_stat_validators(request, admin_stat)
+        response = caching.not_modified(request, etag, last_updated)
+        if response is not None:
+            return response
+
+        # Serialize and return the AdminStat data
+        serializer = AdminStatSerializer(admin_stat)
+        return caching.set_validators(Response(serializer.data, status=status.HTTP_200_OK), etag, last_updated)
+
+
+class AsyncPatientView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin | IsFrontDesk]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    sync_view = PatientView
+
+    async def get(self, request):
+        # Handle GET requests to list patients, answering conditional requests and repeated
+        # queries without running the list query
+        return await caching.acached_list_response(
+            request, self.sync_view.version_tables, lambda: self.get_page_data(request),
+        )
+
+    async def get_page_data(self, request):
+        patients, ordering = get_patient_queryset(request)
+
+        # Serialize a single page of patients, read as .values() rows
+        serializer = PatientValuesSerializer(**get_field_selection(request))
+        rows = serializer.values(patients, *get_ordering_columns(ordering))
+        paginator = KeysetPagination(ordering=ordering)
+        page_queryset = paginator.get_page_queryset(rows, request)
+        page = paginator.get_page([row async for row in page_queryset])
+        with instrumentation.timed_serializer():
+            data = serializer.many(page)
+        return paginator.get_paginated_data(data)
+
+
+class AsyncProcedureView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin | IsDoctor]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    sync_view = ProcedureView
+
+    async def get(self, request):
+        # Handle GET requests to list procedures, answering conditional requests and repeated
+        # queries without running the list query. Pages with inlined reports are too large
+        # to keep in the cache.
+        context = get_procedure_context(request)
+        return await caching.acached_list_response(
+            request, self.sync_view.version_tables, lambda: self.get_page_data(request, context),
+            cache=not context['include_report_base64'],
+        )
+
+    async def get_page_data(self, request, context):
+        procedures = get_procedure_queryset(request)
+
+        # Serialize a single page of procedures, read as .values() rows
+        serializer = ProcedureValuesSerializer(context=context, **get_field_selection(request))
+        paginator = KeysetPagination()
+        rows = serializer.values(procedures, *get_ordering_columns(Procedure._meta.ordering))
+        page_queryset = paginator.get_page_queryset(rows, request)
+        page = paginator.get_page([row async for row in page_queryset])
+
+        if context['include_report_base64']:
+            context['encoded_reports'] = await encode_reports(page)
+        with instrumentation.timed_serializer():
+            data = serializer.many(page)
+        return paginator.get_paginated_data(data)
@@ -0,0 +1,159 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# Keys of the shared cache (MEDTRACK_AUTH_CACHE) holding the auth version of one user and
+# of all users: the time_ns() of their last change. Bumping a version makes the cached
+# copies of the affected users unreachable, and the role claims of their tokens untrusted,
+# in every process using the cache. They are stored without expiry. A missing version
+# (never set, evicted, or lost with the cache) may hide a change, so it is set to the time
+# it was found missing: tokens issued and users cached before then are not trusted.
+_VERSION_KEY = 'medtrack:auth-version:{}'
+_ALL_VERSION_KEY = 'medtrack:auth-version:all'
+
+
+class UserCache:
+    # Size-bounded, thread-safe LRU of users with a per-entry time to live
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, user):
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, user_ids=None):
+        # Drop the entries of the given users, or all entries
+        with self._lock:
+            if user_ids is None:
+                self._entries.clear()
+                return
+            user_ids = set(user_ids)
+            for key in [key for key in self._entries if key[0] in user_ids]:
+                del self._entries[key]
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+user_cache = UserCache(
+    max_size=getattr(settings, 'MEDTRACK_USER_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'MEDTRACK_USER_CACHE_TTL', 60),
+)
+
+
+def get_auth_cache():
+    # The cache holding the auth versions, or None when MEDTRACK_AUTH_CACHE is unset: users
+    # and roles are then read from the database on every request
+    alias = getattr(settings, 'MEDTRACK_AUTH_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def get_auth_version(user_id):
+    # The versions of the user and of all users, read from the shared cache without SQL,
+    # and the time (in seconds) of the latest change to either; None without a shared cache
+    cache = get_auth_cache()
+    if cache is None:
+        return None
+    keys = [_VERSION_KEY.format(user_id), _ALL_VERSION_KEY]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # Another process may be setting them too: the first value written wins
+        now = time.time_ns()
+        for key in missing:
+            cache.add(key, now, None)
+        found = cache.get_many(missing)
+        versions.update({key: found.get(key, now) for key in missing})
+    versions = tuple(versions[key] for key in keys)
+    return versions, max(versions) / 1e9
+
+
+def invalidate_users(user_ids=None):
+    # Called when users are saved (deactivated, password changed, ...) or change groups.
+    # None invalidates every user.
+    cache = get_auth_cache()
+    if cache is not None:
+        version = time.time_ns()
+        if user_ids is None:
+            cache.set(_ALL_VERSION_KEY, version, None)
+        else:
+            cache.set_many({_VERSION_KEY.format(user_id): version for user_id in user_ids}, None)
+    user_cache.discard(user_ids)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # JWTAuthentication that resolves the token's user from an in-process LRU instead of
+    # loading the auth_user row on every request. Entries are keyed by user id and auth
+    # version, read from the shared cache, so saving a user or changing their groups makes
+    # the cached copy unreachable. The time of the user's last auth change is kept on the
+    # returned user, for the role claim check of roles.get_request_roles(). Without a shared
+    # cache every request loads the user, as JWTAuthentication does.
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        auth_version = get_auth_version(user_id)
+        if auth_version is None:
+            return super().get_user(validated_token)
+
+        versions, last_changed = auth_version
+        key = (user_id, *versions)
+        user = user_cache.get(key)
+        if user is None:
+            # Loads the user and checks it is active (and not revoked)
+            user = super().get_user(validated_token)
+            user_cache.set(key, user)
+        elif api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        # Every request gets its own copy, so per-request state set on it does not leak
+        user = copy.copy(user)
+        user._medtrack_auth_changed = last_changed
+        return user
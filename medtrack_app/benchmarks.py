@@ -0,0 +1,233 @@
+import base64
+import platform
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import caching, urls
+from .models import Notification, Patient, Procedure
+from .roles import add_role_claims
+from .synthetic import SYNTHETIC_PASSWORD, synthetic_username
+
+
+def percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Endpoint:
+    # One request to benchmark: the URL name it targets, how to call it and as whom.
+    # `data` may be a callable when every request needs a fresh payload (e.g. uploads).
+    def __init__(self, name, method='get', role='Admin', kwargs=None, data=None, format=None, headers=None,
+                 label=None):
+        self.name = name
+        self.method = method
+        self.role = role
+        self.kwargs = kwargs or {}
+        self.data = data
+        self.format = format
+        self.headers = headers or {}
+        self.label = label or f'{name} {method.upper()}'
+
+    def get_data(self):
+        return self.data() if callable(self.data) else self.data
+
+
+def patient_payload(index=0):
+    return {
+        'first_name': 'Bench', 'last_name': f'Patient{index}', 'mobile_number': '9876543210',
+        'address': '12 MG Road', 'gender': 'F', 'birthdate': '1990-01-01',
+        'email': 'bench@example.com', 'city': 'Pune', 'state': 'Maharashtra', 'pincode': '411001',
+        'emergency_contact_name': 'Contact', 'emergency_contact_mobile_number': '9123456780',
+        'language': 'Marathi',
+    }
+
+
+def import_payload():
+    rows = [patient_payload(index) for index in range(20)]
+    lines = [','.join(rows[0])] + [','.join(row.values()) for row in rows]
+    return {'file': SimpleUploadedFile('patients.csv', '\n'.join(lines).encode())}
+
+
+def get_endpoints():
+    # The requests made against every endpoint in medtrack_app/urls.py. Ids are taken from
+    # the data set in the database; endpoints that need a missing row are left out.
+    patient = Patient.objects.order_by('id').first()
+    procedure = Procedure.objects.order_by('id').first()
+    with_report = Procedure.objects.exclude(report='').exclude(report__isnull=True).order_by('id').first()
+    admin = User.objects.get(username=synthetic_username('Admin'))
+    refresh_token = str(RefreshToken.for_user(admin))
+    login_credentials = base64.b64encode(f'{admin.username}:{SYNTHETIC_PASSWORD}'.encode()).decode()
+
+    endpoints = [
+        Endpoint('register', 'post', role=None, data={
+            'username': 'bench_register', 'email': 'bench_register@example.com',
+            'password': SYNTHETIC_PASSWORD, 'role': 'Doctor',
+        }),
+        Endpoint('token_obtain_pair', 'post', role=None, headers={'HTTP_AUTHORIZATION': login_credentials}),
+        Endpoint('logout', 'post', data={'refresh_token': refresh_token}),
+        Endpoint('user_info', label='user_info GET (admin)'),
+        Endpoint('user_info', role='Doctor', label='user_info GET (doctor)'),
+        Endpoint('list_notifications'),
+        Endpoint('list_notifications', data={'is_read': 'false'}, label='list_notifications GET ?is_read='),
+        Endpoint('notification_unread_count'),
+        Endpoint('bulk_notifications', 'post', data={'action': 'read', 'all': True}, format='json'),
+        Endpoint('stream_notifications', data={'last_event_id': 0, 'timeout': 0}),
+        Endpoint('admin-stats'),
+        Endpoint('admin-instrumentation'),
+        Endpoint('list_create_patient'),
+        Endpoint('list_create_patient', data={'city': 'Pune'}, label='list_create_patient GET ?city='),
+        Endpoint('list_create_patient', data={'search': 'sharma pune'}, label='list_create_patient GET ?search='),
+        Endpoint('list_create_patient', 'post', role='Front_Desk', data=patient_payload()),
+        Endpoint('import_patients', 'post', role='Front_Desk', data=import_payload, format='multipart'),
+        Endpoint('export_patients', data={'start_date': '2000-01-01'}),
+        Endpoint('sync_patients'),
+        Endpoint('list_create_procedure'),
+        Endpoint('list_create_procedure', data={'fields': 'id,status,procedure_datetime,procedure_name'},
+                 label='list_create_procedure GET ?fields='),
+        Endpoint('list_create_procedure', data={'archived': 'true'}, label='list_create_procedure GET ?archived='),
+        Endpoint('export_procedures', data={'status': 'completed'}),
+        Endpoint('sync_procedures'),
+    ]
+    if patient is not None:
+        endpoints += [
+            Endpoint('list_create_procedure', data={'patient_id': patient.pk},
+                     label='list_create_procedure GET ?patient_id='),
+            Endpoint('list_create_procedure', 'post', role='Doctor', data={
+                'patient': patient.pk, 'status': 'completed', 'procedure_datetime': '2024-01-01T10:00:00Z',
+                'category': 'diagnostic', 'procedure_name': 'Bench', 'clinic_address': '1 Hospital Road',
+            }),
+            Endpoint('bulk_create_procedures', 'post', role='Doctor', format='json', data={
+                'procedures': [{
+                    'patient': patient.pk, 'status': 'completed', 'procedure_datetime': '2024-01-01T10:00:00Z',
+                    'category': 'diagnostic', 'procedure_name': f'Bench {index}', 'clinic_address': '1 Hospital Road',
+                } for index in range(20)],
+            }),
+        ]
+    if procedure is not None:
+        endpoints.append(Endpoint('update_procedure', 'put', role='Doctor', kwargs={'pk': procedure.pk},
+                                  data={'status': 'on-hold'}))
+        procedure_ids = Procedure.objects.order_by('id').values_list('id', flat=True)[:20]
+        endpoints.append(Endpoint('bulk_update_procedure_status', 'post', role='Doctor', format='json', data={
+            'updates': [{'id': pk, 'status': 'on-hold'} for pk in procedure_ids],
+        }))
+    if with_report is not None:
+        endpoints.append(Endpoint('procedure_report', kwargs={'pk': with_report.pk}))
+    return endpoints
+
+
+class EndpointBenchmark:
+    # Calls each endpoint in-process through the full middleware and JWT authentication
+    # stack. Every request runs in a transaction that is rolled back, so writes do not change
+    # the data set between iterations or runs. Latencies come from plain timed requests;
+    # query count and peak Python memory from one extra request made under tracemalloc.
+    # Repeated requests would otherwise be answered by the response cache, so it is off
+    # unless `response_cache` is set to measure cache hits instead.
+    def __init__(self, iterations=50, warmup=5, response_cache=False):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.response_cache = response_cache
+        self.clients = {}
+
+    @staticmethod
+    def get_host():
+        # A host name the site accepts; with DEBUG and no ALLOWED_HOSTS that is localhost
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != '*']
+        return hosts[0].lstrip('.') if hosts else 'localhost'
+
+    def get_client(self, role):
+        if role not in self.clients:
+            client = APIClient(HTTP_HOST=self.get_host())
+            if role is not None:
+                user = User.objects.get(username=synthetic_username(role))
+                token = add_role_claims(RefreshToken.for_user(user), user).access_token
+                client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.clients[role] = client
+        return self.clients[role]
+
+    def request(self, endpoint):
+        # Make one request, read the whole body and undo its writes
+        client = self.get_client(endpoint.role)
+        path = reverse(endpoint.name, kwargs=endpoint.kwargs)
+        extra = dict(endpoint.headers)
+        if endpoint.format:
+            extra['format'] = endpoint.format
+        with transaction.atomic():
+            response = getattr(client, endpoint.method)(path, endpoint.get_data(), **extra)
+            if response.streaming:
+                size = sum(len(chunk) for chunk in response.streaming_content)
+            else:
+                size = len(response.content)
+            transaction.set_rollback(True)
+        return response.status_code, size
+
+    def measure(self, endpoint):
+        for _ in range(self.warmup):
+            self.request(endpoint)
+
+        latencies = []
+        for _ in range(self.iterations):
+            started = time.perf_counter()
+            status_code, size = self.request(endpoint)
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                self.request(endpoint)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'method': endpoint.method.upper(),
+            'status': status_code,
+            'iterations': self.iterations,
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p90_ms': round(percentile(latencies, 0.90), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'max_ms': round(latencies[-1], 3),
+            'queries': len(queries.captured_queries),
+            'peak_memory_kb': round(peak / 1024, 1),
+            'response_bytes': size,
+        }
+
+    def run(self, endpoints):
+        if self.response_cache:
+            results = {endpoint.label: self.measure(endpoint) for endpoint in endpoints}
+        else:
+            with caching.response_cache_disabled():
+                results = {endpoint.label: self.measure(endpoint) for endpoint in endpoints}
+        covered = {endpoint.name for endpoint in endpoints}
+        return {
+            'environment': {
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'iterations': self.iterations,
+                'response_cache': self.response_cache and caching.response_cache is not None,
+                'patients': Patient.objects.count(),
+                'procedures': Procedure.objects.count(),
+                'notifications': Notification.objects.count(),
+            },
+            'endpoints': results,
+            'not_benchmarked': sorted(
+                pattern.name for pattern in urls.urlpatterns if pattern.name and pattern.name not in covered
+            ),
+        }
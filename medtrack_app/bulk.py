@@ -0,0 +1,158 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching, counters
+from .models import Patient, Procedure
+from .notifications import notify
+from .serializers import ProcedureSerializer
+
+STATUSES = {value for value, _ in Procedure.STATUS_CHOICES}
+
+
+def parse_id(model, value):
+    # Id of an item, parsed by the model's primary key field like the objects.get() of the
+    # single object views, so numeric strings work too; None when it is not an id
+    if isinstance(value, bool):
+        return None
+    try:
+        return model._meta.pk.to_python(value)
+    except ValidationError:
+        return None
+
+
+def lowercase_choices(data):
+    # Status and category are accepted in any case, like ProcedureView does
+    for name in ('status', 'category'):
+        if isinstance(data.get(name), str):
+            data[name] = data[name].lower()
+    return data
+
+
+class ProcedureBulkCreator:
+    # Creates procedures for existing patients from a list of items shaped like the
+    # ProcedureView.post payload. Items are validated with ProcedureSerializer, the patients
+    # of all items are looked up in one query, and the valid items are inserted with a single
+    # bulk_create in one transaction, along with one AdminStat update and one notification.
+    # Invalid items are reported by position and do not stop the others.
+    max_items = 500
+
+    def __init__(self, created_by):
+        self.created_by = created_by
+        self.results = []
+
+    def run(self, items):
+        patient_ids = {parse_id(Patient, item.get('patient')) for item in items if isinstance(item, dict)}
+        patients = Patient.objects.in_bulk([pk for pk in patient_ids if pk is not None])
+
+        procedures = []
+        for index, item in enumerate(items):
+            procedure = self.validate(index, item, patients)
+            if procedure is not None:
+                procedures.append((index, procedure))
+
+        if procedures:
+            with transaction.atomic():
+                created = Procedure.objects.bulk_create([procedure for _, procedure in procedures])
+                counters.increment('total_procedures', len(created))
+                caching.bump_versions('procedure')
+                notify(self.created_by.id, f"{len(created)} procedures have been created.")
+            self.results += [{'index': index, 'id': procedure.pk} for index, procedure in procedures]
+        return self.report()
+
+    def validate(self, index, item, patients):
+        # Return an unsaved Procedure for a valid item, or record why it was rejected
+        if not isinstance(item, dict):
+            self.results.append({'index': index, 'errors': {'non_field_errors': ['Item must be a JSON object.']}})
+            return None
+
+        patient = patients.get(parse_id(Patient, item.get('patient')))
+        if patient is None:
+            self.results.append({'index': index, 'errors': {'patient': ['Patient does not exist.']}})
+            return None
+
+        serializer = ProcedureSerializer(data=lowercase_choices(dict(item)))
+        if not serializer.is_valid():
+            self.results.append({'index': index, 'errors': serializer.errors})
+            return None
+        return Procedure(patient=patient, created_by=self.created_by, **serializer.validated_data)
+
+    def report(self):
+        self.results.sort(key=lambda result: result['index'])
+        failed = sum('errors' in result for result in self.results)
+        return {
+            'created': len(self.results) - failed,
+            'failed': failed,
+            'results': self.results,
+        }
+
+
+class ProcedureStatusUpdater:
+    # Applies {"id", "status"} transitions to many procedures in one transaction. The
+    # procedures are locked and read in one query, then updated with one UPDATE per target
+    # status. Procedures already in the target status are left alone, and the creators of
+    # the updated procedures get one notification each instead of one per procedure.
+    max_items = 1000
+
+    def __init__(self):
+        self.results = []
+
+    def run(self, items):
+        transitions = {}
+        for item in items:
+            transition = self.validate(item, transitions)
+            if transition is not None:
+                transitions[transition[0]] = transition[1]
+
+        with transaction.atomic():
+            current = {
+                pk: (current_status, created_by_id)
+                for pk, current_status, created_by_id in Procedure.objects.select_for_update()
+                .filter(id__in=transitions).values_list('id', 'status', 'created_by_id')
+            }
+
+            by_status, updated_by_creator = {}, {}
+            for pk, new_status in transitions.items():
+                if pk not in current:
+                    self.results.append({'id': pk, 'errors': {'id': ['Procedure not found.']}})
+                elif current[pk][0] == new_status:
+                    self.results.append({'id': pk, 'status': new_status, 'result': 'unchanged'})
+                else:
+                    by_status.setdefault(new_status, []).append(pk)
+                    creator = current[pk][1]
+                    updated_by_creator[creator] = updated_by_creator.get(creator, 0) + 1
+                    self.results.append({'id': pk, 'status': new_status, 'result': 'updated'})
+
+            # update() skips auto_now and the signals, so the bookkeeping is done here
+            now = timezone.now()
+            for new_status, ids in by_status.items():
+                Procedure.objects.filter(id__in=ids).update(status=new_status, updated_date=now)
+            if by_status:
+                caching.bump_versions('procedure')
+            for creator, count in updated_by_creator.items():
+                notify(creator, f"{count} procedures have been updated.")
+        return self.report()
+
+    def validate(self, item, transitions):
+        # Return the (id, status) of a valid transition, or record why it was rejected
+        if not isinstance(item, dict):
+            self.results.append({'id': None, 'errors': {'non_field_errors': ['Item must be a JSON object.']}})
+            return None
+        pk = parse_id(Procedure, item.get('id'))
+        if pk is None:
+            self.results.append({'id': item.get('id'), 'errors': {'id': ['A valid integer is required.']}})
+            return None
+        if pk in transitions:
+            self.results.append({'id': pk, 'errors': {'id': ['Procedure is listed more than once.']}})
+            return None
+        new_status = lowercase_choices(dict(item)).get('status')
+        if new_status not in STATUSES:
+            self.results.append({'id': pk, 'errors': {'status': [f'"{item.get("status")}" is not a valid choice.']}})
+            return None
+        return pk, new_status
+
+    def report(self):
+        counts = {'updated': 0, 'unchanged': 0, 'failed': 0}
+        for result in self.results:
+            counts['failed' if 'errors' in result else result['result']] += 1
+        return {**counts, 'results': self.results}
@@ -0,0 +1,283 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.module_loading import import_string
+from rest_framework.response import Response
+
+from . import counters
+from .roles import get_request_roles
+
+# Every write to these tables bumps a version counter (a sharded counter like the AdminStat
+# ones) from the signals in signals.py, or from the bulk writers, which bypass the signals.
+# A response rendered from a set of tables is unchanged as long as their versions are.
+VERSIONED_TABLES = ['patient', 'procedure', 'user']
+
+
+def version_counter(table):
+    return f'{table}_version'
+
+
+def bump_versions(*tables, amount=1):
+    # Record a write to `tables`: bump their versions, which every process checks, and drop
+    # the responses cached from them in this process right away
+    for table in tables:
+        counters.increment(version_counter(table), amount)
+        invalidate(table)
+
+
+def get_versions(tables):
+    # Versions of `tables`, and the time of the latest write to any of them
+    versions, last_updated = counters.read_counters([version_counter(table) for table in tables])
+    return versions or {}, last_updated
+
+
+async def aget_versions(tables):
+    # Async version of get_versions(), for the async views
+    versions, last_updated = await counters.aread_counters([version_counter(table) for table in tables])
+    return versions or {}, last_updated
+
+
+def get_admin_stat_validators(request, admin_stat):
+    # The stats only change along with the counters they are summed from
+    totals = [getattr(admin_stat, name) for name in counters.STAT_COUNTERS]
+    return make_etag(request, totals, admin_stat.last_updated), admin_stat.last_updated
+
+
+def make_etag(request, *parts):
+    # Strong ETag of the response to `request` given the `parts` it is rendered from. The
+    # URL and negotiated media type are part of it: the query string selects rows and fields,
+    # and the browsable API and JSON renderings differ.
+    key = repr((request.get_full_path(), request.accepted_media_type, parts))
+    return '"%s"' % md5(key.encode(), usedforsecurity=False).hexdigest()
+
+
+def get_last_modified(last_updated):
+    # Last-Modified has a resolution of one second, so it is only sent once the second of the
+    # last change is over; a later change then always falls in a later second. Until then
+    # clients revalidate with the ETag.
+    if last_updated is None or last_updated > timezone.now() - timedelta(seconds=1):
+        return None
+    return last_updated
+
+
+def not_modified(request, etag, last_updated):
+    # The 304 (or 412) response when the client's conditional headers match, else None
+    last_modified = get_last_modified(last_updated)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified and int(last_modified.timestamp()),
+    )
+    if response is None:
+        return None
+    return set_validators(response, etag, last_updated)
+
+
+def set_validators(response, etag, last_updated):
+    # Add the validators, and make (private) caches revalidate every time they reuse the response
+    response['ETag'] = etag
+    last_modified = get_last_modified(last_updated)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+class LRUResponseCache:
+    # Size-bounded, thread-safe LRU of response data in this process. Every entry is tagged
+    # with the tables it was rendered from, so a write drops exactly the entries it affects.
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, data, tables):
+        with self._lock:
+            self._entries[key] = (data, tables)
+            self._entries.move_to_end(key)
+            for table in tables:
+                self._tags.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, table):
+        # Drop the entries rendered from `table`
+        with self._lock:
+            for key in list(self._tags.get(table, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def _remove(self, key):
+        _, tables = self._entries.pop(key)
+        for table in tables:
+            self._tags[table].discard(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self).__name__,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class DjangoResponseCache:
+    # Response data in a Django cache (e.g. Redis or Memcached), shared between processes.
+    # Entries cannot be enumerated by table: writes make them unreachable through the table
+    # versions in their keys and they expire after `timeout` seconds or when the cache
+    # evicts them, which it does not report. Hits and misses are counted per process.
+    def __init__(self, alias='default', timeout=300):
+        self.alias = alias
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        data = caches[self.alias].get(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def set(self, key, data, tables):
+        caches[self.alias].set(key, data, self.timeout)
+
+    def invalidate(self, table):
+        pass
+
+    def clear(self):
+        # The cache is shared, entries of other processes or applications are left alone
+        pass
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self).__name__,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': None,
+                'invalidations': None,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def load_response_cache():
+    # The backend configured with MEDTRACK_RESPONSE_CACHE_BACKEND and _OPTIONS, or None
+    backend = getattr(settings, 'MEDTRACK_RESPONSE_CACHE_BACKEND', 'medtrack_app.caching.LRUResponseCache')
+    if not backend:
+        return None
+    return import_string(backend)(**getattr(settings, 'MEDTRACK_RESPONSE_CACHE_OPTIONS', {}))
+
+
+response_cache = load_response_cache()
+
+
+def invalidate(table):
+    if response_cache is not None:
+        response_cache.invalidate(table)
+
+
+@contextmanager
+def response_cache_disabled():
+    # Serve every list response from the database while the block runs (used by the
+    # benchmarks, which measure the query and serialization path)
+    global response_cache
+    previous, response_cache = response_cache, None
+    try:
+        yield
+    finally:
+        response_cache = previous
+
+
+def make_cache_key(request, versions):
+    # Responses are shared by callers with the same roles making the same query: the query
+    # parameters are normalized (sorted, blanks dropped) and the versions of the tables the
+    # response is rendered from keep stale entries from ever being returned. The absolute
+    # URL is part of the key because the pagination links are built from it.
+    params = sorted((name, value) for name, values in request.query_params.lists() for value in values if value)
+    roles = sorted(get_request_roles(request))
+    key = repr((request.build_absolute_uri(request.path), params, roles, sorted(versions.items())))
+    return 'medtrack:response:%s' % md5(key.encode(), usedforsecurity=False).hexdigest()
+
+
+def _list_response(request, versions, last_updated, data):
+    return set_validators(Response(data), make_etag(request, sorted(versions.items())), last_updated)
+
+
+def cached_list_response(request, tables, get_data, cache=True):
+    # Response of a list endpoint rendered from `tables`, where get_data() builds the
+    # response data. Conditional requests are answered from the table versions, repeated
+    # queries from the response cache (unless `cache` is false, e.g. for responses too large
+    # to keep); get_data() only runs on a cache miss.
+    versions, last_updated = get_versions(tables)
+    response = not_modified(request, make_etag(request, sorted(versions.items())), last_updated)
+    if response is not None:
+        return response
+
+    if response_cache is None or not cache:
+        return _list_response(request, versions, last_updated, get_data())
+    key = make_cache_key(request, versions)
+    data = response_cache.get(key)
+    if data is None:
+        data = get_data()
+        response_cache.set(key, data, tables)
+    return _list_response(request, versions, last_updated, data)
+
+
+async def acached_list_response(request, tables, get_data, cache=True):
+    # Async version of cached_list_response(), where get_data() is a coroutine function
+    versions, last_updated = await aget_versions(tables)
+    response = not_modified(request, make_etag(request, sorted(versions.items())), last_updated)
+    if response is not None:
+        return response
+
+    if response_cache is None or not cache:
+        return _list_response(request, versions, last_updated, await get_data())
+    key = make_cache_key(request, versions)
+    data = response_cache.get(key)
+    if data is None:
+        data = await get_data()
+        response_cache.set(key, data, tables)
+    return _list_response(request, versions, last_updated, data)
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Cache backends whose entries are only seen by the process that wrote them
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_auth_cache(app_configs, **kwargs):
+    # Cached users and trusted role claims are invalidated through MEDTRACK_AUTH_CACHE, so
+    # with a per-process cache a user deactivated (or whose roles changed) in one worker
+    # keeps access in the others
+    alias = getattr(settings, 'MEDTRACK_AUTH_CACHE', None)
+    if not alias:
+        return []
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend in PER_PROCESS_CACHES:
+        return [Warning(
+            f'MEDTRACK_AUTH_CACHE points at the per-process cache {alias!r} ({backend}).',
+            hint='Changes to users are only seen by the process making them. Use a cache shared '
+                 'by every process (MEDTRACK_CACHE_URL), or unset MEDTRACK_AUTH_CACHE.',
+            id='medtrack_app.W001',
+        )]
+    return []
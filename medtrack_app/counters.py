@@ -0,0 +1,119 @@
+import random
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from .models import AdminStat, ArchivedProcedure, Patient, Procedure, StatCounter
+
+# Counters exposed through AdminStat, named after its fields
+STAT_COUNTERS = ['total_patients', 'total_procedures', 'front_desk_users', 'doctor_users', 'admin_users']
+
+# Counter updated when a user is added to each group
+ROLE_COUNTERS = {
+    'Front_Desk': 'front_desk_users',
+    'Doctor': 'doctor_users',
+    'Admin': 'admin_users',
+}
+
+
+def get_shard_count():
+    return getattr(settings, 'MEDTRACK_COUNTER_SHARDS', 8)
+
+
+def increment(name, amount=1):
+    # Atomically add `amount` to a random shard of the counter. The addition happens in the
+    # database, so concurrent increments are never lost, and spreading them over shards
+    # keeps writers from queueing on a single row lock.
+    shard = random.randrange(get_shard_count())
+    shard_rows = StatCounter.objects.filter(name=name, shard=shard)
+    if shard_rows.update(value=F('value') + amount, last_updated=timezone.now()):
+        return
+
+    # First write to this shard: create it, or retry the update if another writer won the race
+    try:
+        with transaction.atomic():
+            StatCounter.objects.create(name=name, shard=shard, value=amount)
+    except IntegrityError:
+        shard_rows.update(value=F('value') + amount, last_updated=timezone.now())
+
+
+def _counter_totals(names):
+    # Shard sums per counter, with the time of each counter's latest change
+    return (
+        StatCounter.objects.filter(name__in=names)
+        .values('name')
+        .annotate(total=Sum('value'), last_updated=Max('last_updated'))
+        .order_by()
+    )
+
+
+def _combine_totals(rows, names):
+    if not rows:
+        return None, None
+
+    totals = dict.fromkeys(names, 0)
+    totals.update((row['name'], row['total']) for row in rows)
+    return totals, max(row['last_updated'] for row in rows)
+
+
+def read_counters(names=STAT_COUNTERS):
+    # Sum the shards of each counter. Returns the totals and the time of the latest change,
+    # or (None, None) when none of the counters has been written yet.
+    return _combine_totals(list(_counter_totals(names)), names)
+
+
+async def aread_counters(names=STAT_COUNTERS):
+    # Async version of read_counters(), for the async views
+    return _combine_totals([row async for row in _counter_totals(names)], names)
+
+
+def _admin_stat(totals, last_updated):
+    # Build an (unsaved) AdminStat from the counters, or None if there are no stats yet
+    if totals is None:
+        return None
+    return AdminStat(last_updated=last_updated, **totals)
+
+
+def get_admin_stat():
+    return _admin_stat(*read_counters())
+
+
+async def aget_admin_stat():
+    return _admin_stat(*await aread_counters())
+
+
+def compute_counters():
+    # Recompute every statistic from the source tables
+    totals = {
+        'total_patients': Patient.objects.count(),
+        'total_procedures': Procedure.objects.count() + ArchivedProcedure.objects.count(),
+    }
+    for group, name in ROLE_COUNTERS.items():
+        totals[name] = User.objects.filter(groups__name=group).count()
+    return totals
+
+
+@transaction.atomic
+def reconcile():
+    # Overwrite the counters with freshly computed values. The shard rows are locked first,
+    # so increments made while reconciling are applied on top of the new totals rather than
+    # being lost.
+    now = timezone.now()
+    shards = range(get_shard_count())
+    StatCounter.objects.bulk_create(
+        [StatCounter(name=name, shard=shard) for name in STAT_COUNTERS for shard in shards],
+        ignore_conflicts=True,
+    )
+    list(StatCounter.objects.select_for_update().filter(name__in=STAT_COUNTERS))
+
+    totals = compute_counters()
+    for name, value in totals.items():
+        StatCounter.objects.filter(name=name).update(value=0, last_updated=now)
+        StatCounter.objects.filter(name=name, shard=0).update(value=value)
+
+    # Keep a snapshot in the AdminStat row for the admin site
+    AdminStat.objects.update_or_create(pk=1, defaults=totals)
+    return totals
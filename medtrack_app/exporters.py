@@ -0,0 +1,139 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Patient, Procedure
+from .serializers import PatientSerializer
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+# Columns written for each export, in order
+PATIENT_EXPORT_FIELDS = list(PatientSerializer.Meta.fields)
+PROCEDURE_EXPORT_FIELDS = [
+    'id', 'patient_id', 'status', 'procedure_datetime', 'category', 'procedure_name',
+    'clinic_address', 'notes', 'report', 'created_by_id', 'created_date', 'updated_date',
+]
+
+# Rows fetched per round trip; on PostgreSQL .iterator() reads them through a server-side cursor
+EXPORT_CHUNK_SIZE = 2000
+
+# Size of the blocks the response is sent in
+BUFFER_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+_encoder = DjangoJSONEncoder()
+
+
+def parse_date_range(params, field):
+    # Filter kwargs for `start_date` / `end_date` (YYYY-MM-DD, both inclusive) on a datetime
+    # field. The bounds are turned into datetimes so the column index can be used.
+    filters = {}
+    for param, lookup, offset in (('start_date', 'gte', 0), ('end_date', 'lt', 1)):
+        value = params.get(param)
+        if not value:
+            continue
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise ValueError(f"{param} must be a date in YYYY-MM-DD format.")
+        bound = datetime.combine(day + timedelta(days=offset), time.min)
+        filters[f'{field}__{lookup}'] = timezone.make_aware(bound)
+    return filters
+
+
+def parse_choice(params, param, choices):
+    # Validate an optional filter against a field's choices
+    value = params.get(param)
+    if not value:
+        return {}
+    value = value.lower()
+    if value not in dict(choices):
+        raise ValueError(f"{param} must be one of: {', '.join(dict(choices))}.")
+    return {param: value}
+
+
+def patient_export_queryset(params):
+    # Patients to export, filtered on the date they were created
+    return Patient.objects.filter(**parse_date_range(params, 'created_date'))
+
+
+def procedure_export_queryset(params):
+    # Procedures to export, filtered on when they took place, their status and category
+    filters = parse_date_range(params, 'procedure_datetime')
+    filters.update(parse_choice(params, 'status', Procedure.STATUS_CHOICES))
+    filters.update(parse_choice(params, 'category', Procedure.CATEGORY_CHOICES))
+    return Procedure.objects.filter(**filters)
+
+
+EXPORTS = {
+    'patients': (patient_export_queryset, PATIENT_EXPORT_FIELDS),
+    'procedures': (procedure_export_queryset, PROCEDURE_EXPORT_FIELDS),
+}
+
+
+def format_value(value):
+    # Render dates the same way the JSON API does
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return _encoder.default(value)
+    return value
+
+
+def iter_csv(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow([format_value(value) for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(rows, fields):
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_export(queryset, fields, file_format, compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+    # Yield the encoded export in blocks of about BUFFER_SIZE bytes. Rows are fetched
+    # chunk_size at a time and never all held in memory, with or without gzip.
+    rows = queryset.order_by('id').values_list(*fields).iterator(chunk_size=chunk_size)
+    lines = iter_ndjson(rows, fields) if file_format == 'ndjson' else iter_csv(rows, fields)
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    block = []
+    size = 0
+    for line in lines:
+        data = line.encode()
+        block.append(data)
+        size += len(data)
+        if size >= BUFFER_SIZE:
+            data = b''.join(block)
+            block = []
+            size = 0
+            if compressor:
+                # The compressor buffers internally and may have nothing to emit yet
+                data = compressor.compress(data)
+            if data:
+                yield data
+
+    data = b''.join(block)
+    if compressor:
+        yield compressor.compress(data) + compressor.flush()
+    elif data:
+        yield data
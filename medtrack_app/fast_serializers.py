@@ -0,0 +1,117 @@
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from .models import Procedure
+from .serializers import PatientSerializer, ProcedureSerializer, read_report_base64
+
+# Field types whose to_representation() returns database values of the matching type unchanged
+PASSTHROUGH_FIELDS = (serializers.CharField, serializers.ChoiceField, serializers.IntegerField)
+
+
+def datetime_converter(field):
+    # DateTimeField.to_representation() for aware datetimes, with the current timezone looked
+    # up once instead of for every value
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if not settings.USE_TZ or hasattr(field, 'timezone') or output_format is None or output_format.lower() != ISO_8601:
+        return field.to_representation
+    field_timezone = field.default_timezone()
+
+    def convert(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+class ValuesSerializer:
+    # Read-only counterpart of a ModelSerializer for list endpoints. It renders the
+    # dictionaries of a `.values(*serializer.columns)` queryset instead of model instances,
+    # with one precomputed getter per field in place of the serializer's per-row field
+    # lookups, so the output is exactly what `serializer_class(many=True).data` renders.
+    #
+    # Nested serializers are read from `<field>__<column>` columns. SerializerMethodFields
+    # need a `get_<field>(row)` method here, reading the columns listed in the serializer's
+    # `method_field_sources`. `fields` and `expand` are passed on to the serializer.
+    # Instances are meant to serialize a single response: the timezone datetimes are
+    # rendered in is the one active when the instance is created.
+    serializer_class = None
+
+    def __init__(self, context=None, serializer=None, prefix='', **selection):
+        if serializer is None:
+            serializer = self.serializer_class(context={} if context is None else context, **selection)
+        self.serializer = serializer
+        self.context = serializer.context
+        self.columns = []
+        self.getters = [(field.field_name, self.get_getter(field, prefix)) for field in serializer._readable_fields]
+        # Keep the order, drop duplicates
+        self.columns = list(dict.fromkeys(self.columns))
+
+    def get_getter(self, field, prefix):
+        if isinstance(field, serializers.SerializerMethodField):
+            method = getattr(self, f'get_{field.field_name}', None)
+            if method is None:
+                raise ImproperlyConfigured(f'{type(self).__name__} has no get_{field.field_name}(row) method.')
+            method_sources = getattr(self.serializer, 'method_field_sources', {})
+            self.columns += [prefix + column for column in method_sources.get(field.field_name, ())]
+            return method
+
+        column = prefix + field.source.replace('.', '__')
+        self.columns.append(column)
+
+        if isinstance(field, serializers.BaseSerializer):
+            # The foreign key column is None when there is no related object
+            nested = ValuesSerializer(serializer=field, prefix=column + '__')
+            self.columns += nested.columns
+            return lambda row: None if row[column] is None else nested.to_representation(row)
+
+        if isinstance(field, serializers.FileField):
+            # DRF renders the FieldFile, so build one around the stored name
+            model_field = self.serializer.Meta.model._meta.get_field(field.source)
+            convert = lambda name: field.to_representation(model_field.attr_class(None, model_field, name))
+        elif isinstance(field, serializers.DateTimeField):
+            convert = datetime_converter(field)
+        elif isinstance(field, PASSTHROUGH_FIELDS):
+            return itemgetter(column)
+        elif isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+            # Unexpanded relations: the foreign key column holds the primary key
+            return itemgetter(column)
+        else:
+            convert = field.to_representation
+
+        def get(row):
+            value = row[column]
+            return None if value is None else convert(value)
+        return get
+
+    def values(self, queryset, *columns):
+        # The queryset's rows as dictionaries holding every column rendered, plus `columns`
+        # (e.g. what the rows are paged on)
+        return queryset.values(*dict.fromkeys([*self.columns, *columns]))
+
+    def to_representation(self, row):
+        return {name: get(row) for name, get in self.getters}
+
+    def many(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+
+class PatientValuesSerializer(ValuesSerializer):
+    serializer_class = PatientSerializer
+
+
+class ProcedureValuesSerializer(ValuesSerializer):
+    serializer_class = ProcedureSerializer
+
+    def get_report_base64(self, row):
+        # Mirrors ProcedureSerializer.get_report_base64()
+        encoded_reports = self.context.get('encoded_reports')
+        if encoded_reports is not None:
+            return encoded_reports.get(row['id'])
+        if row['report']:
+            return read_report_base64(Procedure._meta.get_field('report').storage.path(row['report']))
+        return None
@@ -0,0 +1,149 @@
+import csv
+import io
+import json
+
+from django.db import transaction
+
+from . import caching, counters
+from .models import Patient
+from .notifications import notify
+from .serializers import GENDER_ERROR, GENDER_MAPPING, PatientSerializer
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+
+class ImportFileError(ValueError):
+    # The rest of the file cannot be read (bad encoding, broken CSV quoting)
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.line = line
+        self.message = message
+
+
+def guess_format(filename, default='csv'):
+    # Work out the import format from a file name
+    name = (filename or '').lower()
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def iter_csv_rows(binary_file):
+    # Yield (line number, row dict) pairs from a CSV file with a header row. Raises
+    # ImportFileError when the file stops being readable.
+    text = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    try:
+        for row in reader:
+            yield reader.line_num, row
+    except UnicodeDecodeError:
+        # Text is decoded in blocks, so the line is where reading stopped
+        raise ImportFileError(reader.line_num + 1, 'File is not valid UTF-8 text.')
+    except csv.Error as error:
+        raise ImportFileError(reader.line_num + 1, f'Malformed CSV: {error}.')
+    finally:
+        # Leave the underlying file open for whoever owns it
+        text.detach()
+
+
+def iter_ndjson_rows(binary_file):
+    # Yield (line number, row) pairs from a file holding one JSON object per line
+    for line_number, line in enumerate(binary_file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row
+
+
+def iter_rows(binary_file, file_format):
+    if file_format == 'ndjson':
+        return iter_ndjson_rows(binary_file)
+    return iter_csv_rows(binary_file)
+
+
+class PatientImporter:
+    # Imports patients row by row from a stream. Rows are validated with the same gender
+    # mapping and PatientSerializer rules as PatientView.post and inserted in chunks, one
+    # transaction, one AdminStat update and one summary notification per chunk. Only the
+    # current chunk and the per-row errors are kept in memory. A file that cannot be read to
+    # the end is reported as an error on the line where reading stopped; the rows before it
+    # are still imported. Only the first `max_errors` row errors are kept, the rest are
+    # counted.
+    chunk_size = 500
+    max_errors = 1000
+
+    def __init__(self, created_by, chunk_size=None):
+        self.created_by = created_by
+        self.chunk_size = chunk_size or self.chunk_size
+        self.created = self.failed = 0
+        self.errors = []
+
+    def run(self, rows):
+        chunk = []
+        try:
+            for line, row in rows:
+                patient = self.validate(line, row)
+                if patient is not None:
+                    chunk.append(patient)
+                if len(chunk) >= self.chunk_size:
+                    self.save(chunk)
+                    chunk = []
+        except ImportFileError as error:
+            # Always reported, even past max_errors: it explains the rows missing at the end
+            self.failed += 1
+            self.errors.append({
+                'line': error.line,
+                'errors': {'file': [f'{error.message} Rows from this line on were not imported.']},
+            })
+        if chunk:
+            self.save(chunk)
+        return self.report()
+
+    def validate(self, line, row):
+        # Return an unsaved Patient for a valid row, or record why the row was rejected
+        if not isinstance(row, dict):
+            return self.reject(line, {'non_field_errors': ['Row must be a JSON object.']})
+
+        data = dict(row)
+        gender = data.get('gender') or ''
+        if not isinstance(gender, str):
+            return self.reject(line, {'gender': [GENDER_ERROR]})
+        gender = gender.capitalize()
+        if gender:
+            if gender not in GENDER_MAPPING:
+                return self.reject(line, {'gender': [GENDER_ERROR]})
+            data['gender'] = GENDER_MAPPING[gender]
+
+        serializer = PatientSerializer(data=data)
+        if not serializer.is_valid():
+            return self.reject(line, serializer.errors)
+        return Patient(**serializer.validated_data)
+
+    def reject(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'errors': errors})
+        return None
+
+    def save(self, patients):
+        with transaction.atomic():
+            Patient.objects.bulk_create(patients)
+            counters.increment('total_patients', len(patients))
+            caching.bump_versions('patient')
+            notify(self.created_by.id, f"{len(patients)} patient records have been imported.")
+        self.created += len(patients)
+
+    def report(self):
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            # Failed rows whose errors are not listed
+            'errors_omitted': self.failed - len(self.errors),
+        }
@@ -0,0 +1,292 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import serializers
+
+# Upper bounds (ms) of the latency histogram buckets; slower requests go in a final bucket
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Requests that did not resolve to a URL name, and names beyond the registry's bound
+UNRESOLVED = '<unresolved>'
+OTHER = '<other>'
+
+# Metrics of the request being handled. Context variables follow the request into the
+# threads sync_to_async() runs database code in, so async views are measured too.
+_current = contextvars.ContextVar('medtrack_request_metrics', default=None)
+
+
+class RequestMetrics:
+    # What one request spent, filled in while it runs
+    __slots__ = ('started', 'queries', 'query_time', 'serializer_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.serializer_time = 0.0
+
+
+def query_wrapper(execute, sql, params, many, context):
+    # Database execute wrapper counting and timing the queries of the current request
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.query_time += time.perf_counter() - started
+
+
+def install_query_wrapper(sender=None, connection=None, **kwargs):
+    # Connected to connection_created, so connections opened in any thread are measured
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+def install_query_wrappers(**kwargs):
+    # Connected to request_started, which runs in the thread the request's database code
+    # runs in (under ASGI too), to cover connections opened before instrumentation started
+    for connection in connections.all(initialized_only=True):
+        install_query_wrapper(connection=connection)
+
+
+def start_request():
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+@contextmanager
+def timed_serializer():
+    # Add the time spent in the block to the current request's serializer time
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_time += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    # Serializer mixin recording the time spent producing `.data`. Nested serializers are
+    # rendered through to_representation(), so they are counted once, by their parent.
+    @property
+    def data(self):
+        with timed_serializer():
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    # list_serializer_class of the timed serializers, for many=True
+    pass
+
+
+class EndpointStats:
+    # Fixed-size aggregate of the requests to one URL name
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.query_ms = 0.0
+        self.serializer_ms = 0.0
+        self.response_bytes = 0
+
+    def add(self, latency_ms, status_code, metrics, size):
+        self.requests += 1
+        if status_code >= 500:
+            self.errors += 1
+        self.histogram[self._bucket(latency_ms)] += 1
+        self.latency_ms += latency_ms
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+        self.queries += metrics.queries
+        self.max_queries = max(self.max_queries, metrics.queries)
+        self.query_ms += metrics.query_time * 1000
+        self.serializer_ms += metrics.serializer_time * 1000
+        self.response_bytes += size
+
+    @staticmethod
+    def _bucket(latency_ms):
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                return index
+        return len(LATENCY_BUCKETS_MS)
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the percentile (the maximum for the last bucket)
+        rank = fraction * self.requests
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= rank:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else round(self.max_latency_ms, 3)
+        return None
+
+    def snapshot(self):
+        requests = self.requests or 1
+        labels = [f'<={bound}' for bound in LATENCY_BUCKETS_MS] + [f'>{LATENCY_BUCKETS_MS[-1]}']
+        return {
+            'requests': self.requests,
+            'server_errors': self.errors,
+            'latency_ms': {
+                'mean': round(self.latency_ms / requests, 3),
+                'p50': self.percentile(0.50),
+                'p95': self.percentile(0.95),
+                'p99': self.percentile(0.99),
+                'max': round(self.max_latency_ms, 3),
+                'histogram': dict(zip(labels, self.histogram)),
+            },
+            'sql': {
+                'queries_mean': round(self.queries / requests, 2),
+                'queries_max': self.max_queries,
+                'time_ms_mean': round(self.query_ms / requests, 3),
+            },
+            'serializer_ms_mean': round(self.serializer_ms / requests, 3),
+            'response_bytes_mean': round(self.response_bytes / requests),
+        }
+
+
+class MetricsRegistry:
+    # Thread-safe map of URL name to EndpointStats. At most `max_endpoints` names are kept
+    # (URL names are a fixed set, this only guards against surprises); later names are
+    # aggregated under OTHER.
+    def __init__(self, max_endpoints):
+        self.max_endpoints = max_endpoints
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, latency_ms, status_code, metrics, size):
+        with self._lock:
+            stats = self._endpoints.get(name)
+            if stats is None:
+                if len(self._endpoints) >= self.max_endpoints:
+                    name = OTHER
+                stats = self._endpoints.setdefault(name, EndpointStats())
+            stats.add(latency_ms, status_code, metrics, size)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: stats.snapshot() for name, stats in sorted(self._endpoints.items())}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+registry = MetricsRegistry(max_endpoints=getattr(settings, 'MEDTRACK_INSTRUMENTATION_MAX_ENDPOINTS', 200))
+
+
+def server_timing(latency, metrics):
+    return (
+        f'app;dur={latency * 1000:.1f}, '
+        f'db;dur={metrics.query_time * 1000:.1f};desc="{metrics.queries} queries", '
+        f'serializer;dur={metrics.serializer_time * 1000:.1f}'
+    )
+
+
+class InstrumentationMiddleware:
+    # Opt-in (MEDTRACK_INSTRUMENTATION) per URL name request metrics: latency histogram,
+    # SQL query count and time, serializer time and response size, aggregated in `registry`
+    # and returned as a Server-Timing header when MEDTRACK_SERVER_TIMING is set.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'MEDTRACK_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'MEDTRACK_SERVER_TIMING', True)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+        connection_created.connect(install_query_wrapper, dispatch_uid='medtrack_instrumentation')
+        request_started.connect(install_query_wrappers, dispatch_uid='medtrack_instrumentation')
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        metrics, token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics, token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        match = getattr(request, 'resolver_match', None)
+        name = match.url_name if match is not None and match.url_name else UNRESOLVED
+
+        latency = time.perf_counter() - metrics.started
+        if self.server_timing:
+            response['Server-Timing'] = server_timing(latency, metrics)
+
+        if not response.streaming:
+            size = len(response.content)
+        elif response.has_header('Content-Length'):
+            # File downloads; leave the body alone so the server can still use sendfile
+            size = int(response['Content-Length'])
+        else:
+            # Generated bodies are produced after this returns: record once they are sent
+            response.streaming_content = self.count_stream(response, name, metrics)
+            return response
+        registry.record(name, latency * 1000, response.status_code, metrics, size)
+        return response
+
+    @staticmethod
+    def count_stream(response, name, metrics):
+        # Wrap the (sync or async) streaming content to measure its size and duration, and
+        # the queries run while producing it
+        content = response.streaming_content
+        status_code = response.status_code
+
+        def record(size):
+            _current.set(None)
+            latency_ms = (time.perf_counter() - metrics.started) * 1000
+            registry.record(name, latency_ms, status_code, metrics, size)
+
+        if response.is_async:
+            async def counted():
+                _current.set(metrics)
+                size = 0
+                try:
+                    async for chunk in content:
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    record(size)
+        else:
+            def counted():
+                _current.set(metrics)
+                size = 0
+                try:
+                    for chunk in content:
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    record(size)
+        return counted()
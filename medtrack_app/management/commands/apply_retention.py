@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from medtrack_app.retention import get_retention_tasks
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete notifications and archive procedures older than their retention periods '
+        '(MEDTRACK_NOTIFICATION_RETENTION_DAYS, MEDTRACK_PROCEDURE_ARCHIVE_DAYS) in short batches.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=['notifications', 'procedures'], help='Apply a single retention task.')
+        parser.add_argument('--batch-size', type=int, help='Rows per batch (MEDTRACK_RETENTION_BATCH_SIZE).')
+        parser.add_argument('--sleep', type=float, help='Seconds to pause between batches (MEDTRACK_RETENTION_SLEEP).')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches per task; the next run resumes.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be processed.')
+
+    def handle(self, *args, **options):
+        tasks = get_retention_tasks(
+            batch_size=options['batch_size'], sleep=options['sleep'], max_batches=options['max_batches'],
+        )
+        if options['only']:
+            tasks = [task for task in tasks if task.name == options['only']]
+        if not tasks:
+            raise CommandError('No retention period is configured for the selected tasks.')
+
+        for task in tasks:
+            if options['dry_run']:
+                self.stdout.write(f'{task.name}: {task.count()} rows older than {task.days} days')
+                continue
+            processed = task.run(progress=lambda processed: self.stdout.write(f'{task.name}: {processed} rows'))
+            self.stdout.write(self.style.SUCCESS(f'{task.name}: processed {processed} rows older than {task.days} days'))
@@ -0,0 +1,43 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from medtrack_app.benchmarks import EndpointBenchmark, get_endpoints
+from medtrack_app.synthetic import ROLES, synthetic_username
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure latency percentiles, query counts and peak memory of every API endpoint '
+        'against the configured database (run generate_synthetic_data first), as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per endpoint.')
+        parser.add_argument('--endpoints', nargs='+', help='Only benchmark these URL names.')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of standard output.')
+        parser.add_argument(
+            '--response-cache', action='store_true',
+            help='Leave the list response cache on, measuring cache hits rather than queries and serialization.',
+        )
+
+    def handle(self, *args, **options):
+        missing = [role for role in ROLES if not User.objects.filter(username=synthetic_username(role)).exists()]
+        if missing:
+            raise CommandError('No synthetic users for ' + ', '.join(missing) + '; run generate_synthetic_data first.')
+
+        endpoints = get_endpoints()
+        if options['endpoints']:
+            endpoints = [endpoint for endpoint in endpoints if endpoint.name in options['endpoints']]
+
+        benchmark = EndpointBenchmark(
+            iterations=options['iterations'], warmup=options['warmup'], response_cache=options['response_cache'],
+        )
+        results = json.dumps(benchmark.run(endpoints), indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(results + '\n')
+        else:
+            self.stdout.write(results)
@@ -0,0 +1,148 @@
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from medtrack_app.benchmarks import percentile
+from medtrack_app.roles import add_role_claims
+
+DEFAULT_PATHS = ['/notifications/', '/admin-stat/', '/patients/', '/procedures/']
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError(f'Server did not start listening on {host}:{port} within {timeout} seconds.')
+
+
+def run_load(url, token, total, concurrency):
+    # Send `total` GET requests with `concurrency` requests in flight and time each one
+    def fetch(_):
+        request = urllib.request.Request(url, headers={'Authorization': f'Bearer {token}'})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                ok = response.status < 400
+        except urllib.error.HTTPError as error:
+            # An empty notification list is a 404 and still a served request
+            ok = error.code == 404
+        except OSError:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(fetch, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    return {
+        'requests': total,
+        'errors': sum(1 for _, ok in results if not ok),
+        'requests_per_second': round(total / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare concurrent-request throughput of the list endpoints under a WSGI server '
+        '(gunicorn, sync views) and an ASGI server (uvicorn, async views).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', required=True, help='Admin user the requests are made as.')
+        parser.add_argument('--servers', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+        parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS)
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint.')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once.')
+        parser.add_argument('--workers', type=int, default=1, help='Server worker processes.')
+        parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker.')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument(
+            '--response-cache', action='store_true',
+            help='Leave the list response cache on in the servers, measuring cache hits.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist.")
+        token = str(add_role_claims(RefreshToken.for_user(user), user).access_token)
+
+        results = {}
+        for server in options['servers']:
+            results[server] = self.benchmark(server, token, options)
+
+        for server, endpoints in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(server))
+            for path, result in endpoints.items():
+                self.stdout.write(
+                    f"  {path:<20} {result['requests_per_second']:>8} req/s  "
+                    f"p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  "
+                    f"p99 {result['p99_ms']} ms  errors {result['errors']}"
+                )
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+
+    def benchmark(self, server, token, options):
+        host, port = '127.0.0.1', options['port']
+        command, module = self.server_command(server, host, port, options)
+        if importlib.util.find_spec(module) is None:
+            raise CommandError(f'{module} is not installed; it is needed to benchmark under {server.upper()}.')
+
+        # The ASGI entry point switches to the async views, make sure WSGI does not. Without
+        # --response-cache every request goes to the database, not the response cache.
+        env = dict(os.environ, MEDTRACK_ASYNC_VIEWS='1' if server == 'asgi' else '0')
+        if not options['response_cache']:
+            env['MEDTRACK_RESPONSE_CACHE_BACKEND'] = ''
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL)
+        try:
+            wait_for_port(host, port, timeout=30)
+            base_url = f'http://{host}:{port}'
+            # One untimed pass warms up connections and caches
+            for path in options['paths']:
+                run_load(base_url + path, token, options['concurrency'], options['concurrency'])
+            return {
+                path: run_load(base_url + path, token, options['requests'], options['concurrency'])
+                for path in options['paths']
+            }
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    @staticmethod
+    def server_command(server, host, port, options):
+        if server == 'wsgi':
+            return [
+                sys.executable, '-m', 'gunicorn', 'medtrack.wsgi:application',
+                '--bind', f'{host}:{port}', '--workers', str(options['workers']),
+                '--threads', str(options['threads']),
+            ], 'gunicorn'
+        return [
+            sys.executable, '-m', 'uvicorn', 'medtrack.asgi:application',
+            '--host', host, '--port', str(port), '--workers', str(options['workers']),
+        ], 'uvicorn'
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from medtrack_app.storage import collect_report_garbage
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete report files no procedure refers to any more, once they have been unreferenced '
+        'for MEDTRACK_REPORT_GC_GRACE seconds, in short batches.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Files per batch (MEDTRACK_REPORT_GC_BATCH_SIZE).')
+        parser.add_argument('--grace', type=int, help='Seconds a file stays after its last reference went (MEDTRACK_REPORT_GC_GRACE).')
+        parser.add_argument('--sleep', type=float, help='Seconds to pause between batches (MEDTRACK_RETENTION_SLEEP).')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches; the next run resumes.')
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running and collect every INTERVAL seconds instead of once.',
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            deleted = collect_report_garbage(
+                batch_size=options['batch_size'], grace=options['grace'], sleep=options['sleep'],
+                max_batches=options['max_batches'], progress=lambda deleted: self.stdout.write(f'{deleted} files deleted'),
+            )
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unreferenced report files'))
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,117 @@
+from itertools import takewhile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from medtrack_app.models import ArchivedProcedure, Notification, Patient, Procedure
+from medtrack_app.pagination import KeysetPagination
+from medtrack_app.fast_serializers import PatientValuesSerializer, ProcedureValuesSerializer
+from medtrack_app.serializers import NotificationSerializer
+
+
+def page_queryset(queryset, position=None):
+    # Build the queryset the API runs for one page, optionally deep into the listing
+    paginator = KeysetPagination()
+    params = {}
+    if position is not None:
+        params[paginator.cursor_query_param] = paginator.encode_cursor(position, reverse=False)
+    request = Request(RequestFactory().get('/', params))
+    return paginator.get_page_queryset(queryset, request)
+
+
+def get_list_queries():
+    # The queries behind each API list endpoint, as (label, queryset, deep) triples where
+    # `deep` marks a page read from a cursor
+    patients = PatientValuesSerializer().values(Patient.objects.all())
+    procedures = ProcedureValuesSerializer().values(Procedure.objects.all())
+    archived_procedures = ProcedureValuesSerializer().values(ArchivedProcedure.objects.all())
+    notifications = NotificationSerializer(expand=set()).setup_eager_loading(
+        Notification.objects.filter(user_id=1), 'timestamp', 'id',
+    )
+    deep_patient = ['M', 'M', 1]
+    deep_procedure = ['2024-01-01T00:00:00+00:00', 1]
+    deep_notification = ['2024-01-01T00:00:00+00:00', 1]
+    pages = [
+        ('patients', patients, deep_patient),
+        ('patients ?city=', patients.filter(city='Pune'), deep_patient),
+        ('procedures', procedures, deep_procedure),
+        ('procedures ?patient_id=', procedures.filter(patient_id=1), deep_procedure),
+        ('procedures ?archived=true', archived_procedures, deep_procedure),
+        ('procedures ?archived=true&patient_id=', archived_procedures.filter(patient_id=1), deep_procedure),
+        ('notifications', notifications, deep_notification),
+        ('notifications ?is_read=false', notifications.filter(is_read=False), deep_notification),
+    ]
+    queries = []
+    for label, queryset, position in pages:
+        queries.append((label, page_queryset(queryset), False))
+        if position is not None:
+            queries.append((f'{label} (deep page)', page_queryset(queryset, position=position), True))
+    return queries
+
+
+def plan_detail(line):
+    # The text of a SQLite plan line, without its tree drawing or its leading
+    # "id parent notused" numbers
+    return line.lstrip(' |-`0123456789')
+
+
+def is_sequential_scan(plan):
+    # Detect a full table scan in a PostgreSQL or SQLite plan
+    for line in plan.splitlines():
+        if 'Seq Scan' in line:
+            return True
+        if plan_detail(line).startswith('SCAN ') and ' USING ' not in line:
+            return True
+    return False
+
+
+def is_full_index_scan(plan):
+    # Detect an index read from one end instead of from a position: a SQLite SCAN through
+    # an index (a SEARCH is what has a range), or a PostgreSQL index scan without an Index
+    # Cond. Fine for a first page, which stops after one page of rows, but a page read from
+    # a cursor would walk every row before it.
+    lines = plan.splitlines()
+    for number, line in enumerate(lines):
+        text = plan_detail(line)
+        if text.startswith('SCAN ') and ' USING ' in text and ' INDEX ' in f'{text} ':
+            return True
+        if 'Index Scan' in line or 'Index Only Scan' in line:
+            details = takewhile(lambda detail: '->' not in detail, lines[number + 1:])
+            if not any('Index Cond:' in detail for detail in details):
+                return True
+    return False
+
+
+class Command(BaseCommand):
+    help = 'Print the query plan of every API list query, to catch missing or unused indexes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Exit with an error if any query falls back to a sequential table scan, or a '
+                 'deep page to a full index scan.',
+        )
+
+    def handle(self, *args, **options):
+        scans = []
+        for label, queryset, deep in get_list_queries():
+            plan = self.explain(queryset)
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(plan + '\n')
+            if is_sequential_scan(plan) or (deep and is_full_index_scan(plan)):
+                scans.append(label)
+
+        if options['check'] and scans:
+            raise CommandError('Sequential or full index scan in: ' + ', '.join(scans))
+
+    def explain(self, queryset):
+        # On PostgreSQL tiny tables are always scanned sequentially, so plan with sequential
+        # scans disabled to see whether an index could be used at all
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from medtrack_app.exporters import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, EXPORTS, iter_export
+
+
+class Command(BaseCommand):
+    help = 'Stream patients or procedures to a CSV or NDJSON file without loading them into memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=list(EXPORTS))
+        parser.add_argument('--output', default='-', help='File to write, or - for standard output.')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--start-date', help='Earliest date to include (YYYY-MM-DD).')
+        parser.add_argument('--end-date', help='Latest date to include (YYYY-MM-DD).')
+        parser.add_argument('--status', help='Only procedures with this status.')
+        parser.add_argument('--category', help='Only procedures in this category.')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        build_queryset, fields = EXPORTS[options['export']]
+        try:
+            queryset = build_queryset(options)
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        blocks = iter_export(
+            queryset, fields, options['format'], compress=options['gzip'], chunk_size=options['chunk_size'],
+        )
+        if options['output'] == '-':
+            sys.stdout.buffer.writelines(blocks)
+            sys.stdout.buffer.flush()
+        else:
+            with open(options['output'], 'wb') as file:
+                file.writelines(blocks)
@@ -0,0 +1,29 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from medtrack_app.synthetic import SyntheticDataGenerator
+
+
+class Command(BaseCommand):
+    help = 'Add a deterministic synthetic data set (users, patients, procedures, notifications) for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=1000)
+        parser.add_argument('--procedures-per-patient', type=int, default=5)
+        parser.add_argument('--users-per-role', type=int, default=3)
+        parser.add_argument('--notifications-per-user', type=int, default=20)
+        parser.add_argument('--reports', action='store_true', help='Attach a small PDF report to about 30%% of procedures.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=SyntheticDataGenerator.batch_size)
+
+    def handle(self, *args, **options):
+        generator = SyntheticDataGenerator(seed=options['seed'], batch_size=options['batch_size'])
+        created = generator.generate(
+            patients=options['patients'],
+            procedures_per_patient=options['procedures_per_patient'],
+            users_per_role=options['users_per_role'],
+            notifications_per_user=options['notifications_per_user'],
+            reports=options['reports'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Created {json.dumps(created)}'))
@@ -0,0 +1,33 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from medtrack_app.importers import IMPORT_FORMATS, PatientImporter, guess_format, iter_rows
+
+
+class Command(BaseCommand):
+    help = 'Import patients from a CSV or NDJSON file, validating rows like the patient API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import.')
+        parser.add_argument('--user', required=True, help='Username the import is recorded for.')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=PatientImporter.chunk_size)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist.")
+
+        file_format = options['format'] or guess_format(options['path'])
+        importer = PatientImporter(created_by=user, chunk_size=options['chunk_size'])
+        with open(options['path'], 'rb') as file:
+            report = importer.run(iter_rows(file, file_format))
+
+        for error in report['errors']:
+            self.stderr.write(f"Line {error['line']}: {json.dumps(error['errors'])}")
+        if report['errors_omitted']:
+            self.stderr.write(f"{report['errors_omitted']} more rows failed.")
+        self.stdout.write(self.style.SUCCESS(f"Imported {report['created']} patients, {report['failed']} rows failed."))
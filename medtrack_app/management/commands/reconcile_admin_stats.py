@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from medtrack_app import counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute the AdminStat counters from the patient, procedure and user tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running and reconcile every INTERVAL seconds instead of once.',
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            totals = counters.reconcile()
+            summary = ', '.join(f'{name}={value}' for name, value in totals.items())
+            self.stdout.write(self.style.SUCCESS(f'Reconciled admin stats: {summary}'))
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,26 @@
+# Generated by Django 5.1 on 2026-10-17 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medtrack_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='patient',
+            options={'ordering': ['last_name', 'first_name', 'id'], 'verbose_name': 'Patient', 'verbose_name_plural': 'Patients'},
+        ),
+        migrations.AlterModelOptions(
+            name='procedure',
+            options={'ordering': ['-procedure_datetime', 'id'], 'verbose_name': 'Procedure', 'verbose_name_plural': 'Procedures'},
+        ),
+        migrations.AlterField(
+            model_name='procedure',
+            name='report',
+            field=models.FileField(blank=True, null=True, upload_to='report/'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1 on 2026-10-17 06:33
+
+from django.db import migrations, models
+
+
+STAT_FIELDS = ['total_patients', 'total_procedures', 'front_desk_users', 'doctor_users', 'admin_users']
+
+
+def copy_admin_stat(apps, schema_editor):
+    # Seed the counters with the values accumulated in the existing AdminStat row
+    AdminStat = apps.get_model('medtrack_app', 'AdminStat')
+    StatCounter = apps.get_model('medtrack_app', 'StatCounter')
+    admin_stat = AdminStat.objects.filter(pk=1).first()
+    if admin_stat is not None:
+        StatCounter.objects.bulk_create(
+            StatCounter(name=name, shard=0, value=getattr(admin_stat, name)) for name in STAT_FIELDS
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medtrack_app', '0002_alter_patient_options_alter_procedure_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('value', models.BigIntegerField(default=0)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Statistic Counter',
+                'verbose_name_plural': 'Statistic Counters',
+                'constraints': [models.UniqueConstraint(fields=('name', 'shard'), name='unique_stat_counter_shard')],
+            },
+        ),
+        migrations.RunPython(copy_admin_stat, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1 on 2026-10-17 06:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_patient_updated_date(apps, schema_editor):
+    # Existing patients have not changed since they were created
+    Patient = apps.get_model('medtrack_app', 'Patient')
+    Patient.objects.update(updated_date=models.F('created_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medtrack_app', '0006_list_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_date', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Tombstone',
+                'verbose_name_plural': 'Tombstones',
+            },
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='updated_date',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_patient_updated_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['updated_date', 'id'], name='patient_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='procedure',
+            index=models.Index(fields=['updated_date', 'id'], name='procedure_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['model_name', 'deleted_date', 'id'], name='tombstone_sync_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1 on 2026-10-17 07:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medtrack_app', '0008_notification_read_state'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedProcedure',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('preparation', 'Preparation'), ('in-progress', 'In Progress'), ('not-done', 'Not Done'), ('on-hold', 'On Hold'), ('stopped', 'Stopped'), ('completed', 'Completed'), ('entered-in-error', 'Entered in Error'), ('unknown', 'Unknown')], max_length=20)),
+                ('procedure_datetime', models.DateTimeField()),
+                ('category', models.CharField(choices=[('psychiatry', 'Psychiatry procedure or service'), ('counseling', 'Counseling'), ('surgical', 'Surgical procedure'), ('diagnostic', 'Diagnostic procedure'), ('chiropractic', 'Chiropractic manipulation'), ('social-service', 'Social service procedure')], max_length=20)),
+                ('procedure_name', models.CharField(max_length=100)),
+                ('clinic_address', models.TextField()),
+                ('notes', models.TextField(blank=True, null=True)),
+                ('report', models.FileField(blank=True, null=True, upload_to='report/')),
+                ('created_date', models.DateTimeField()),
+                ('updated_date', models.DateTimeField()),
+                ('archived_date', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Archived Procedure',
+                'verbose_name_plural': 'Archived Procedures',
+                'ordering': ['-procedure_datetime', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['timestamp', 'id'], name='notification_retention_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedprocedure',
+            name='created_by',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedprocedure',
+            name='patient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_procedures', to='medtrack_app.patient'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedprocedure',
+            index=models.Index(fields=['-procedure_datetime', 'id'], name='archived_procedure_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedprocedure',
+            index=models.Index(fields=['patient', '-procedure_datetime', 'id'], name='archived_procedure_patient_idx'),
+        ),
+    ]
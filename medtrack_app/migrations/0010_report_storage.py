@@ -0,0 +1,54 @@
+# Generated by Django 5.1 on 2026-10-17 07:40
+
+import medtrack_app.storage
+from django.db import migrations, models
+
+
+def count_references(apps, schema_editor):
+    # Reports uploaded before content addressing keep their names; count their references
+    # so the files are collected once the last procedure using them goes
+    ReportBlob = apps.get_model('medtrack_app', 'ReportBlob')
+    counts = {}
+    for model_name in ('Procedure', 'ArchivedProcedure'):
+        model = apps.get_model('medtrack_app', model_name)
+        for name in model.objects.exclude(report='').exclude(report__isnull=True).values_list('report', flat=True).iterator():
+            counts[name] = counts.get(name, 0) + 1
+    ReportBlob.objects.bulk_create(
+        (ReportBlob(name=name, ref_count=count) for name, count in counts.items()), batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medtrack_app', '0009_retention'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedprocedure',
+            name='report',
+            field=models.FileField(blank=True, null=True, storage=medtrack_app.storage.get_report_storage, upload_to='report/'),
+        ),
+        migrations.AlterField(
+            model_name='procedure',
+            name='report',
+            field=models.FileField(blank=True, null=True, storage=medtrack_app.storage.get_report_storage, upload_to='report/'),
+        ),
+        migrations.CreateModel(
+            name='ReportBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('released_date', models.DateTimeField(blank=True, null=True)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Report Blob',
+                'verbose_name_plural': 'Report Blobs',
+                'indexes': [models.Index(condition=models.Q(('ref_count__lte', 0)), fields=['released_date', 'id'], name='report_blob_garbage_idx')],
+            },
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
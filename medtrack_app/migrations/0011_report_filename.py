@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-17 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medtrack_app', '0010_report_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedprocedure',
+            name='report_filename',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='procedure',
+            name='report_filename',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -1,7 +1,79 @@
+import os
+
+from django.core.files import File
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 
+from .storage import get_report_storage
+
+
+class ChangeTrackingMixin:
+    # Model mixin remembering the values of the columns loaded from the database, so changes
+    # can be found without reading the row again. Timestamps maintained by Django (auto_now,
+    # auto_now_add) are not tracked. The snapshot is refreshed after every save.
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    @classmethod
+    def get_tracked_fields(cls):
+        return [
+            field for field in cls._meta.concrete_fields
+            if not field.primary_key and not getattr(field, 'auto_now', False)
+            and not getattr(field, 'auto_now_add', False)
+        ]
+
+    def is_tracked(self):
+        # Whether the instance was loaded from the database (and has a snapshot)
+        return hasattr(self, '_loaded_values')
+
+    def has_loaded_value(self, name):
+        # Whether the column was loaded (not deferred) or saved, so its snapshot is known
+        return self.is_tracked() and self._meta.get_field(name).attname in self._loaded_values
+
+    def get_loaded_value(self, name):
+        # Database value of the column when the instance was loaded (or last saved)
+        return self._loaded_values.get(self._meta.get_field(name).attname)
+
+    def get_dirty_fields(self):
+        # Names of the fields changed since the instance was loaded. Untracked instances and
+        # columns that were deferred but have been set count as changed.
+        dirty = set()
+        for field in self.get_tracked_fields():
+            if field.attname not in self.__dict__:
+                continue
+            if not self.is_tracked() or field.attname not in self._loaded_values:
+                dirty.add(field.name)
+            elif self._current_value(field) != self._loaded_values[field.attname]:
+                dirty.add(field.name)
+        return dirty
+
+    def has_changed(self, name):
+        return name in self.get_dirty_fields()
+
+    def _current_value(self, field):
+        value = self.__dict__[field.attname]
+        # File fields hold a FieldFile (or an upload) around the stored name
+        return value.name if isinstance(value, File) else value
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Only the written columns are in sync with the database now; with update_fields the
+        # others keep their old snapshot and stay dirty if they were changed
+        update_fields = kwargs.get('update_fields')
+        saved = {
+            field.attname: self._current_value(field)
+            for field in self._meta.concrete_fields if field.attname in self.__dict__
+            and (update_fields is None or field.name in update_fields or field.attname in update_fields)
+        }
+        if update_fields is None:
+            self._loaded_values = saved
+        else:
+            self._loaded_values = {**getattr(self, '_loaded_values', {}), **saved}
+
 
 class Patient(models.Model):
     GENDER_CHOICES = [
@@ -24,17 +96,26 @@ class Patient(models.Model):
     emergency_contact_mobile_number = models.CharField(max_length=10)
     language = models.CharField(max_length=50)
     created_date = models.DateTimeField(auto_now_add=True)
+    updated_date = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
     class Meta:
-        ordering = ['last_name', 'first_name']
+        ordering = ['last_name', 'first_name', 'id']
+        indexes = [
+            # Default listing order and its keyset pagination
+            models.Index(fields=['last_name', 'first_name', 'id'], name='patient_name_order_idx'),
+            # ?city= filter
+            models.Index(fields=['city', 'last_name', 'first_name', 'id'], name='patient_city_idx'),
+            # Delta sync
+            models.Index(fields=['updated_date', 'id'], name='patient_updated_idx'),
+        ]
         verbose_name = _('Patient')
         verbose_name_plural = _('Patients')
 
 
-class Procedure(models.Model):
+class Procedure(ChangeTrackingMixin, models.Model):
     STATUS_CHOICES = [
         ('preparation', _('Preparation')),
         ('in-progress', _('In Progress')),
@@ -62,7 +143,9 @@ class Procedure(models.Model):
     procedure_name = models.CharField(max_length=100)
     clinic_address = models.TextField()
     notes = models.TextField(blank=True, null=True)
-    report = models.FileField(upload_to='report/', blank=True, null=True)
+    report = models.FileField(upload_to='report/', storage=get_report_storage, blank=True, null=True)
+    # Name the report was uploaded under, the stored file is named after its content
+    report_filename = models.CharField(max_length=255, blank=True, default='')
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_date = models.DateTimeField(auto_now_add=True)
     updated_date = models.DateTimeField(auto_now=True)
@@ -70,12 +153,105 @@ class Procedure(models.Model):
     def __str__(self):
         return f"{self.procedure_name} - {self.patient.first_name} {self.patient.last_name}"
 
+    def save(self, *args, **kwargs):
+        # A new upload is not stored yet and still carries the client's file name
+        if self.report and not self.report._committed:
+            self.report_filename = os.path.basename(self.report.name)[:255]
+        elif not self.report:
+            self.report_filename = ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'report' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'report_filename'}
+        super().save(*args, **kwargs)
+
     class Meta:
-        ordering = ['-procedure_datetime']
+        ordering = ['-procedure_datetime', 'id']
+        indexes = [
+            # Default listing order and its keyset pagination
+            models.Index(fields=['-procedure_datetime', 'id'], name='procedure_datetime_idx'),
+            # ?patient_id= filter in listing order
+            models.Index(fields=['patient', '-procedure_datetime', 'id'], name='procedure_patient_dt_idx'),
+            # Delta sync
+            models.Index(fields=['updated_date', 'id'], name='procedure_updated_idx'),
+        ]
         verbose_name = _('Procedure')
         verbose_name_plural = _('Procedures')
 
 
+class ArchivedProcedure(models.Model):
+    # Procedure moved out of the Procedure table by the retention command (see
+    # medtrack_app/retention.py). Ids, timestamps and report files are kept as they were,
+    # so the row reads the same through ?archived=true on the procedure list.
+    id = models.BigIntegerField(primary_key=True)
+    patient = models.ForeignKey('Patient', on_delete=models.CASCADE, related_name='archived_procedures')
+    status = models.CharField(max_length=20, choices=Procedure.STATUS_CHOICES)
+    procedure_datetime = models.DateTimeField()
+    category = models.CharField(max_length=20, choices=Procedure.CATEGORY_CHOICES)
+    procedure_name = models.CharField(max_length=100)
+    clinic_address = models.TextField()
+    notes = models.TextField(blank=True, null=True)
+    report = models.FileField(upload_to='report/', storage=get_report_storage, blank=True, null=True)
+    report_filename = models.CharField(max_length=255, blank=True, default='')
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_date = models.DateTimeField()
+    updated_date = models.DateTimeField()
+    archived_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.procedure_name} - {self.patient.first_name} {self.patient.last_name} (archived)"
+
+    class Meta:
+        ordering = ['-procedure_datetime', 'id']
+        indexes = [
+            # Listing order and its keyset pagination, with and without ?patient_id=
+            models.Index(fields=['-procedure_datetime', 'id'], name='archived_procedure_dt_idx'),
+            models.Index(fields=['patient', '-procedure_datetime', 'id'], name='archived_procedure_patient_idx'),
+        ]
+        verbose_name = _('Archived Procedure')
+        verbose_name_plural = _('Archived Procedures')
+
+
+class ReportBlob(models.Model):
+    # Reference count of a report file in the content-addressed storage (see
+    # medtrack_app/storage.py): the number of procedures, archived or not, pointing at it.
+    # Files at zero are deleted by `manage.py collect_reports` once their grace period is over.
+    name = models.CharField(max_length=100, unique=True)
+    ref_count = models.IntegerField(default=0)
+    released_date = models.DateTimeField(null=True, blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
+
+    class Meta:
+        indexes = [
+            # Garbage collection, longest released first, without visiting referenced files
+            models.Index(
+                fields=['released_date', 'id'], condition=models.Q(ref_count__lte=0),
+                name='report_blob_garbage_idx',
+            ),
+        ]
+        verbose_name = _('Report Blob')
+        verbose_name_plural = _('Report Blobs')
+
+
+class Tombstone(models.Model):
+    # Record of a deleted patient or procedure, so delta sync clients can drop their copy
+    model_name = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    deleted_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Deleted {self.model_name} {self.object_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model_name', 'deleted_date', 'id'], name='tombstone_sync_idx'),
+        ]
+        verbose_name = _('Tombstone')
+        verbose_name_plural = _('Tombstones')
+
+
 class AdminStat(models.Model):
     total_patients = models.IntegerField(default=0)
     total_procedures = models.IntegerField(default=0)
@@ -92,15 +268,61 @@ class AdminStat(models.Model):
         verbose_name_plural = _('Admin Statistics')
 
 
+class StatCounter(models.Model):
+    # One shard of a named counter behind AdminStat. Writers add to a random shard with an
+    # atomic UPDATE, so concurrent writers rarely touch the same row, and readers sum the shards.
+    name = models.CharField(max_length=50)
+    shard = models.PositiveSmallIntegerField()
+    value = models.BigIntegerField(default=0)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}[{self.shard}] = {self.value}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'shard'], name='unique_stat_counter_shard'),
+        ]
+        verbose_name = _('Statistic Counter')
+        verbose_name_plural = _('Statistic Counters')
+
+
 class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     message = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    is_read = models.BooleanField(default=False)
 
     def __str__(self):
         return f"Notification for {self.user.username} at {self.timestamp}"
     
     class Meta:
-        ordering = ['-timestamp']
+        ordering = ['-timestamp', '-id']
+        indexes = [
+            # A user's notifications, newest first, and their keyset pagination
+            models.Index(fields=['user', '-timestamp', '-id'], name='notification_user_ts_idx'),
+            # Unread counts and unread listings, without visiting the read history
+            models.Index(
+                fields=['user', '-timestamp', '-id'], condition=models.Q(is_read=False),
+                name='notification_unread_idx',
+            ),
+            # Retention, oldest first
+            models.Index(fields=['timestamp', 'id'], name='notification_retention_idx'),
+        ]
         verbose_name = _('Notification')
-        verbose_name_plural = _('Notifications')
\ No newline at end of file
+        verbose_name_plural = _('Notifications')
+
+
+class NotificationOutbox(models.Model):
+    # Notifications the background dispatcher has not written yet. Rows are inserted in the
+    # transaction of the change they report and moved to Notification by the dispatcher.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    message = models.TextField()
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Pending notification for user {self.user_id}"
+
+    class Meta:
+        verbose_name = _('Notification Outbox Entry')
+        verbose_name_plural = _('Notification Outbox')
\ No newline at end of file
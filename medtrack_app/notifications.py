@@ -0,0 +1,249 @@
+import asyncio
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Notification, NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+# Sentinel telling a worker thread to exit
+_STOP = object()
+
+
+class NotificationDispatcher:
+    # Writes notifications from a pool of background threads so that creating them does
+    # not add fan-out work to request latency. Requests insert a NotificationOutbox row in
+    # their own transaction, so a notification is stored exactly when the change it reports
+    # commits and survives crashes and restarts. Once the transaction commits a wake-up is
+    # put on a small queue; workers then claim outbox rows with SKIP LOCKED, move them to
+    # Notification with a single bulk_create and delete them. Workers also check the outbox
+    # every MEDTRACK_NOTIFICATION_OUTBOX_POLL seconds, which picks up rows left by other
+    # processes or by a process that died before its workers got to them.
+    #
+    # With MEDTRACK_NOTIFICATION_WORKERS = 0 no threads are started and outbox rows are
+    # only moved when drain() is called, which is what the tests use.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._threads = []
+
+    @property
+    def workers(self):
+        return getattr(settings, 'MEDTRACK_NOTIFICATION_WORKERS', 2)
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'MEDTRACK_NOTIFICATION_BATCH_SIZE', 100)
+
+    @property
+    def poll_interval(self):
+        return getattr(settings, 'MEDTRACK_NOTIFICATION_OUTBOX_POLL', 5)
+
+    def enqueue(self, user_id, message):
+        # Store the notification with the current transaction (if any) and wake a worker
+        # once it commits
+        NotificationOutbox.objects.create(user_id=user_id, message=message)
+        transaction.on_commit(self._wake)
+
+    def _wake(self):
+        self._ensure_started()
+        if not self._threads:
+            return
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            # Every worker already has a wake-up waiting, and each one empties the outbox
+            pass
+
+    def _ensure_started(self):
+        if self._queue is not None and len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            if self._queue is None:
+                # One pending wake-up per worker is enough
+                self._queue = queue.Queue(maxsize=max(self.workers, 1))
+                atexit.register(self.shutdown)
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work, name=f'notification-dispatcher-{len(self._threads)}', daemon=True,
+                )
+                self._threads.append(thread)
+                thread.start()
+
+    def _work(self):
+        while True:
+            try:
+                if self._queue.get(timeout=self.poll_interval) is _STOP:
+                    return
+            except queue.Empty:
+                pass
+            self._run_safely(self.flush_outbox)
+
+    @staticmethod
+    def _run_safely(function, *args):
+        # Worker threads keep their own database connection, release it after every run
+        try:
+            function(*args)
+        except Exception:
+            logger.exception('Notification dispatcher failed')
+        finally:
+            close_old_connections()
+
+    def flush_outbox(self, limit=None):
+        # Move pending outbox entries into Notification in batches. Rows claimed by another
+        # worker are skipped, and a failed batch rolls back and stays in the outbox for the
+        # next run. Returns the number moved.
+        moved = 0
+        while limit is None or moved < limit:
+            size = self.batch_size if limit is None else min(self.batch_size, limit - moved)
+            with transaction.atomic():
+                entries = list(
+                    NotificationOutbox.objects.select_for_update(skip_locked=True)
+                    .order_by('id')
+                    .values_list('id', 'user_id', 'message')[:size]
+                )
+                if not entries:
+                    break
+                notifications = Notification.objects.bulk_create(
+                    Notification(user_id=user_id, message=message) for _, user_id, message in entries
+                )
+                NotificationOutbox.objects.filter(id__in=[entry[0] for entry in entries]).delete()
+            broker.publish(notifications)
+            moved += len(entries)
+        return moved
+
+    def drain(self):
+        # Synchronously write everything in the outbox
+        self.flush_outbox()
+
+    def shutdown(self):
+        # Stop the workers; whatever they did not get to stays in the outbox for the next start
+        if self._queue is None:
+            return
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        self._threads = []
+
+
+class Subscription:
+    # Notifications pushed to one waiting client of a user (a long-poll request or an event
+    # stream) as (id, message, timestamp, is_read) entries. Clients running on an event loop wait on
+    # an asyncio.Event, set from the writing thread through the loop; others on a
+    # threading.Event. When more than `max_pending` entries pile up, or the database did not
+    # return the ids of the written rows, the entries are dropped and the subscription is
+    # marked stale: the client then reads what it missed from the database instead.
+    def __init__(self, user_id, max_pending, loop=None):
+        self.user_id = user_id
+        self.max_pending = max_pending
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._entries = []
+        self._stale = False
+        self._event = threading.Event() if loop is None else asyncio.Event()
+
+    def push(self, entries):
+        with self._lock:
+            if self._stale or len(self._entries) + len(entries) > self.max_pending or any(
+                entry[0] is None for entry in entries
+            ):
+                self._entries, self._stale = [], True
+            else:
+                self._entries += entries
+        if self._loop is None:
+            self._event.set()
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # The loop is closed, the client is gone
+            pass
+
+    def take(self):
+        # The entries pushed since the last call, and whether some were dropped
+        with self._lock:
+            entries, stale = self._entries, self._stale
+            self._entries, self._stale = [], False
+            self._event.clear()
+        return entries, stale
+
+    def wait(self, timeout):
+        # Block until something is pushed or `timeout` seconds pass; False on timeout
+        return self._event.wait(timeout)
+
+    async def wait_async(self, timeout):
+        # wait() for subscriptions made with a loop
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class NotificationBroker:
+    # In-process fan-out of the notifications this process writes to the clients of their
+    # users waiting in it, so waiting clients are woken by the write instead of each polling
+    # the database. Notifications written by other processes are not seen here: clients
+    # pick those up from the database when they reconnect or re-sync (see
+    # MEDTRACK_NOTIFICATION_STREAM_RESYNC).
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    @property
+    def max_pending(self):
+        return getattr(settings, 'MEDTRACK_NOTIFICATION_STREAM_BUFFER', 100)
+
+    def subscribe(self, user_id, loop=None):
+        subscription = Subscription(user_id, self.max_pending, loop)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, notifications):
+        # Push written Notification rows to the subscriptions of their users
+        if not self._subscriptions:
+            return
+        entries = {}
+        for notification in notifications:
+            entries.setdefault(notification.user_id, []).append(
+                (notification.id, notification.message, notification.timestamp, notification.is_read)
+            )
+        with self._lock:
+            targets = [
+                (subscription, entries[user_id])
+                for user_id in entries for subscription in self._subscriptions.get(user_id, ())
+            ]
+        for subscription, user_entries in targets:
+            subscription.push(user_entries)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+dispatcher = NotificationDispatcher()
+broker = NotificationBroker()
+
+
+def notify(user_id, message):
+    # Queue a notification for the given user
+    dispatcher.enqueue(user_id, message)
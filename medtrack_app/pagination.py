@@ -0,0 +1,170 @@
+import base64
+import binascii
+import datetime
+import decimal
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    # Cursor pagination keyed on the complete ordering of the queryset (which must end
+    # in a unique column such as 'id'). Every page is fetched with a WHERE clause on the
+    # last seen position instead of an OFFSET, so deep pages cost the same as the first.
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering=None):
+        self.ordering = ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Fetch a single page of rows and remember enough state to build the links
+        queryset = self.get_page_queryset(queryset, request)
+        return self.get_page(list(queryset))
+
+    def get_page_queryset(self, queryset, request):
+        # Build the (lazy) queryset for the requested page; one row more than the page
+        # size is fetched to find out whether another page follows
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = list(self.ordering or queryset.query.order_by or queryset.model._meta.ordering)
+        self.position, self.reverse = self.decode_cursor(request, queryset)
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = [self._invert(name) for name in ordering]
+
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self._keyset_filter(self.position))
+        return queryset[:self.page_size + 1]
+
+    def get_page(self, rows):
+        # Trim the look-ahead row and work out which neighbouring pages exist
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if self.reverse:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = self.position is not None, has_more
+
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def get_next_link(self):
+        if not (self.has_next and self.page):
+            return None
+        return self._link(self._position_of(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not (self.has_previous and self.page):
+            return None
+        return self._link(self._position_of(self.page[0]), reverse=True)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request, queryset):
+        # Cursors are opaque to clients: base64 encoded JSON holding the ordering values
+        # of the row the page starts after, plus the paging direction
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            padding = '=' * (-len(encoded) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(encoded + padding).decode('utf-8'))
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                self._get_field(queryset, name).to_python(value)
+                for name, value in zip(self._field_names(), values)
+            ]
+            return position, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError) as e:
+            raise NotFound(self.invalid_cursor_message) from e
+
+    def encode_cursor(self, position, reverse):
+        payload = {'p': [self._encode_value(value) for value in position]}
+        if reverse:
+            payload['r'] = 1
+        data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    def _link(self, position, reverse):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(position, reverse))
+
+    def _keyset_filter(self, position):
+        # Expand the row comparison (a, b, c) > (x, y, z) into a filter that honours the
+        # direction of each ordering column:
+        #   a >= x  AND  (a > x  OR  (a = x AND b > y)  OR  (a = x AND b = y AND c > z))
+        # The redundant bound on the leading column lets the database start the index scan
+        # at the cursor instead of walking every row before it.
+        query = Q()
+        equal = Q()
+        bound = None
+        for name, value in zip(self.ordering, position):
+            descending = name.startswith('-') != self.reverse
+            field = name.lstrip('-')
+            lookup = 'lt' if descending else 'gt'
+            if bound is None:
+                bound = Q(**{f'{field}__{lookup}e': value})
+            query |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return bound & query
+
+    def _position_of(self, row):
+        # Rows may be model instances or dictionaries produced by .values()
+        if isinstance(row, dict):
+            return [row[name] for name in self._field_names()]
+        return [getattr(row, name) for name in self._field_names()]
+
+    def _field_names(self):
+        return [name.lstrip('-') for name in self.ordering]
+
+    @staticmethod
+    def _get_field(queryset, name):
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(name)
+
+    @staticmethod
+    def _invert(name):
+        return name[1:] if name.startswith('-') else f'-{name}'
+
+    @staticmethod
+    def _encode_value(value):
+        # Keep full microsecond precision, the position has to match exactly
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            return value.isoformat()
+        # Decimals (such as the search rank) as strings, which JSON keeps exact
+        if isinstance(value, decimal.Decimal):
+            return str(value)
+        return value
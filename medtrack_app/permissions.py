@@ -1,16 +1,22 @@
 from rest_framework.permissions import BasePermission
+from .roles import get_request_roles
+
+class HasRole(BasePermission):
+    # Allows access only to users in the group named by `role`. Roles come from the access
+    # token or are loaded once per request, so combining permissions costs no extra queries.
+    role = None
 
-class IsDoctor(BasePermission):
-    # Allows access only to users in the 'Doctor' group.
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='Doctor')
+        return self.role in get_request_roles(request)
+
+class IsDoctor(HasRole):
+    # Allows access only to users in the 'Doctor' group.
+    role = 'Doctor'
 
-class IsAdmin(BasePermission):
+class IsAdmin(HasRole):
     # Allows access only to users in the 'Admin' group.    
-    def has_permission(self, request, view):
-        return request.user.groups.filter(name='Admin')
+    role = 'Admin'
 
-class IsFrontDesk(BasePermission):
+class IsFrontDesk(HasRole):
     # Allows access only to users in the 'Front_Desk' group.
-    def has_permission(self, request, view):
-        return request.user.groups.filter(name='Front_Desk')
+    role = 'Front_Desk'
@@ -0,0 +1,40 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .streaming import server_sent_event
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    # JSONRenderer encoding with orjson when it is installed. For the compact, non-ASCII
+    # escaping output DRF produces by default, orjson's output is byte for byte the same,
+    # except for NaN and Infinity floats, which the views using this renderer never return.
+    # Datetimes and anything else orjson does not handle natively go through DRF's encoder,
+    # and pretty printed (indented) output is left to JSONRenderer.
+    orjson_options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self.encoder_class().default, option=self.orjson_options)
+        # Escaped like JSONRenderer does, to keep the output a strict JavaScript subset
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class EventStreamRenderer(BaseRenderer):
+    # Lets views accept text/event-stream requests. The views stream the events themselves;
+    # this only renders the responses they do not stream (errors) as a single error event.
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return server_sent_event(FastJSONRenderer().render(data), event='error')
@@ -0,0 +1,137 @@
+import contextvars
+from abc import ABC, abstractmethod
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching
+from .models import ArchivedProcedure, Notification, Procedure
+
+# Set while rows are moved to an archive table: their post_delete receivers must not treat
+# the move as a deletion (remove report files, leave tombstones, bump versions per row)
+_archiving = contextvars.ContextVar('medtrack_archiving', default=False)
+
+
+def is_archiving():
+    return _archiving.get()
+
+
+@contextmanager
+def archiving():
+    token = _archiving.set(True)
+    try:
+        yield
+    finally:
+        _archiving.reset(token)
+
+
+class RetentionTask(ABC):
+    # Removes the rows of a table older than `days` days, oldest first, in batches of
+    # `batch_size` rows. Every batch is its own short transaction, so locks are only held
+    # for one batch and an interrupted run loses nothing: the next run carries on with what
+    # is left. `sleep` seconds between batches leave room for the application's own writes,
+    # and `max_batches` bounds the work done in one run. `ordering` (oldest first) must
+    # match an index on the date, so each batch is read from the index in order.
+    name = None
+    model = None
+    date_field = None
+    ordering = None
+
+    def __init__(self, days, batch_size=1000, sleep=0.0, max_batches=None):
+        self.days = days
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.max_batches = max_batches
+
+    def get_cutoff(self):
+        return timezone.now() - timedelta(days=self.days)
+
+    def get_queryset(self, cutoff):
+        # Expired rows in the order they are processed, served by an index on the date
+        return self.model.objects.filter(**{f'{self.date_field}__lt': cutoff}).order_by(*self.ordering)
+
+    def count(self):
+        return self.get_queryset(self.get_cutoff()).count()
+
+    @abstractmethod
+    def process(self, ids):
+        # Archive or delete the rows with the given ids; returns how many were
+        ...
+
+    def run(self, progress=None):
+        # Process every expired row, calling progress(processed_so_far) after each batch.
+        # The cutoff is fixed for the run, so it ends even while new rows keep expiring.
+        cutoff = self.get_cutoff()
+        processed = batches = 0
+        while self.max_batches is None or batches < self.max_batches:
+            with transaction.atomic():
+                # Rows locked by a concurrent run are left to it
+                ids = list(
+                    self.get_queryset(cutoff).select_for_update(skip_locked=True)
+                    .values_list('id', flat=True)[:self.batch_size]
+                )
+                if not ids:
+                    break
+                processed += self.process(ids)
+            batches += 1
+            if progress is not None:
+                progress(processed)
+            if len(ids) < self.batch_size:
+                break
+            if self.sleep:
+                time.sleep(self.sleep)
+        return processed
+
+
+class NotificationRetention(RetentionTask):
+    # Deletes old notifications. Nothing depends on them, so each batch is a single DELETE.
+    name = 'notifications'
+    model = Notification
+    date_field = 'timestamp'
+    # notification_retention_idx
+    ordering = ('timestamp', 'id')
+
+    def process(self, ids):
+        deleted, _ = Notification.objects.filter(id__in=ids).delete()
+        return deleted
+
+
+class ProcedureArchiver(RetentionTask):
+    # Moves procedures whose procedure date is older than the retention period to the
+    # ArchivedProcedure table, keeping their ids and report files
+    name = 'procedures'
+    model = Procedure
+    date_field = 'procedure_datetime'
+    # procedure_datetime_idx, scanned backward
+    ordering = ('procedure_datetime', '-id')
+
+    def process(self, ids):
+        procedures = list(Procedure.objects.filter(id__in=ids))
+        fields = [field.attname for field in Procedure._meta.concrete_fields]
+        ArchivedProcedure.objects.bulk_create(
+            ArchivedProcedure(**{name: getattr(procedure, name) for name in fields}) for procedure in procedures
+        )
+        with archiving():
+            Procedure.objects.filter(id__in=ids).delete()
+        # The moved rows leave the procedure list and join the archived one
+        caching.bump_versions('procedure')
+        return len(procedures)
+
+
+def get_retention_tasks(batch_size=None, sleep=None, max_batches=None):
+    # The retention tasks enabled in the settings
+    batch_size = batch_size or getattr(settings, 'MEDTRACK_RETENTION_BATCH_SIZE', 1000)
+    sleep = getattr(settings, 'MEDTRACK_RETENTION_SLEEP', 0.1) if sleep is None else sleep
+    tasks = []
+    for task_class, setting in (
+        (NotificationRetention, 'MEDTRACK_NOTIFICATION_RETENTION_DAYS'),
+        (ProcedureArchiver, 'MEDTRACK_PROCEDURE_ARCHIVE_DAYS'),
+    ):
+        days = getattr(settings, setting, None)
+        if days is not None:
+            tasks.append(task_class(days, batch_size=batch_size, sleep=sleep, max_batches=max_batches))
+    return tasks
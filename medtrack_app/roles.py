@@ -0,0 +1,82 @@
+import time
+
+# JWT claims carrying the user's group names and when they were read, set at login
+ROLES_CLAIM = 'roles'
+ROLES_ISSUED_CLAIM = 'roles_iat'
+
+
+def get_roles(user):
+    # Names of the user's groups in group id order. They are loaded at most once per user
+    # object, which lives for a single request, and reuse prefetched groups when present.
+    if not user or not user.is_authenticated:
+        return ()
+
+    roles = getattr(user, '_medtrack_roles', None)
+    if roles is None:
+        prefetched = getattr(user, '_prefetched_objects_cache', {}).get('groups')
+        if prefetched is not None:
+            roles = tuple(group.name for group in sorted(prefetched, key=lambda group: group.pk))
+        else:
+            roles = tuple(user.groups.order_by('pk').values_list('name', flat=True))
+        user._medtrack_roles = roles
+    return roles
+
+
+def get_role(user):
+    # The user's primary role (their first group), or None when they have no group
+    roles = get_roles(user)
+    return roles[0] if roles else None
+
+
+def get_request_roles(request):
+    # Roles of the user making the request. The roles claim of the access token is used
+    # without loading the groups unless the user changed after it was issued.
+    token = request.auth
+    claim = token.get(ROLES_CLAIM) if hasattr(token, 'get') else None
+    if claim is not None and not roles_changed_since(request.user, token.get(ROLES_ISSUED_CLAIM)):
+        return tuple(claim)
+    return get_roles(request.user)
+
+
+def add_role_claims(token, user):
+    # Store the user's roles in a (refresh) token; access tokens derived from it copy them.
+    # The user's auth versions are set first if missing, so the claim is issued after them.
+    from .authentication import get_auth_version
+
+    get_auth_version(user.pk)
+    token[ROLES_CLAIM] = list(get_roles(user))
+    token[ROLES_ISSUED_CLAIM] = time.time()
+    return token
+
+
+def roles_changed_since(user, issued_at):
+    # Whether the user's auth version changed after `issued_at`. The change time comes from
+    # the shared cache (see authentication.get_auth_version()), normally already read by the
+    # authentication of the request, so trusting the claim costs no query. Without a shared
+    # cache changes made by other processes cannot be seen, so the claim is never trusted.
+    from .authentication import get_auth_version
+
+    if hasattr(user, '_medtrack_auth_changed'):
+        last_changed = user._medtrack_auth_changed
+    else:
+        auth_version = get_auth_version(user.pk)
+        if auth_version is None:
+            return True
+        _, last_changed = auth_version
+    return issued_at is None or last_changed > issued_at
+
+
+def invalidate_roles(users=None):
+    # Forget cached roles after a group membership change. `users` are user objects or
+    # ids; None means membership changed for users we cannot enumerate. Bumping their auth
+    # version also stops tokens issued before the change from being trusted.
+    from .authentication import invalidate_users
+
+    if users is None:
+        invalidate_users()
+        return
+
+    for user in users:
+        if hasattr(user, '_medtrack_roles'):
+            del user._medtrack_roles
+    invalidate_users([getattr(user, 'pk', user) for user in users])
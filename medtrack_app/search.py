@@ -0,0 +1,81 @@
+from abc import ABC, abstractmethod
+
+from django.db import connections
+from django.db.models import Case, DecimalField, FloatField, Q, Value, When
+from django.db.models.functions import Cast, Greatest, Round, Upper
+
+# Patient columns covered by patient search. On PostgreSQL each one has a pg_trgm GIN
+# index on UPPER(column) (see migration 0005) that serves the icontains filters, so only
+# the matching rows are ranked.
+PATIENT_SEARCH_FIELDS = ['first_name', 'last_name', 'mobile_number', 'email', 'city']
+
+
+class PatientSearchBackend(ABC):
+    # Filters patients matching every term of the query in at least one of the search
+    # fields and annotates each row with a `rank`, higher meaning more relevant. The rank
+    # is rounded to a fixed precision decimal: lists are keyset paged on it, and a float
+    # (float4 on PostgreSQL) may not compare equal to itself once it went through a cursor.
+    fields = PATIENT_SEARCH_FIELDS
+
+    def search(self, queryset, query):
+        terms = query.split()
+        if not terms:
+            return queryset.annotate(rank=self.as_rank(Value(0.0, output_field=FloatField())))
+
+        matches = Q()
+        for term in terms:
+            term_matches = Q()
+            for field in self.fields:
+                term_matches |= Q(**{f'{field}__icontains': term})
+            matches &= term_matches
+
+        return queryset.filter(matches).annotate(rank=self.as_rank(self.rank(query, terms)))
+
+    @abstractmethod
+    def rank(self, query, terms):
+        # Expression scoring how well a row matches the query
+        ...
+
+    @staticmethod
+    def as_rank(expression):
+        return Cast(Round(expression, 6), DecimalField(max_digits=12, decimal_places=6))
+
+
+class PostgresPatientSearchBackend(PatientSearchBackend):
+    # Ranks by trigram similarity between the whole query and the best matching field
+
+    def rank(self, query, terms):
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        similarities = [TrigramSimilarity(Upper(field), query.upper()) for field in self.fields]
+        return Greatest(*similarities, output_field=FloatField())
+
+
+class FallbackPatientSearchBackend(PatientSearchBackend):
+    # Portable ranking for databases without pg_trgm (SQLite in local runs and tests):
+    # exact matches score highest, then prefix matches, then substring matches.
+
+    def rank(self, query, terms):
+        score = Value(0.0, output_field=FloatField())
+        for term in terms:
+            for field in self.fields:
+                score = score + Case(
+                    When(**{f'{field}__iexact': term}, then=Value(3.0)),
+                    When(**{f'{field}__istartswith': term}, then=Value(2.0)),
+                    When(**{f'{field}__icontains': term}, then=Value(1.0)),
+                    default=Value(0.0),
+                    output_field=FloatField(),
+                )
+        return score
+
+
+def get_search_backend(using='default'):
+    # Pick the search backend matching the database the queryset runs on
+    if connections[using].vendor == 'postgresql':
+        return PostgresPatientSearchBackend()
+    return FallbackPatientSearchBackend()
+
+
+def search_patients(queryset, query):
+    # Shared entry point for the API and the admin
+    return get_search_backend(queryset.db).search(queryset, query)
@@ -1,12 +1,96 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User, Group
 from .models import Patient, Procedure, AdminStat, Notification
+from .instrumentation import TimedListSerializer, TimedSerializerMixin
 from django.utils import timezone
 import re
 import base64
 
+# Read a report file and return its content base64 encoded
+def read_report_base64(path):
+    with open(path.replace('\\', '/'), 'rb') as file:
+        return base64.b64encode(file.read()).decode('utf-8')
+
+# Parse the `fields` and `expand` query parameters into keyword arguments for the
+# SparseFieldsMixin serializers. `fields=id,status,patient.city` selects fields, a dotted
+# name selects fields of a relation (and expands it); `expand=patient` nests a relation.
+def parse_field_selection(query_params):
+    selection = {}
+    if query_params.get('fields'):
+        fields = {}
+        for name in query_params['fields'].split(','):
+            name, _, nested = name.strip().partition('.')
+            if not name:
+                continue
+            if not nested:
+                fields[name] = None
+            elif name not in fields or fields[name] is not None:
+                fields.setdefault(name, set()).add(nested)
+        selection['fields'] = fields
+    if query_params.get('expand'):
+        selection['expand'] = {name.strip() for name in query_params['expand'].split(',') if name.strip()}
+    return selection
+
+# Columns and relations a serializer reads, as only() and select_related() arguments
+def get_field_sources(serializer, prefix=''):
+    columns, related = [], []
+    for field in serializer._readable_fields:
+        if isinstance(field, serializers.SerializerMethodField):
+            method_sources = getattr(serializer, 'method_field_sources', {})
+            columns += [prefix + name for name in method_sources.get(field.field_name, ())]
+            continue
+        source = prefix + field.source.replace('.', '__')
+        columns.append(source)
+        if isinstance(field, serializers.BaseSerializer):
+            nested_columns, nested_related = get_field_sources(field, source + '__')
+            columns += nested_columns
+            related += [source, *nested_related]
+    return columns, related
+
+# Serializer mixin for sparse fieldsets and optional expansion of nested relations. Without
+# `fields` and `expand` the serializer renders as declared. With either of them, only the
+# selected fields are rendered (all fields when `fields` is not given) and nested relations
+# are rendered as primary keys unless expanded.
+class SparseFieldsMixin:
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None or expand is not None:
+            self.select_fields(fields, set(expand or ()))
+
+    def select_fields(self, fields, expand):
+        if fields is not None:
+            expand |= {name for name, nested in fields.items() if nested is not None}
+        nested_fields = {name for name, field in self.fields.items() if isinstance(field, serializers.BaseSerializer)}
+
+        unknown = set(fields or ()) - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError({"fields": f"Unknown field(s): {', '.join(sorted(unknown))}."})
+        unknown = expand - nested_fields
+        if unknown:
+            raise serializers.ValidationError({"expand": f"Cannot expand: {', '.join(sorted(unknown))}."})
+
+        for name in list(self.fields):
+            if fields is not None and name not in fields and name not in expand:
+                self.fields.pop(name)
+            elif name in expand:
+                nested = (fields or {}).get(name)
+                if nested is not None:
+                    self.fields[name].select_fields(dict.fromkeys(nested), set())
+            elif name in nested_fields:
+                self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    # Load only the columns of the rendered fields, with the nested relations joined in, so
+    # a narrower selection means a narrower query and listing costs a constant number of
+    # queries. `columns` are loaded as well, e.g. what the rows are ordered by.
+    def setup_eager_loading(self, queryset, *columns):
+        sources, related = get_field_sources(self)
+        if related:
+            # Without arguments select_related() would follow every foreign key
+            queryset = queryset.select_related(*related)
+        return queryset.only(*sources, *columns)
+
 # Serializer for the User model
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     # Custom field to accept role during user creation
     role = serializers.CharField(write_only=True)
 
@@ -73,19 +157,32 @@ class UserSerializer(serializers.ModelSerializer):
 
         return user
 
+# Accepted gender inputs, full names and abbreviations (after capitalizing), mapped to the stored value
+GENDER_MAPPING = {
+    'M': 'Male',
+    'F': 'Female',
+    'O': 'Other',
+    'Male': 'Male',
+    'Female': 'Female',
+    'Other': 'Other'
+}
+GENDER_ERROR = "Gender must be one of the following: Male, Female, Others or M, F, O"
+
 # Serializer for the Patient model
-class PatientSerializer(serializers.ModelSerializer):
+class PatientSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Patient
+        list_serializer_class = TimedListSerializer
         fields = [
             'id', 'first_name', 'last_name', 'mobile_number', 'address',
             'gender', 'birthdate', 'email', 'city', 'state', 'pincode',
-            'emergency_contact_name', 'emergency_contact_mobile_number', 'language', 'created_date'
+            'emergency_contact_name', 'emergency_contact_mobile_number', 'language', 'created_date', 'updated_date'
         ]
 
-        # `created_date` should be read-only as it's set automatically
+        # `created_date` and `updated_date` should be read-only as they're set automatically
         extra_kwargs = {
-            'created_date': {'read_only': True}
+            'created_date': {'read_only': True},
+            'updated_date': {'read_only': True},
         } 
 
     # Custom validation for the Patient model fields
@@ -113,14 +210,17 @@ class PatientSerializer(serializers.ModelSerializer):
         return data
 
 # Serializer for the Procedure model
-class ProcedureSerializer(serializers.ModelSerializer):
+class ProcedureSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     # Include nested serializers for patient and created_by fields
     patient = PatientSerializer(read_only=True)
     created_by = UserSerializer(read_only=True)
     report_base64 = serializers.SerializerMethodField()
+    # Columns read by the method fields
+    method_field_sources = {'report_base64': ['id', 'report']}
 
     class Meta:
         model = Procedure
+        list_serializer_class = TimedListSerializer
         fields = [
             'id', 'patient', 'status', 'procedure_datetime', 'category',
             'procedure_name', 'clinic_address', 'notes', 'report', 'report_base64', 'created_by', 'created_date', 'updated_date'
@@ -132,6 +232,14 @@ class ProcedureSerializer(serializers.ModelSerializer):
             'updated_date': {'read_only': True},
         } 
 
+    def __init__(self, *args, **kwargs):
+        selected = kwargs.get('fields') or ()
+        super().__init__(*args, **kwargs)
+        # Inlining the report as base64 reads the whole file, so it is only done on request
+        # (with ?report_base64=true or by selecting the field)
+        if not self.context.get('include_report_base64') and 'report_base64' not in selected:
+            self.fields.pop('report_base64', None)
+
     # Custom validation for the Procedure model fields
     def validate(self, data):
         # Validate the procedure_datetime field to ensure it is not in the future
@@ -147,17 +255,29 @@ class ProcedureSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError({"report": "Only PDF files are accepted."})
 
         return data
+
+    def update(self, instance, validated_data):
+        # Write only the columns that changed (plus updated_date). A PUT that changes nothing
+        # writes nothing: updated_date is left as it was and no update notification is sent
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        changed = instance.get_dirty_fields()
+        if changed:
+            instance.save(update_fields=[*changed, 'updated_date'])
+        return instance
     
     def get_report_base64(self, obj):
     # Return the base64-encoded string of the report file, if it exists
+        # Async views read the files beforehand, without blocking, and pass them in the context
+        encoded_reports = self.context.get('encoded_reports')
+        if encoded_reports is not None:
+            return encoded_reports.get(obj.pk)
         if obj.report:
-            with open(obj.report.path.replace('\\', '/'), 'rb') as file:
-                file_content = file.read()
-                return base64.b64encode(file_content).decode('utf-8')
+            return read_report_base64(obj.report.path)
         return None
     
 # Serializer for the AdminStat model
-class AdminStatSerializer(serializers.ModelSerializer):
+class AdminStatSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = AdminStat
         fields = [
@@ -166,9 +286,35 @@ class AdminStatSerializer(serializers.ModelSerializer):
         ]
 
 # Serializer for the Notification model
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer()
 
     class Meta:
         model = Notification
-        fields = ['id', 'user', 'message', 'timestamp']
+        list_serializer_class = TimedListSerializer
+        fields = ['id', 'user', 'message', 'timestamp', 'is_read']
+
+# Serializer for bulk actions on the notifications of a user: the notifications listed in
+# `ids`, those up to `before`, both, or all of them with `all`
+class NotificationBulkActionSerializer(serializers.Serializer):
+    ACTIONS = ['read', 'unread', 'delete']
+    MAX_IDS = 1000
+
+    action = serializers.ChoiceField(choices=ACTIONS)
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False, max_length=MAX_IDS)
+    before = serializers.DateTimeField(required=False)
+    all = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, data):
+        # Acting on everything has to be asked for explicitly
+        if 'ids' not in data and 'before' not in data and not data['all']:
+            raise serializers.ValidationError("Provide ids, before or all.")
+        return data
+
+    # Filter a user's notifications down to the selected ones
+    def filter(self, queryset):
+        if 'ids' in self.validated_data:
+            queryset = queryset.filter(id__in=self.validated_data['ids'])
+        if 'before' in self.validated_data:
+            queryset = queryset.filter(timestamp__lte=self.validated_data['before'])
+        return queryset
@@ -1,75 +1,123 @@
 from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, Group
 from django.dispatch import receiver, Signal
-from .models import Procedure, Notification, AdminStat
-import os
+from .models import ArchivedProcedure, Patient, Procedure, Tombstone
+from .authentication import invalidate_users
+from .notifications import notify
+from . import caching, counters, retention, roles, storage
 
 # Custom signal to indicate when a patient is created
 patient_created = Signal()
 
-# Signal receiver to update role counts in AdminStat when users are added to groups
+# Signal receiver to update role counts in AdminStat when users are added to groups,
+# and to invalidate cached roles whenever group membership changes
 @receiver(m2m_changed, sender=User.groups.through)
-def role_count_update(sender, instance, action, **kwargs):
+def role_count_update(sender, instance, action, reverse, pk_set, **kwargs):
+    # Cached and token-borne roles of the affected users are no longer valid
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        roles.invalidate_roles([instance] if not reverse else pk_set)
+
     # Triggered when the 'groups' field of User model is changed
-    if action == 'post_add':
-        admin_stat, _ = AdminStat.objects.get_or_create(pk=1)
-        group = instance.groups.first().name
-        # Update counts based on the user's group
-        if group == 'Front_Desk':
-            admin_stat.front_desk_users += 1
-        elif group == 'Doctor':
-            admin_stat.doctor_users += 1
-        elif group == 'Admin':
-            admin_stat.admin_users += 1
-        admin_stat.save()
+    if action == 'post_add' and pk_set:
+        if reverse:
+            # Users were added to a group through group.user_set
+            added = {instance.name: len(pk_set)}
+        else:
+            added = {name: 1 for name in Group.objects.filter(pk__in=pk_set).values_list('name', flat=True)}
+
+        # Update counts based on the groups the users were added to
+        for group, amount in added.items():
+            if group in counters.ROLE_COUNTERS:
+                counters.increment(counters.ROLE_COUNTERS[group], amount)
+
+# Signal receiver to drop cached copies of a user when it is saved (e.g. deactivated or
+# given a new password) or deleted
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_users([instance.pk])
+
+# Signal receiver to bump the version of the table behind cached and conditional API
+# responses on every write, and drop the cached responses rendered from it. Logins only
+# touch last_login, which no response renders, and the archiver bumps once per batch.
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=Procedure)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Procedure)
+@receiver(post_delete, sender=User)
+def bump_table_version(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    if retention.is_archiving():
+        return
+    caching.bump_versions(sender._meta.model_name)
 
 # Signal receiver to handle actions when a patient is created
 @receiver(patient_created)
 def handle_patient_created(sender, patient, created_by, **kwargs):
-    # Create a notification for the user who created the patient record
-    Notification.objects.create(
-        user=created_by,
-        message=f"A new patient record for {patient.first_name} {patient.last_name} has been created."
-    )
+    # Queue a notification for the user who created the patient record
+    notify(created_by.id, f"A new patient record for {patient.first_name} {patient.last_name} has been created.")
 
     # Update the total patient count in AdminStat
-    admin_stat, _ = AdminStat.objects.get_or_create(pk=1)
-    admin_stat.total_patients += 1
-    admin_stat.save()
+    counters.increment('total_patients')
 
 # Signal receiver to handle actions when a Procedure is created or updated
 @receiver(post_save, sender=Procedure)
 def procedure_created_or_updated(sender, instance, created, **kwargs):
-    # Create a notification for the user who created or updated the procedure
-    Notification.objects.create(
-        user=User.objects.get(id=instance.created_by_id),
-        message=f"A procedure {instance.procedure_name} for patient {instance.patient.first_name} {instance.patient.last_name} has been " + ('created.' if created else 'updated.')
+    # Saves that changed nothing are not worth a notification
+    if not created and instance.is_tracked() and not instance.get_dirty_fields():
+        return
+
+    # Queue a notification for the user who created or updated the procedure. The views
+    # load the patient along with the procedure, so formatting the message needs no query.
+    patient = instance.patient
+    notify(
+        instance.created_by_id,
+        f"A procedure {instance.procedure_name} for patient {patient.first_name} {patient.last_name} has been " + ('created.' if created else 'updated.')
     )
 
     # Update the total procedure count in AdminStat if the procedure was newly created
     if created:
-        admin_stat, _ = AdminStat.objects.get_or_create(pk=1)
-        admin_stat.total_procedures += 1
-        admin_stat.save()
+        counters.increment('total_procedures')
 
-# Signal receiver to delete the old file when a Procedure is updated with a new file
+# Signal receivers to count the procedures referring to each report file. Reports are
+# stored by content and shared between procedures, so no file is removed here: files left
+# without references are deleted in the background by `manage.py collect_reports`, keeping
+# file system work out of the request. The old file of an update is noted before the save.
 @receiver(pre_save, sender=Procedure)
-def delete_old_file_on_update(sender, instance, **kwargs):
-    # Check if this is an update (existing procedure)
-    if instance.pk:
-        try:
-            old_file = Procedure.objects.get(pk=instance.pk).report
-        except Procedure.DoesNotExist:
-            return
-        else:
-            # Check if the old file exists and is different from the new one
-            if old_file and old_file != instance.report:
-                if os.path.isfile(old_file.path):
-                    os.remove(old_file.path)
+def note_old_report(sender, instance, **kwargs):
+    if not instance.pk:
+        instance._old_report = None
+    elif instance.has_loaded_value('report'):
+        # Procedures loaded from the database know their old file without a query, unless
+        # the report column was deferred
+        instance._old_report = instance.get_loaded_value('report') or None
+    else:
+        instance._old_report = Procedure.objects.filter(pk=instance.pk).values_list('report', flat=True).first()
+
+@receiver(post_save, sender=Procedure)
+def update_report_references(sender, instance, created, **kwargs):
+    old_name = None if created else getattr(instance, '_old_report', None)
+    new_name = instance.report.name or None
+    if old_name != new_name:
+        storage.release_references([old_name])
+        storage.add_references([new_name])
+
+# Archived procedures keep the file of the procedure, so archiving moves the reference
+@receiver(post_delete, sender=Procedure)
+@receiver(post_delete, sender=ArchivedProcedure)
+def release_report_on_delete(sender, instance, **kwargs):
+    if retention.is_archiving():
+        return
+    storage.release_references([instance.report.name])
 
-# Signal receiver to delete the report file from the filesystem when a Procedure is deleted
+# Signal receiver to leave a tombstone for delta sync clients when a Patient or Procedure
+# is deleted, including procedures removed along with their patient. Archived procedures
+# are still on record, clients keep their copy.
+@receiver(post_delete, sender=Patient)
 @receiver(post_delete, sender=Procedure)
-def delete_file_on_delete(sender, instance, **kwargs):
-    if instance.report:
-        if os.path.isfile(instance.report.path):
-            os.remove(instance.report.path)
\ No newline at end of file
+def record_tombstone(sender, instance, **kwargs):
+    if retention.is_archiving():
+        return
+    Tombstone.objects.create(model_name=sender._meta.model_name, object_id=instance.pk)
\ No newline at end of file
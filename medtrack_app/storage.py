@@ -0,0 +1,150 @@
+import hashlib
+import os
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+def get_report_storage():
+    # Storage of the report files (STORAGES['reports']), resolved when the field is used so
+    # tests and deployments can swap it in the settings
+    return storages['reports']
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    # File system storage that names files after the SHA-256 of their content, so identical
+    # uploads are stored once: report/<first two hex digits>/<digest>.pdf. The content is
+    # hashed while it is streamed to a temporary file next to its final location, which is
+    # then moved into place, or dropped when the same content is already stored. Files are
+    # shared between rows, so they are never deleted directly: ReportBlob counts the rows
+    # referencing each file and collect_report_garbage() removes the unreferenced ones.
+    # The name the file was uploaded under is kept by the row (Procedure.report_filename).
+    def get_available_name(self, name, max_length=None):
+        # The final name depends on the content only and may already exist
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        staging = self.path(directory)
+        os.makedirs(staging, exist_ok=True)
+
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=staging, prefix='.upload-', delete=False) as temporary:
+            try:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temporary.write(chunk)
+            except BaseException:
+                temporary.close()
+                os.remove(temporary.name)
+                raise
+
+        hexdigest = digest.hexdigest()
+        name = os.path.join(directory, hexdigest[:2], hexdigest + extension).replace('\\', '/')
+        full_path = self.path(name)
+        # Restart the grace period of an existing, possibly released, copy before relying on
+        # it. The update waits for a collector holding the row, which removes the file before
+        # it lets go, so a file still there afterwards stays until the new reference is counted.
+        if os.path.exists(full_path):
+            self.touch(name)
+            if os.path.exists(full_path):
+                os.remove(temporary.name)
+                return name
+
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        file_move_safe(temporary.name, full_path, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    @staticmethod
+    def touch(name):
+        from .models import ReportBlob
+
+        ReportBlob.objects.filter(name=name).update(released_date=timezone.now())
+
+
+def add_references(names, amount=1):
+    # Record `amount` more (or, when negative, fewer) rows referencing each named file, with
+    # one UPDATE per distinct number of occurrences in `names`
+    from .models import ReportBlob
+
+    occurrences = Counter(name for name in names if name)
+    if not occurrences:
+        return
+    ReportBlob.objects.bulk_create([ReportBlob(name=name) for name in occurrences], ignore_conflicts=True)
+    by_count = {}
+    for name, count in occurrences.items():
+        by_count.setdefault(count, []).append(name)
+    for count, grouped in by_count.items():
+        updates = {'ref_count': F('ref_count') + count * amount}
+        if amount < 0:
+            # Unreferenced files are collected once they have been released for a while
+            updates['released_date'] = timezone.now()
+        ReportBlob.objects.filter(name__in=grouped).update(**updates)
+
+
+def release_references(names):
+    add_references(names, amount=-1)
+
+
+def collect_report_garbage(batch_size=None, grace=None, sleep=None, max_batches=None, progress=None):
+    # Delete the files no row references any more, in batches of `batch_size`, each in its
+    # own short transaction and `sleep` seconds apart, like the retention tasks. Files
+    # released less than `grace` seconds ago are kept, as a reference may be on its way in a
+    # transaction that has not committed yet. Each batch checks the procedure tables before
+    # deleting, which also repairs counts missed by writes that bypass the signals. Files are
+    # removed while the rows are still locked, see ContentAddressedStorage._save(); a batch
+    # rolled back after that leaves rows without files, which the next run deletes. Returns
+    # the number of files deleted.
+    from .models import ArchivedProcedure, Procedure, ReportBlob
+
+    batch_size = batch_size or getattr(settings, 'MEDTRACK_REPORT_GC_BATCH_SIZE', 500)
+    grace = getattr(settings, 'MEDTRACK_REPORT_GC_GRACE', 3600) if grace is None else grace
+    sleep = getattr(settings, 'MEDTRACK_RETENTION_SLEEP', 0.1) if sleep is None else sleep
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    storage = get_report_storage()
+
+    deleted = batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            blobs = list(
+                ReportBlob.objects.select_for_update(skip_locked=True)
+                .filter(ref_count__lte=0, released_date__lt=cutoff).order_by('released_date', 'id')
+                .values_list('id', 'name')[:batch_size]
+            )
+            if not blobs:
+                break
+
+            names = [name for _, name in blobs]
+            referenced = {}
+            for model in (Procedure, ArchivedProcedure):
+                for name in model.objects.filter(report__in=names).values_list('report', flat=True):
+                    referenced[name] = referenced.get(name, 0) + 1
+            for name, count in referenced.items():
+                ReportBlob.objects.filter(name=name).update(ref_count=count)
+
+            garbage = [(pk, name) for pk, name in blobs if name not in referenced]
+            ReportBlob.objects.filter(id__in=[pk for pk, _ in garbage]).delete()
+            for _, name in garbage:
+                storage.delete(name)
+        deleted += len(garbage)
+        batches += 1
+        if progress is not None:
+            progress(deleted)
+        if len(blobs) < batch_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+    return deleted
@@ -0,0 +1,148 @@
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+# Size of the blocks files are read and sent in
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Marks the end of a synchronous iterator read from async code
+_DONE = object()
+
+
+def server_sent_event(data, event=None, event_id=None):
+    # One text/event-stream frame carrying the already encoded `data` (bytes)
+    lines = []
+    if event_id is not None:
+        lines.append(b'id: %d' % event_id)
+    if event is not None:
+        lines.append(b'event: ' + event.encode())
+    lines += [b'data: ' + line for line in data.splitlines()]
+    return b'\n'.join(lines) + b'\n\n'
+
+
+async def aiter_in_thread(iterator):
+    # Async iterator over a synchronous one, pulling one chunk at a time through
+    # sync_to_async. All chunks are produced in the same thread, so iterators holding a
+    # database cursor keep using one connection.
+    iterator = iter(iterator)
+    try:
+        while True:
+            chunk = await sync_to_async(next)(iterator, _DONE)
+            if chunk is _DONE:
+                return
+            yield chunk
+    finally:
+        if hasattr(iterator, 'close'):
+            await sync_to_async(iterator.close)()
+
+
+def stream_for(request, response):
+    # Under ASGI, Django buffers a streaming response with a synchronous iterator in full
+    # before sending it. Give such responses an async iterator so they are sent as they
+    # are produced, with the memory of a single chunk.
+    if response.streaming and not response.is_async and isinstance(getattr(request, '_request', request), ASGIRequest):
+        response.streaming_content = aiter_in_thread(response.streaming_content)
+    return response
+
+
+def file_etag(stat):
+    # Cheap strong validator built from the modification time and size of the file
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def iter_file(path, start=0, length=None, chunk_size=CHUNK_SIZE):
+    # Yield `length` bytes of the file starting at `start`, one chunk at a time
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = length if length is not None else os.fstat(file.fileno()).st_size - start
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def parse_range(header, size):
+    # Return the (start, end) byte positions of a single-range header, or None when the
+    # header should be ignored and the full file served. Raise ValueError when the
+    # range cannot be satisfied.
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size:
+            raise ValueError('Range start is beyond the end of the file')
+        if end < start:
+            return None
+    elif last:
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError('Empty suffix range')
+        start, end = max(size - suffix, 0), size - 1
+    else:
+        return None
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    # A Range header is only honoured when If-Range (if any) still matches the file
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def ranged_file_response(request, path, content_type=None, filename=None, etag=None):
+    # Serve a file from disk in chunks with support for conditional (ETag/Last-Modified)
+    # and single byte-range requests
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = etag or file_etag(stat)
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = http_date(last_modified)
+        return response
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header and if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type, filename=filename)
+        response.block_size = CHUNK_SIZE
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(iter_file(path, start, length), status=206, content_type=content_type)
+        response.headers['Content-Length'] = str(length)
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        if filename:
+            response.headers['Content-Disposition'] = content_disposition_header(False, filename)
+
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    return stream_for(request, response)
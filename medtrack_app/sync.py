@@ -0,0 +1,103 @@
+import base64
+import binascii
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Tombstone
+
+
+class InvalidWatermark(ValueError):
+    pass
+
+
+class DeltaSync:
+    # Returns the rows of a model changed after a client's watermark, plus the ids deleted
+    # since, walking both in (timestamp, id) order so every call is an index range scan.
+    #
+    # The watermark is opaque to clients: base64 encoded JSON holding the last position
+    # reached in the changes and in the tombstones. Timestamps are assigned before the
+    # saving transaction commits, so a row may become visible with a timestamp slightly
+    # in the past. Once a client has caught up, its watermark is therefore held back by
+    # MEDTRACK_SYNC_OVERLAP seconds and recent rows are sent again on the next call;
+    # applying a change or a deletion twice is harmless.
+    page_size = 200
+    max_page_size = 1000
+
+    def __init__(self, model_name, queryset, timestamp_field='updated_date'):
+        self.model_name = model_name
+        self.queryset = queryset
+        self.timestamp_field = timestamp_field
+
+    def get_changes(self, watermark=None, page_size=None):
+        # Return (changed rows, deleted ids, new watermark, has_more)
+        page_size = max(1, min(page_size or self.page_size, self.max_page_size))
+        positions = self.decode_watermark(watermark)
+        caught_up_at = timezone.now() - timedelta(seconds=getattr(settings, 'MEDTRACK_SYNC_OVERLAP', 5))
+
+        rows = list(self._after(self.queryset, self.timestamp_field, positions.get('c'))[:page_size + 1])
+        deleted = list(
+            self._after(Tombstone.objects.filter(model_name=self.model_name), 'deleted_date', positions.get('d'))
+            .values_list('deleted_date', 'id', 'object_id')[:page_size + 1]
+        )
+
+        more_rows = len(rows) > page_size
+        more_deleted = len(deleted) > page_size
+        rows = rows[:page_size]
+        deleted = deleted[:page_size]
+
+        changes_position = positions.get('c')
+        if rows:
+            changes_position = (getattr(rows[-1], self.timestamp_field), rows[-1].pk)
+        deleted_position = positions.get('d')
+        if deleted:
+            deleted_position = deleted[-1][:2]
+
+        new_positions = {
+            'c': changes_position if more_rows else self._hold_back(changes_position, caught_up_at),
+            'd': deleted_position if more_deleted else self._hold_back(deleted_position, caught_up_at),
+        }
+        return rows, [row[2] for row in deleted], self.encode_watermark(new_positions), more_rows or more_deleted
+
+    @staticmethod
+    def _after(queryset, field, position):
+        # Rows strictly after a (timestamp, id) position in (timestamp, id) order
+        queryset = queryset.order_by(field, 'id')
+        if position is None:
+            return queryset
+        timestamp, pk = position
+        return queryset.filter(Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': pk}))
+
+    @staticmethod
+    def _hold_back(position, caught_up_at):
+        if position is None or position[0] > caught_up_at:
+            return (caught_up_at, 0)
+        return position
+
+    @staticmethod
+    def encode_watermark(positions):
+        payload = {key: [timestamp.isoformat(), pk] for key, (timestamp, pk) in positions.items()}
+        data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_watermark(watermark):
+        if not watermark:
+            return {}
+        try:
+            padding = '=' * (-len(watermark) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(watermark + padding).decode('utf-8'))
+            positions = {}
+            for key in ('c', 'd'):
+                timestamp, pk = payload[key]
+                timestamp = parse_datetime(timestamp)
+                if timestamp is None:
+                    raise ValueError
+                positions[key] = (timestamp, int(pk))
+            return positions
+        except (TypeError, ValueError, KeyError, AttributeError, binascii.Error) as e:
+            raise InvalidWatermark('Invalid watermark.') from e
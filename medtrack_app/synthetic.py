@@ -0,0 +1,199 @@
+import random
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from . import caching, counters, storage
+from .models import Notification, Patient, Procedure
+
+# Synthetic users are named <prefix>_<role>_<n> and share this password
+SYNTHETIC_USER_PREFIX = 'synthetic'
+SYNTHETIC_PASSWORD = 'Synthetic1!'
+ROLES = ['Front_Desk', 'Doctor', 'Admin']
+
+FIRST_NAMES = [
+    'Aarav', 'Vivaan', 'Aditya', 'Arjun', 'Sai', 'Reyansh', 'Ishaan', 'Kabir', 'Rohan', 'Vihaan',
+    'Ananya', 'Diya', 'Saanvi', 'Aadhya', 'Pari', 'Myra', 'Kiara', 'Ira', 'Anika', 'Meera',
+]
+LAST_NAMES = [
+    'Sharma', 'Patil', 'Deshmukh', 'Iyer', 'Reddy', 'Nair', 'Kulkarni', 'Joshi', 'Gupta', 'Singh',
+    'Khan', 'Das', 'Mehta', 'Chopra', 'Rao', 'Bose', 'Menon', 'Pillai', 'Verma', 'Jain',
+]
+# City, state, pincode prefix and language
+LOCATIONS = [
+    ('Pune', 'Maharashtra', '411', 'Marathi'),
+    ('Mumbai', 'Maharashtra', '400', 'Marathi'),
+    ('Bengaluru', 'Karnataka', '560', 'Kannada'),
+    ('Chennai', 'Tamil Nadu', '600', 'Tamil'),
+    ('Hyderabad', 'Telangana', '500', 'Telugu'),
+    ('Kolkata', 'West Bengal', '700', 'Bengali'),
+    ('Delhi', 'Delhi', '110', 'Hindi'),
+    ('Jaipur', 'Rajasthan', '302', 'Hindi'),
+]
+CITY_WEIGHTS = [20, 25, 15, 10, 10, 8, 8, 4]
+GENDER_WEIGHTS = {'Female': 49, 'Male': 49, 'Other': 2}
+
+# Rough shape of a clinic's workload: mostly diagnostics, mostly completed
+CATEGORY_WEIGHTS = {
+    'diagnostic': 45, 'surgical': 15, 'counseling': 15,
+    'psychiatry': 10, 'chiropractic': 8, 'social-service': 7,
+}
+STATUS_WEIGHTS = {
+    'completed': 60, 'in-progress': 10, 'preparation': 10, 'on-hold': 5,
+    'not-done': 5, 'stopped': 4, 'entered-in-error': 3, 'unknown': 3,
+}
+PROCEDURE_NAMES = {
+    'diagnostic': ['Blood panel', 'MRI scan', 'CT scan', 'X-ray', 'Ultrasound', 'ECG'],
+    'surgical': ['Appendectomy', 'Arthroscopy', 'Cataract surgery', 'Biopsy'],
+    'counseling': ['Nutrition counseling', 'Family counseling', 'Smoking cessation'],
+    'psychiatry': ['Psychiatric evaluation', 'Medication review'],
+    'chiropractic': ['Spinal manipulation', 'Posture assessment'],
+    'social-service': ['Home care assessment', 'Benefits counseling'],
+}
+
+# Every procedure happened during the two years before this instant, so runs are repeatable
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+# Smallest well-formed PDF, enough for the report endpoints
+PDF_DOCUMENT = (
+    b'%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n'
+    b'2 0 obj<</Type/Pages/Kids[]/Count 0>>endobj\n'
+    b'trailer<</Root 1 0 R>>\n%%EOF\n'
+)
+
+
+def synthetic_username(role, index=0):
+    return f'{SYNTHETIC_USER_PREFIX}_{role.lower()}_{index}'
+
+
+class SyntheticDataGenerator:
+    # Adds a deterministic data set to the database: on an empty database the same seed and
+    # sizes always produce the same rows. Rows are inserted with bulk_create, in batches, so
+    # signals do not fire; the AdminStat counters are reconciled and the table versions bumped
+    # once at the end.
+    batch_size = 1000
+
+    def __init__(self, seed=0, batch_size=None):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size or self.batch_size
+
+    def choice(self, weights):
+        return self.random.choices(list(weights), weights=list(weights.values()))[0]
+
+    def generate(self, patients=1000, procedures_per_patient=5, users_per_role=3,
+                 notifications_per_user=20, reports=False):
+        # Returns the number of rows created per model
+        users = self.create_users(users_per_role)
+        everyone = [user for role in ROLES for user in users[role]]
+        patient_count = self.create_patients(patients)
+        procedure_count = self.create_procedures(procedures_per_patient, users['Doctor'] + users['Admin'], reports)
+        notification_count = self.create_notifications(everyone, notifications_per_user)
+        counters.reconcile()
+        caching.bump_versions(*caching.VERSIONED_TABLES)
+        return {
+            'users': len(everyone),
+            'patients': patient_count,
+            'procedures': procedure_count,
+            'notifications': notification_count,
+        }
+
+    def create_users(self, per_role):
+        # Users in each role, by role, hashing the shared password once
+        password = make_password(SYNTHETIC_PASSWORD)
+        users = {}
+        for role in ROLES:
+            users[role] = []
+            group, _ = Group.objects.get_or_create(name=role)
+            for index in range(per_role):
+                user, created = User.objects.get_or_create(
+                    username=synthetic_username(role, index),
+                    defaults={'email': f'{synthetic_username(role, index)}@example.com', 'password': password},
+                )
+                if created:
+                    user.groups.add(group)
+                users[role].append(user)
+        return users
+
+    def build_patient(self, index):
+        city, state, pincode, language = self.random.choices(LOCATIONS, weights=CITY_WEIGHTS)[0]
+        first_name = self.random.choice(FIRST_NAMES)
+        last_name = self.random.choice(LAST_NAMES)
+        return Patient(
+            first_name=first_name,
+            last_name=last_name,
+            mobile_number=f'9{self.random.randrange(10 ** 9):09d}',
+            address=f'{self.random.randrange(1, 400)} Station Road, {city}',
+            gender=self.choice(GENDER_WEIGHTS),
+            birthdate=date(1940, 1, 1) + timedelta(days=self.random.randrange(365 * 80)),
+            email=f'{first_name}.{last_name}.{index}@example.com'.lower(),
+            city=city,
+            state=state,
+            pincode=f'{pincode}{self.random.randrange(1000):03d}',
+            emergency_contact_name=f'{self.random.choice(FIRST_NAMES)} {last_name}',
+            emergency_contact_mobile_number=f'8{self.random.randrange(10 ** 9):09d}',
+            language=language,
+        )
+
+    def create_patients(self, count):
+        start = Patient.objects.count()
+        for offset in range(0, count, self.batch_size):
+            batch = [self.build_patient(start + index) for index in range(offset, min(offset + self.batch_size, count))]
+            with transaction.atomic():
+                Patient.objects.bulk_create(batch)
+        return count
+
+    def build_procedure(self, patient_id, users, reports):
+        category = self.choice(CATEGORY_WEIGHTS)
+        procedure = Procedure(
+            patient_id=patient_id,
+            status=self.choice(STATUS_WEIGHTS),
+            procedure_datetime=EPOCH - timedelta(minutes=self.random.randrange(2 * 365 * 24 * 60)),
+            category=category,
+            procedure_name=self.random.choice(PROCEDURE_NAMES[category]),
+            clinic_address=f'{self.random.randrange(1, 50)} Hospital Road',
+            notes=self.random.choice([None, '', 'Follow up in two weeks.', 'Patient stable.']),
+            created_by=self.random.choice(users),
+        )
+        if reports and self.random.random() < 0.3:
+            procedure.report = self.write_report()
+        return procedure
+
+    def write_report(self):
+        number = self.random.randrange(10 ** 9)
+        return storage.get_report_storage().save(
+            f'report/synthetic-{number}.pdf', ContentFile(PDF_DOCUMENT + f'% report {number}\n'.encode())
+        )
+
+    def create_procedures(self, per_patient, users, reports):
+        # Procedures for every patient, created by doctors and admins, reading the patient
+        # ids back from the database in batches
+        created = 0
+        batch = []
+        for patient_id in Patient.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=self.batch_size):
+            batch.extend(self.build_procedure(patient_id, users, reports) for _ in range(per_patient))
+            if len(batch) >= self.batch_size:
+                created += self.save_procedures(batch)
+                batch = []
+        if batch:
+            created += self.save_procedures(batch)
+        return created
+
+    @staticmethod
+    def save_procedures(batch):
+        with transaction.atomic():
+            Procedure.objects.bulk_create(batch)
+            # bulk_create skips the signals that count references to the report files
+            storage.add_references([procedure.report.name for procedure in batch])
+        return len(batch)
+
+    def create_notifications(self, users, per_user):
+        notifications = [
+            Notification(user=user, message=f'Synthetic notification {index} for {user.username}.')
+            for user in users for index in range(per_user)
+        ]
+        Notification.objects.bulk_create(notifications, batch_size=self.batch_size)
+        return len(notifications)
+
@@ -1,3 +1,1702 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import json
+import os
+import tempfile
+import threading
+from io import StringIO
+from datetime import date, timedelta
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import Value
+from django.test import AsyncClient, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import async_views, caching, counters, instrumentation, views
+from .models import (
+    AdminStat, ArchivedProcedure, Notification, NotificationOutbox, Patient, Procedure, ReportBlob, Tombstone,
+)
+from .authentication import invalidate_users, user_cache
+from .checks import check_auth_cache
+from .fast_serializers import ProcedureValuesSerializer
+from .management.commands import explain_list_queries
+from .importers import PatientImporter
+from .retention import NotificationRetention, ProcedureArchiver
+from .notifications import Subscription, broker, dispatcher
+from .pagination import KeysetPagination
+from .search import FallbackPatientSearchBackend
+from .serializers import PatientSerializer, ProcedureSerializer
+from .signals import patient_created
+from .storage import collect_report_garbage
+from .synthetic import SyntheticDataGenerator
+
+
+def create_user(username, role):
+    # Create a user and put them in the group for the given role
+    group, _ = Group.objects.get_or_create(name=role)
+    user = User.objects.create_user(username=username, email=f'{username}@example.com', password='Passw0rd!')
+    user.groups.add(group)
+    return user
+
+
+def build_patient(index, **kwargs):
+    # Build an unsaved patient with valid data
+    data = {
+        'first_name': f'First{index:05d}',
+        'last_name': f'Last{index % 7}',
+        'mobile_number': '9876543210',
+        'address': '12 MG Road',
+        'gender': 'Female',
+        'birthdate': date(1990, 1, 1),
+        'email': f'patient{index}@example.com',
+        'city': 'Pune',
+        'state': 'Maharashtra',
+        'pincode': '411001',
+        'emergency_contact_name': 'Contact',
+        'emergency_contact_mobile_number': '9123456780',
+        'language': 'Marathi',
+    }
+    data.update(kwargs)
+    return Patient(**data)
+
+
+def asgi_get(user, path, data=None, **headers):
+    # GET through Django's ASGI handler with an access token, returning the response and
+    # its content read the way an ASGI server reads it
+    token = AccessToken.for_user(user)
+
+    async def get():
+        response = await AsyncClient().get(path, data, headers={'Authorization': f'Bearer {token}', **headers})
+        if not response.streaming:
+            return response, response.content
+        return response, b''.join([chunk async for chunk in response.streaming_content])
+
+    return async_to_sync(get)()
+
+
+def build_procedure(patient, user, index, **kwargs):
+    # Build an unsaved procedure with valid data
+    data = {
+        'patient': patient,
+        'created_by': user,
+        'status': 'completed',
+        'procedure_datetime': timezone.now() - timedelta(hours=index % 13),
+        'category': 'diagnostic',
+        'procedure_name': f'Procedure {index}',
+        'clinic_address': '1 Clinic Street',
+    }
+    data.update(kwargs)
+    return Procedure(**data)
+
+
+def discard_notifications():
+    # Drop the queued notifications and the dispatcher's pending wake-ups
+    dispatcher.shutdown()
+    NotificationOutbox.objects.all().delete()
+
+
+@override_settings(MEDTRACK_NOTIFICATION_WORKERS=0)
+class MedTrackTestCase(APITestCase):
+    # Notifications stay queued in the test thread until a test drains them. Cached responses
+    # are keyed by table versions, which the database rollback between tests resets.
+    def tearDown(self):
+        discard_notifications()
+        caching.response_cache.clear()
+        cache.clear()
+        super().tearDown()
+
+
+class KeysetPaginationTests(MedTrackTestCase):
+    def setUp(self):
+        self.admin = create_user('admin_user', 'Admin')
+        self.client.force_authenticate(self.admin)
+        Patient.objects.bulk_create(build_patient(i) for i in range(25))
+        patient = Patient.objects.first()
+        Procedure.objects.bulk_create(build_procedure(patient, self.admin, i) for i in range(25))
+
+    def walk(self, url):
+        # Follow next links to the end, then previous links back to the start
+        forward, pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            forward.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+
+        backward = [row['id'] for row in pages[-1]['results']]
+        url = pages[-1]['previous']
+        while url:
+            response = self.client.get(url)
+            backward = [row['id'] for row in response.data['results']] + backward
+            url = response.data['previous']
+        return forward, backward
+
+    def test_patient_pages_follow_model_ordering(self):
+        forward, backward = self.walk(reverse('list_create_patient') + '?page_size=4')
+        expected = list(Patient.objects.values_list('id', flat=True))
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_procedure_pages_follow_model_ordering(self):
+        forward, backward = self.walk(reverse('list_create_procedure') + '?page_size=6')
+        expected = list(Procedure.objects.values_list('id', flat=True))
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_page_size_is_bounded(self):
+        response = self.client.get(reverse('list_create_patient') + '?page_size=100000')
+        self.assertEqual(len(response.data['results']), 25)
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('list_create_patient') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_deep_page_starts_at_the_cursor(self):
+        # The plan seeks to the cursor with an index range instead of scanning the rows before it
+        procedures = ProcedureValuesSerializer().values(Procedure.objects.all())
+        position = ['2024-01-01T00:00:00+00:00', 1]
+        plan = explain_list_queries.Command().explain(explain_list_queries.page_queryset(procedures, position))
+        if connection.vendor == 'sqlite':
+            self.assertIn('SEARCH medtrack_app_procedure USING INDEX procedure_datetime_idx (procedure_datetime<?)', plan)
+        else:
+            self.assertRegex(plan, r'Index Cond: \(procedure_datetime <')
+
+
+class ProcedureListQueryCountTests(MedTrackTestCase):
+    def setUp(self):
+        self.doctor = create_user('doctor_user', 'Doctor')
+        self.client.force_authenticate(self.doctor)
+        creators = [self.doctor] + [create_user(f'doctor_{i}', 'Doctor') for i in range(4)]
+        patients = Patient.objects.bulk_create(build_patient(i) for i in range(50))
+        Procedure.objects.bulk_create(
+            build_procedure(patients[i % 50], creators[i % 5], i) for i in range(1000)
+        )
+
+    def test_listing_1000_procedures_uses_constant_queries(self):
+        # One role lookup, the table versions for the ETag and one query per page, however
+        # many rows are rendered
+        url = reverse('list_create_procedure') + '?page_size=200'
+        seen = 0
+        while url:
+            # A fresh user object per request, as in production
+            self.client.force_authenticate(User.objects.get(pk=self.doctor.pk))
+            with self.assertNumQueries(3):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += len(response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, 1000)
+
+    def test_nested_patient_and_creator_are_rendered(self):
+        response = self.client.get(reverse('list_create_procedure') + '?page_size=1')
+        procedure = response.data['results'][0]
+        self.assertEqual(set(procedure['created_by']), {'id', 'username', 'email'})
+        self.assertEqual(procedure['patient']['city'], 'Pune')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FastListSerializationTests(MedTrackTestCase):
+    def setUp(self):
+        self.admin = create_user('admin_user', 'Admin')
+        self.client.force_authenticate(self.admin)
+        # Strings JSON encoders are known to disagree on
+        awkward = ['Zoë "Quote" \\ Back', 'Line\u2028Sep\u2029', 'Tab\tNew\nline\x01', 'हिन्दी 😀', '']
+        patients = Patient.objects.bulk_create(
+            build_patient(i, first_name=name, address=name) for i, name in enumerate(awkward)
+        )
+        report = SimpleUploadedFile('scan.pdf', b'%PDF-1.4 scan')
+        build_procedure(patients[0], self.admin, 1, notes=awkward[1], report=report).save()
+        build_procedure(patients[1], self.admin, 2, notes=None).save()
+        build_procedure(patients[2], self.admin, 3, notes='', report='').save()
+
+    def assertSameAsSerializer(self, url, serializer_class, queryset, context=None):
+        # The response is byte for byte what rendering the page with the DRF serializer gives
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        ids = [row['id'] for row in response.data['results']]
+        instances = sorted(queryset.filter(id__in=ids), key=lambda instance: ids.index(instance.id))
+        expected = JSONRenderer().render({
+            'next': response.data['next'],
+            'previous': response.data['previous'],
+            'results': serializer_class(instances, many=True, context=context or {}).data,
+        })
+        self.assertEqual(response.content, expected)
+
+    def test_patient_list_matches_serializer(self):
+        url = reverse('list_create_patient')
+        self.assertSameAsSerializer(url, PatientSerializer, Patient.objects.all())
+        self.assertSameAsSerializer(url + '?page_size=2', PatientSerializer, Patient.objects.all())
+        self.assertSameAsSerializer(url + '?search=line', PatientSerializer, Patient.objects.all())
+        with patch('medtrack_app.renderers.orjson', None):
+            self.assertSameAsSerializer(url, PatientSerializer, Patient.objects.all())
+
+    def test_procedure_list_matches_serializer(self):
+        url = reverse('list_create_procedure')
+        procedures = Procedure.objects.all()
+        self.assertSameAsSerializer(url, ProcedureSerializer, procedures)
+        self.assertSameAsSerializer(url + '?report_base64=true', ProcedureSerializer, procedures,
+                                    context={'include_report_base64': True})
+        with patch('medtrack_app.renderers.orjson', None):
+            self.assertSameAsSerializer(url, ProcedureSerializer, procedures)
+
+    def test_values_serializer_follows_timezone_and_request(self):
+        request = APIRequestFactory().get('/procedures/')
+        rows = ProcedureValuesSerializer(context={'request': request}).values(Procedure.objects.all())
+        with timezone.override('Asia/Kolkata'):
+            serializer = ProcedureValuesSerializer(context={'request': request})
+            expected = ProcedureSerializer(Procedure.objects.all(), many=True, context={'request': request}).data
+            self.assertEqual(serializer.many(rows), expected)
+        self.assertTrue(expected[0]['report'].startswith('http://testserver/'))
+        self.assertTrue(expected[0]['created_date'].endswith('+05:30'))
+
+
+class SparseFieldsTests(MedTrackTestCase):
+    def setUp(self):
+        self.admin = create_user('admin_user', 'Admin')
+        self.client.force_authenticate(self.admin)
+        patients = Patient.objects.bulk_create(build_patient(i) for i in range(3))
+        Procedure.objects.bulk_create(build_procedure(patients[i % 3], self.admin, i) for i in range(6))
+        Notification.objects.create(user=self.admin, message='Hello')
+
+    def get(self, name, query):
+        # Return the response and the SQL of the last query it ran
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name) + query)
+        return response, queries.captured_queries[-1]['sql']
+
+    def test_selected_fields_narrow_the_query(self):
+        response, sql = self.get('list_create_procedure', '?fields=id,status,procedure_datetime,procedure_name')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'status', 'procedure_datetime', 'procedure_name'})
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('clinic_address', sql)
+
+        response, sql = self.get('list_create_patient', '?fields=id,city')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'city'})
+        self.assertNotIn('emergency_contact_name', sql)
+
+    def test_relations_are_primary_keys_unless_expanded(self):
+        response, sql = self.get('list_create_procedure', '?expand=patient')
+        procedure = response.data['results'][0]
+        self.assertEqual(procedure['created_by'], self.admin.pk)
+        self.assertEqual(procedure['patient']['city'], 'Pune')
+        self.assertIn('app_patient', sql)
+        self.assertNotIn('auth_user', sql)
+
+        response, sql = self.get('list_create_procedure', '?fields=id,patient.city&expand=created_by')
+        procedure = response.data['results'][0]
+        self.assertEqual(set(procedure), {'id', 'patient', 'created_by'})
+        self.assertEqual(set(procedure['patient']), {'city'})
+        self.assertEqual(set(procedure['created_by']), {'id', 'username', 'email'})
+        self.assertNotIn('mobile_number', sql)
+
+    def test_notifications_and_sync(self):
+        response, sql = self.get('list_notifications', '?fields=id,message')
+        self.assertEqual(response.data['results'], [{'id': Notification.objects.get().pk, 'message': 'Hello'}])
+        self.assertNotIn('auth_user', sql)
+
+        response, sql = self.get('list_notifications', '?fields=message,user.username')
+        self.assertEqual(response.data['results'], [{'user': {'username': 'admin_user'}, 'message': 'Hello'}])
+
+        response, sql = self.get('sync_procedures', '?fields=id,status')
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'status'})
+
+    def test_invalid_selection(self):
+        response = self.client.get(reverse('list_create_procedure') + '?fields=id,password')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.data)
+        response = self.client.get(reverse('list_create_patient') + '?expand=city')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('expand', response.data)
+
+
+class ConditionalRequestTests(MedTrackTestCase):
+    def setUp(self):
+        self.admin = create_user('admin_user', 'Admin')
+        self.client.force_authenticate(self.admin)
+        self.patient = build_patient(1)
+        self.patient.save()
+        build_procedure(self.patient, self.admin, 1).save()
+        counters.reconcile()
+
+    def revalidate(self, url, etag):
+        # Conditional GET, returning the response and whether the listed rows were read
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        tables = ('"medtrack_app_patient"', '"medtrack_app_procedure"')
+        return response, any(table in query['sql'] for query in queries.captured_queries for table in tables)
+
+    def test_unchanged_list_is_not_modified(self):
+        url = reverse('list_create_patient')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('Authorization', response['Vary'])
+
+        not_modified, read_rows = self.revalidate(url, response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertFalse(read_rows)
+
+        # Another page or filter is another representation
+        self.assertEqual(self.revalidate(url + '?city=Pune', response['ETag'])[0].status_code, 200)
+
+    def test_writes_change_the_etag(self):
+        url = reverse('list_create_procedure')
+        etag = self.client.get(url)['ETag']
+
+        # Logging in only updates last_login, which is not rendered
+        self.client.login(username='admin_user', password='Passw0rd!')
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.revalidate(url, etag)[0].status_code, 304)
+
+        # Changes to the nested patient and creator count too
+        for instance, field in ((self.patient, 'city'), (self.admin, 'email')):
+            setattr(instance, field, 'changed@example.com')
+            instance.save()
+            response = self.revalidate(url, etag)[0]
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+
+        # So do bulk imports, which bypass the signals
+        patients_etag = self.client.get(reverse('list_create_patient'))['ETag']
+        PatientImporter(created_by=self.admin).save([build_patient(2)])
+        self.assertEqual(self.revalidate(reverse('list_create_patient'), patients_etag)[0].status_code, 200)
+
+    def test_admin_stats(self):
+        url = reverse('admin-stats')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.revalidate(url, etag)[0].status_code, 304)
+        counters.increment('total_patients')
+        self.assertEqual(self.revalidate(url, etag)[0].status_code, 200)
+
+    def test_last_modified_once_the_second_is_over(self):
+        url = reverse('list_create_patient')
+        self.assertFalse(self.client.get(url).has_header('Last-Modified'))
+
+        later = timezone.now() + timedelta(seconds=2)
+        with patch('medtrack_app.caching.timezone.now', return_value=later):
+            last_modified = self.client.get(url)['Last-Modified']
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_async_view(self):
+        etag = self.client.get(reverse('list_create_patient'))['ETag']
+        request = APIRequestFactory().get(reverse('list_create_patient'), HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=self.admin)
+        response = async_to_sync(async_views.AsyncPatientView.as_view())(request)
+        self.assertEqual(response.status_code, 304)
+
+
+class ResponseCacheTests(MedTrackTestCase):
+    def setUp(self):
+        self.admin = create_user('admin_user', 'Admin')
+        self.client.force_authenticate(self.admin)
+        self.patient = build_patient(1)
+        self.patient.save()
+        build_procedure(self.patient, self.admin, 1).save()
+        caching.response_cache.clear()
+        caching.response_cache.reset_stats()
+
+    def get(self, url):
+        # Return the response and whether the listed rows were read from the database
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        tables = ('"medtrack_app_patient"', '"medtrack_app_procedure"')
+        return response, any(table in query['sql'] for query in queries.captured_queries for table in tables)
+
+    def test_repeated_queries_are_served_from_the_cache(self):
+        url = reverse('list_create_patient')
+        first, read_rows = self.get(url + '?city=Pune&page_size=10')
+        self.assertTrue(read_rows)
+        # Same parameters in another order, and a blank one
+        second, read_rows = self.get(url + '?page_size=10&name=&city=Pune')
+        self.assertFalse(read_rows)
+        self.assertEqual(second.content, first.content)
+
+        stats = caching.response_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_entries_are_per_role(self):
+        url = reverse('list_create_patient')
+        self.get(url)
+        self.client.force_authenticate(create_user('front_desk_user', 'Front_Desk'))
+        self.assertTrue(self.get(url)[1])
+        self.assertEqual(caching.response_cache.stats()['size'], 2)
+
+    def test_writes_invalidate_the_entries_rendered_from_the_table(self):
+        patients_url, procedures_url = reverse('list_create_patient'), reverse('list_create_procedure')
+        self.get(patients_url)
+        self.get(procedures_url)
+
+        # Users are only rendered in procedure lists
+        self.admin.email = 'new@example.com'
+        self.admin.save()
+        self.assertEqual(caching.response_cache.stats()['invalidations'], 1)
+        self.assertFalse(self.get(patients_url)[1])
+        response, read_rows = self.get(procedures_url)
+        self.assertTrue(read_rows)
+        self.assertEqual(response.data['results'][0]['created_by']['email'], 'new@example.com')
+
+        self.patient.city = 'Mumbai'
+        self.patient.save()
+        self.assertEqual(caching.response_cache.stats()['size'], 0)
+        self.assertEqual(self.get(patients_url)[0].data['results'][0]['city'], 'Mumbai')
+
+    def test_writes_in_other_processes_change_the_key(self):
+        url = reverse('list_create_patient')
+        self.get(url)
+        # A version bumped elsewhere does not drop the local entry, it makes it unreachable
+        counters.increment(caching.version_counter('patient'))
+        self.assertTrue(self.get(url)[1])
+
+    def test_inlined_reports_are_not_cached(self):
+        url = reverse('list_create_procedure') + '?report_base64=true'
+        self.get(url)
+        self.assertTrue(self.get(url)[1])
+
+    def test_lru_eviction(self):
+        cache = caching.LRUResponseCache(max_size=2)
+        cache.set('a', 1, ['patient'])
+        cache.set('b', 2, ['procedure'])
+        cache.get('a')
+        cache.set('c', 3, ['patient'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        cache.invalidate('patient')
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_stats_are_exposed(self):
+        self.get(reverse('list_create_patient'))
+        response = self.client.get(reverse('admin-instrumentation'))
+        self.assertEqual(response.data['response_cache']['misses'], 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProcedureReportTests(MedTrackTestCase):
+    def setUp(self):
+        self.doctor = create_user('doctor_user', 'Doctor')
+        self.client.force_authenticate(self.doctor)
+        self.content = bytes(range(256)) * 1024
+        patient = build_patient(1)
+        patient.save()
+        self.procedure = build_procedure(patient, self.doctor, 1)
+        self.procedure.report = SimpleUploadedFile('scan.pdf', self.content, content_type='application/pdf')
+        self.procedure.save()
+        self.url = reverse('procedure_report', args=[self.procedure.pk])
+
+    def test_listing_does_not_inline_reports_unless_asked(self):
+        response = self.client.get(reverse('list_create_procedure'))
+        self.assertNotIn('report_base64', response.data['results'][0])
+
+        response = self.client.get(reverse('list_create_procedure') + '?report_base64=true')
+        self.assertEqual(base64.b64decode(response.data['results'][0]['report_base64']), self.content)
+
+    def test_download_streams_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_download_streams_under_asgi(self):
+        response, content = asgi_get(self.doctor, self.url)
+        self.assertTrue(response.is_async)
+        self.assertEqual(content, self.content)
+        response, content = asgi_get(self.doctor, self.url, Range='bytes=10-19')
+        self.assertEqual((response.status_code, response.is_async), (206, True))
+        self.assertEqual(content, self.content[10:20])
+
+    def test_range_request(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_conditional_request(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_front_desk_cannot_download(self):
+        self.client.force_authenticate(create_user('front_desk_user', 'Front_Desk'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+@override_settings(MEDTRACK_NOTIFICATION_WORKERS=0)
+class ProcedureBulkTests(MedTrackTestCase):
+    def setUp(self):
+        self.doctor = create_user('doctor_user', 'Doctor')
+        self.client.force_authenticate(self.doctor)
+        self.patient = build_patient(1)
+        self.patient.save()
+
+    def item(self, index, **kwargs):
+        data = {
+            'patient': self.patient.pk, 'status': 'Completed', 'procedure_datetime': '2024-01-01T10:00:00Z',
+            'category': 'diagnostic', 'procedure_name': f'Bulk {index}', 'clinic_address': '1 Clinic Street',
+        }
+        data.update(kwargs)
+        return data
+
+    def post(self, name, data):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse(name), data, format='json')
+        inserts = [query['sql'] for query in queries.captured_queries if 'INSERT INTO "medtrack_app_procedure"' in query['sql']]
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE "medtrack_app_procedure"')]
+        return response, inserts, updates
+
+    def test_bulk_create(self):
+        # Patient ids may be numeric strings, as with the single create
+        items = [
+            self.item(0), self.item(1, status='done'), self.item(2, patient=999999),
+            self.item(3, patient=str(self.patient.pk)), 'nope',
+        ]
+        response, inserts, _ = self.post('bulk_create_procedures', {'procedures': items})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 3))
+        results = response.data['results']
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3, 4])
+        self.assertIn('status', results[1]['errors'])
+        self.assertIn('patient', results[2]['errors'])
+        self.assertEqual(
+            list(Procedure.objects.order_by('id').values_list('id', 'procedure_name', 'status')),
+            [(results[0]['id'], 'Bulk 0', 'completed'), (results[3]['id'], 'Bulk 3', 'completed')],
+        )
+        self.assertEqual(len(inserts), 1)
+
+        # One counter update and one notification for the batch
+        self.assertEqual(counters.read_counters()[0]['total_procedures'], 2)
+        dispatcher.drain()
+        self.assertEqual(list(Notification.objects.values_list('message', flat=True)), ['2 procedures have been created.'])
+
+    def test_bulk_create_rejects_bad_requests(self):
+        self.assertEqual(self.post('bulk_create_procedures', {'procedures': []})[0].status_code, 400)
+        response = self.post('bulk_create_procedures', {'procedures': [self.item(0, category='x')]})[0]
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Procedure.objects.exists())
+        too_many = [self.item(i) for i in range(501)]
+        self.assertEqual(self.post('bulk_create_procedures', {'procedures': too_many})[0].status_code, 400)
+
+    def test_bulk_status_update(self):
+        other = create_user('other_doctor', 'Doctor')
+        procedures = [build_procedure(self.patient, self.doctor if i < 3 else other, i) for i in range(4)]
+        for procedure in procedures:
+            procedure.save()
+        discard_notifications()
+        ids = [procedure.id for procedure in procedures]
+        self.client.get(reverse('list_create_procedure'))
+
+        response, _, updates = self.post('bulk_update_procedure_status', {'updates': [
+            {'id': ids[0], 'status': 'On-Hold'}, {'id': ids[1], 'status': 'stopped'},
+            {'id': ids[2], 'status': 'completed'}, {'id': str(ids[3]), 'status': 'on-hold'},
+            {'id': ids[0], 'status': 'stopped'}, {'id': 999999, 'status': 'stopped'},
+            {'id': ids[1], 'status': 'finished'}, {'id': str(ids[2]), 'status': 'stopped'},
+            {'id': True, 'status': 'stopped'}, {'id': 'abc', 'status': 'stopped'},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        # Procedure ids may be numeric strings, as with bulk create, and name the same
+        # procedure as the integer id
+        self.assertEqual(
+            {key: response.data[key] for key in ('updated', 'unchanged', 'failed')},
+            {'updated': 3, 'unchanged': 1, 'failed': 6},
+        )
+        # One UPDATE per target status
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(
+            dict(Procedure.objects.values_list('id', 'status')),
+            {ids[0]: 'on-hold', ids[1]: 'stopped', ids[2]: 'completed', ids[3]: 'on-hold'},
+        )
+        self.assertGreater(Procedure.objects.get(id=ids[0]).updated_date, procedures[0].updated_date)
+
+        dispatcher.drain()
+        self.assertEqual(
+            sorted(Notification.objects.values_list('user__username', 'message')),
+            [('doctor_user', '2 procedures have been updated.'), ('other_doctor', '1 procedures have been updated.')],
+        )
+        # The cached list is not served stale
+        response = self.client.get(reverse('list_create_procedure'))
+        self.assertEqual({row['id']: row['status'] for row in response.data['results']}[ids[1]], 'stopped')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), MEDTRACK_NOTIFICATION_WORKERS=0)
+class ProcedureChangeTrackingTests(MedTrackTestCase):
+    def setUp(self):
+        self.doctor = create_user('doctor_user', 'Doctor')
+        self.client.force_authenticate(self.doctor)
+        patient = build_patient(1)
+        patient.save()
+        self.procedure = build_procedure(patient, self.doctor, 1)
+        self.procedure.report = SimpleUploadedFile('old.pdf', b'%PDF-1.4 old', content_type='application/pdf')
+        self.procedure.save()
+        self.url = reverse('update_procedure', args=[self.procedure.pk])
+        discard_notifications()
+
+    def put(self, data, format=None):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.put(self.url, data, format=format)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries.captured_queries if 'medtrack_app_procedure' in query['sql']]
+
+    def test_tracker(self):
+        procedure = Procedure.objects.get(pk=self.procedure.pk)
+        self.assertEqual(procedure.get_dirty_fields(), set())
+        procedure.status = 'on-hold'
+        procedure.notes = 'Rescheduled'
+        self.assertEqual(procedure.get_dirty_fields(), {'status', 'notes'})
+        self.assertEqual(procedure.get_loaded_value('status'), 'completed')
+        procedure.save()
+        self.assertEqual(procedure.get_dirty_fields(), set())
+
+        # Saving some of the fields leaves the other changes dirty
+        procedure.status = 'stopped'
+        procedure.notes = 'Cancelled'
+        procedure.save(update_fields=['status'])
+        self.assertEqual(procedure.get_dirty_fields(), {'notes'})
+        self.assertEqual(procedure.get_loaded_value('status'), 'stopped')
+
+        # Deferred columns that get set count as changed
+        procedure = Procedure.objects.only('id').get(pk=self.procedure.pk)
+        procedure.status = 'stopped'
+        self.assertEqual(procedure.get_dirty_fields(), {'status'})
+
+    def test_status_change_writes_only_the_status(self):
+        queries = self.put({'status': 'On-Hold'})
+        # The procedure is read once, by the view, and only the changed columns are written
+        self.assertEqual(len([sql for sql in queries if sql.startswith('SELECT')]), 1)
+        update, = [sql for sql in queries if sql.startswith('UPDATE')]
+        self.assertIn('"status"', update)
+        self.assertIn('"updated_date"', update)
+        self.assertNotIn('"notes"', update)
+        self.assertNotIn('"report"', update)
+        self.assertEqual(Procedure.objects.get(pk=self.procedure.pk).status, 'on-hold')
+        self.assertTrue(os.path.isfile(self.procedure.report.path))
+
+        dispatcher.drain()
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_unchanged_put_writes_nothing(self):
+        updated_date = Procedure.objects.get(pk=self.procedure.pk).updated_date
+        queries = self.put({'status': 'completed', 'procedure_name': 'Procedure 1'})
+        self.assertFalse([sql for sql in queries if sql.startswith('UPDATE')])
+        self.assertEqual(Procedure.objects.get(pk=self.procedure.pk).updated_date, updated_date)
+        dispatcher.drain()
+        self.assertFalse(Notification.objects.exists())
+
+    def test_new_report_replaces_the_old_file(self):
+        old_path = self.procedure.report.path
+        report = SimpleUploadedFile('new.pdf', b'%PDF-1.4 new', content_type='application/pdf')
+        self.put({'report': report}, format='multipart')
+        procedure = Procedure.objects.get(pk=self.procedure.pk)
+        with procedure.report.open('rb') as file:
+            self.assertEqual(file.read(), b'%PDF-1.4 new')
+        # The old file is left to the garbage collector
+        self.assertEqual(ReportBlob.objects.get(name=self.procedure.report.name).ref_count, 0)
+        collect_report_garbage(grace=0)
+        self.assertFalse(os.path.isfile(old_path))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), MEDTRACK_NOTIFICATION_WORKERS=0, MEDTRACK_RETENTION_SLEEP=0)
+class ReportStorageTests(MedTrackTestCase):
+    def setUp(self):
+        self.doctor = create_user('doctor_user', 'Doctor')
+        self.patient = build_patient(1)
+        self.patient.save()
+
+    def create(self, index, content):
+        report = SimpleUploadedFile(f'report{index}.pdf', content, content_type='application/pdf')
+        procedure = build_procedure(self.patient, self.doctor, index, report=report)
+        procedure.save()
+        return procedure
+
+    def blob(self, procedure):
+        return ReportBlob.objects.get(name=procedure.report.name)
+
+    def test_identical_reports_share_one_file(self):
+        # Only a copy that already exists has its grace period restarted
+        def touches(queries):
+            return [q for q in queries.captured_queries if q['sql'].startswith('UPDATE') and 'released_date' in q['sql']]
+
+        with CaptureQueriesContext(connection) as queries:
+            first = self.create(1, b'%PDF-1.4 same')
+        self.assertEqual(touches(queries), [])
+        with CaptureQueriesContext(connection) as queries:
+            second = self.create(2, b'%PDF-1.4 same')
+        self.assertNotEqual(touches(queries), [])
+        other = self.create(3, b'%PDF-1.4 other')
+
+        self.assertEqual(first.report.name, second.report.name)
+        self.assertNotEqual(first.report.name, other.report.name)
+        self.assertRegex(first.report.name, r'^report/[0-9a-f]{2}/[0-9a-f]{64}\.pdf$')
+        self.assertEqual(len(os.listdir(os.path.dirname(first.report.path))), 1)
+        self.assertEqual(self.blob(first).ref_count, 2)
+        with Procedure.objects.get(pk=second.pk).report.open('rb') as file:
+            self.assertEqual(file.read(), b'%PDF-1.4 same')
+
+    def test_replacing_a_deferred_report_releases_the_old_file(self):
+        old = self.blob(self.create(1, b'%PDF-1.4 old'))
+        procedure = Procedure.objects.defer('report').get()
+        procedure.report = SimpleUploadedFile('new.pdf', b'%PDF-1.4 new', content_type='application/pdf')
+        procedure.save()
+
+        old.refresh_from_db()
+        self.assertEqual(old.ref_count, 0)
+        self.assertEqual(self.blob(procedure).ref_count, 1)
+
+    def test_unreferenced_files_are_collected_after_the_grace_period(self):
+        first = self.create(1, b'%PDF-1.4 same')
+        second = self.create(2, b'%PDF-1.4 same')
+        path = first.report.path
+
+        # Deleting a procedure leaves the file to the collector, and a shared file stays
+        first.delete()
+        self.assertEqual(self.blob(second).ref_count, 1)
+        second.delete()
+        self.assertTrue(os.path.isfile(path))
+
+        self.assertEqual(collect_report_garbage(), 0)
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(collect_report_garbage(grace=0, batch_size=1), 1)
+        self.assertFalse(os.path.isfile(path))
+        self.assertFalse(ReportBlob.objects.exists())
+
+    def test_collector_keeps_files_still_referenced(self):
+        procedure = self.create(1, b'%PDF-1.4 report')
+        # A count gone wrong, e.g. through a bulk write, is repaired instead of trusted
+        ReportBlob.objects.update(ref_count=0, released_date=timezone.now() - timedelta(days=1))
+        self.assertEqual(collect_report_garbage(grace=0), 0)
+        self.assertTrue(os.path.isfile(procedure.report.path))
+        self.assertEqual(self.blob(procedure).ref_count, 1)
+
+    def test_stored_copy_is_kept_for_a_new_upload(self):
+        procedure = self.create(1, b'%PDF-1.4 report')
+        procedure.delete()
+        ReportBlob.objects.update(released_date=timezone.now() - timedelta(days=1))
+
+        # The same content arrives again; until its procedure is saved only the stored file
+        # refers to the blob, and the collector must not take it in between
+        storage = Procedure._meta.get_field('report').storage
+        name = storage.save('report/again.pdf', SimpleUploadedFile('again.pdf', b'%PDF-1.4 report'))
+        self.assertEqual(name, procedure.report.name)
+        self.assertEqual(collect_report_garbage(), 0)
+        self.assertTrue(storage.exists(name))
+
+    def test_download_uses_the_uploaded_name(self):
+        procedure = self.create(1, b'%PDF-1.4 report')
+        self.assertEqual(procedure.report_filename, 'report1.pdf')
+        self.client.force_authenticate(self.doctor)
+        response = self.client.get(reverse('procedure_report', args=[procedure.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('filename="report1.pdf"', response['Content-Disposition'])
+
+    def test_archiving_keeps_the_reference(self):
+        procedure = self.create(1, b'%PDF-1.4 report')
+        Procedure.objects.filter(pk=procedure.pk).update(procedure_datetime=timezone.now() - timedelta(days=1000))
+        ProcedureArchiver(days=730).run()
+        self.assertEqual(self.blob(procedure).ref_count, 1)
+        ArchivedProcedure.objects.all().delete()
+        self.assertEqual(self.blob(procedure).ref_count, 0)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RetentionTests(MedTrackTestCase):
+    def setUp(self):
+        self.admin = create_user('admin_user', 'Admin')
+        self.client.force_authenticate(self.admin)
+        patient = build_patient(1)
+        patient.save()
+        old = timezone.now() - timedelta(days=1000)
+        report = SimpleUploadedFile('old.pdf', b'%PDF-1.4 old', content_type='application/pdf')
+        self.old = [
+            build_procedure(patient, self.admin, i, procedure_datetime=old - timedelta(days=i), report=report if i == 0 else None)
+            for i in range(5)
+        ]
+        for procedure in self.old:
+            procedure.save()
+        self.recent = build_procedure(patient, self.admin, 9)
+        self.recent.save()
+
+        notifications = Notification.objects.bulk_create(Notification(user=self.admin, message=f'Old {i}') for i in range(3))
+        Notification.objects.filter(id__in=[n.id for n in notifications]).update(timestamp=old)
+        Notification.objects.create(user=self.admin, message='Recent')
+
+    def test_procedures_are_moved_to_the_archive(self):
+        report_path = self.old[0].report.path
+        self.client.get(reverse('list_create_procedure'))
+
+        self.assertEqual(ProcedureArchiver(days=730, batch_size=2).run(), 5)
+        self.assertEqual(list(Procedure.objects.values_list('id', flat=True)), [self.recent.id])
+        archived = ArchivedProcedure.objects.get(id=self.old[0].id)
+        self.assertEqual(
+            (archived.procedure_name, archived.created_date, archived.report.name),
+            (self.old[0].procedure_name, self.old[0].created_date, self.old[0].report.name),
+        )
+        # Moving is not deleting: the report file stays and sync clients keep their copy
+        self.assertTrue(os.path.isfile(report_path))
+        self.assertFalse(Tombstone.objects.exists())
+        self.assertEqual(counters.compute_counters()['total_procedures'], 6)
+
+        # The cached list is not served stale, the archive is listed on request
+        response = self.client.get(reverse('list_create_procedure'))
+        self.assertEqual([row['id'] for row in response.data['results']], [self.recent.id])
+        response = self.client.get(reverse('list_create_procedure'), {'archived': 'true'})
+        self.assertEqual([row['id'] for row in response.data['results']], [p.id for p in self.old])
+        self.assertEqual(response.data['results'][0]['report'], self.old[0].report.url)
+        self.assertEqual(response.data['results'][0]['patient']['first_name'], 'First00001')
+
+        # Deleting the patient releases the archived files
+        Patient.objects.all().delete()
+        collect_report_garbage(grace=0)
+        self.assertFalse(os.path.isfile(report_path))
+
+    def test_runs_are_bounded_and_resume(self):
+        archiver = ProcedureArchiver(days=730, batch_size=2, max_batches=1)
+        self.assertEqual(archiver.count(), 5)
+        self.assertEqual(archiver.run(), 2)
+        # The oldest go first
+        self.assertEqual(set(ArchivedProcedure.objects.values_list('id', flat=True)), {self.old[4].id, self.old[3].id})
+        self.assertEqual(archiver.run(), 2)
+        self.assertEqual(archiver.count(), 1)
+
+    def test_old_notifications_are_deleted(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(NotificationRetention(days=180).run(), 3)
+        self.assertEqual(len([query for query in queries.captured_queries if query['sql'].startswith('DELETE')]), 1)
+        self.assertEqual(list(Notification.objects.values_list('message', flat=True)), ['Recent'])
+
+    def test_batches_follow_the_index_order(self):
+        # notification_retention_idx is read forward, procedure_datetime_idx backward
+        def index_fields(model, name):
+            index, = [index for index in model._meta.indexes if index.name == name]
+            return index.fields
+
+        def invert(fields):
+            return [field[1:] if field.startswith('-') else f'-{field}' for field in fields]
+
+        self.assertEqual(list(NotificationRetention.ordering), index_fields(Notification, 'notification_retention_idx'))
+        self.assertEqual(list(ProcedureArchiver.ordering), invert(index_fields(Procedure, 'procedure_datetime_idx')))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('apply_retention', '--dry-run', stdout=out)
+        self.assertIn('notifications: 3 rows older than 180 days', out.getvalue())
+        self.assertIn('procedures: 5 rows older than 730 days', out.getvalue())
+
+        call_command('apply_retention', '--only', 'procedures', '--sleep', '0', stdout=out)
+        self.assertEqual(ArchivedProcedure.objects.count(), 5)
+        self.assertEqual(Notification.objects.count(), 4)
+
+
+class AdminStatCounterTests(MedTrackTestCase):
+    def setUp(self):
+        self.admin = create_user('admin_user', 'Admin')
+        self.front_desk = create_user('front_desk_user', 'Front_Desk')
+        self.client.force_authenticate(self.admin)
+
+    def test_signals_increment_counters(self):
+        patient = build_patient(1)
+        patient.save()
+        patient_created.send(sender=self.__class__, patient=patient, created_by=self.front_desk)
+        build_procedure(patient, self.admin, 1).save()
+
+        response = self.client.get(reverse('admin-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {key: value for key, value in response.data.items() if key != 'last_updated'},
+            {'total_patients': 1, 'total_procedures': 1, 'front_desk_users': 1, 'doctor_users': 0, 'admin_users': 1},
+        )
+        self.assertIn('last_updated', response.data)
+
+    def test_reconcile_recomputes_from_source_tables(self):
+        Patient.objects.bulk_create(build_patient(i) for i in range(3))
+        counters.increment('total_procedures', 5)
+
+        call_command('reconcile_admin_stats', stdout=StringIO())
+
+        totals, _ = counters.read_counters()
+        self.assertEqual(totals['total_patients'], 3)
+        self.assertEqual(totals['total_procedures'], 0)
+        self.assertEqual(totals['admin_users'], 1)
+        self.assertEqual(AdminStat.objects.get(pk=1).total_patients, 3)
+
+
+class NotificationDispatchTests(MedTrackTestCase):
+    def setUp(self):
+        self.front_desk = create_user('front_desk_user', 'Front_Desk')
+        self.client.force_authenticate(self.front_desk)
+        self.patient_data = {
+            'first_name': 'Asha', 'last_name': 'Patil', 'mobile_number': '9876543210',
+            'address': '12 MG Road', 'gender': 'f', 'birthdate': '1990-01-01',
+            'email': 'asha@example.com', 'city': 'Pune', 'state': 'Maharashtra', 'pincode': '411001',
+            'emergency_contact_name': 'Ravi', 'emergency_contact_mobile_number': '9123456780',
+            'language': 'Marathi',
+        }
+
+    def test_notifications_are_written_off_the_request_path(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('list_create_patient'), self.patient_data)
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(Notification.objects.exists())
+
+        dispatcher.drain()
+        notification = Notification.objects.get()
+        self.assertEqual(notification.user, self.front_desk)
+        self.assertIn('Asha Patil', notification.message)
+
+    def test_outbox_is_replayed(self):
+        NotificationOutbox.objects.create(user=self.front_desk, message='Left over')
+        dispatcher.drain()
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(Notification.objects.get().message, 'Left over')
+
+    def test_notifications_are_stored_with_the_transaction(self):
+        # The outbox row commits or rolls back with the change it reports
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatcher.enqueue(self.front_desk.id, 'Queued')
+        dispatcher.shutdown()
+        self.assertEqual(NotificationOutbox.objects.get().message, 'Queued')
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            dispatcher.enqueue(self.front_desk.id, 'Rolled back')
+            raise RuntimeError
+        self.assertEqual(list(NotificationOutbox.objects.values_list('message', flat=True)), ['Queued'])
+
+
+class NotificationReadStateTests(MedTrackTestCase):
+    def setUp(self):
+        self.user = create_user('doctor_user', 'Doctor')
+        other = create_user('other_user', 'Doctor')
+        self.client.force_authenticate(self.user)
+        Notification.objects.bulk_create(Notification(user=self.user, message=f'Message {i}') for i in range(7))
+        Notification.objects.create(user=other, message='Not mine')
+        self.ids = list(Notification.objects.filter(user=self.user).values_list('id', flat=True))
+
+    def bulk(self, **data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('bulk_notifications'), data, format='json')
+        writes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith(('UPDATE', 'DELETE'))]
+        return response, writes
+
+    def test_notifications_are_paged_newest_first(self):
+        url = reverse('list_notifications') + '?page_size=3'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, self.ids)
+
+        row = response.data['results'][0]
+        self.assertEqual(set(row), {'id', 'user', 'message', 'timestamp', 'is_read'})
+        # The caller is not repeated on every row unless expanded
+        self.assertEqual(row['user'], self.user.pk)
+
+    def test_mark_read_and_unread_count(self):
+        url = reverse('notification_unread_count')
+        self.assertEqual(self.client.get(url).data, {'unread': 7})
+
+        response, writes = self.bulk(action='read', ids=self.ids[:3])
+        self.assertEqual(response.data, {'action': 'read', 'count': 3})
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(self.client.get(url).data, {'unread': 4})
+        # Rows already read are not written again
+        self.assertEqual(self.bulk(action='read', ids=self.ids[:4])[0].data['count'], 1)
+
+        response = self.client.get(reverse('list_notifications'), {'is_read': 'false'})
+        self.assertEqual([row['id'] for row in response.data['results']], self.ids[4:])
+
+        self.assertEqual(self.bulk(action='read', all=True)[0].data['count'], 3)
+        self.assertEqual(self.client.get(url).data, {'unread': 0})
+        self.assertFalse(Notification.objects.get(message='Not mine').is_read)
+
+    def test_bulk_delete(self):
+        response, writes = self.bulk(action='delete', before=Notification.objects.get(id=self.ids[3]).timestamp.isoformat())
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(list(Notification.objects.filter(user=self.user).values_list('id', flat=True)), self.ids[:3])
+
+    def test_invalid_bulk_actions(self):
+        self.assertEqual(self.bulk(action='read')[0].status_code, 400)
+        self.assertEqual(self.bulk(action='archive', all=True)[0].status_code, 400)
+        self.assertEqual(self.bulk(action='read', ids=[])[0].status_code, 400)
+
+
+@override_settings(MEDTRACK_NOTIFICATION_WORKERS=0)
+class NotificationStreamTests(MedTrackTestCase):
+    def setUp(self):
+        self.user = create_user('doctor_user', 'Doctor')
+        self.client.force_authenticate(self.user)
+        self.notifications = [Notification.objects.create(user=self.user, message=f'Message {i}') for i in range(3)]
+        self.url = reverse('stream_notifications')
+
+    def pushed(self, notification_id, message):
+        return Notification(id=notification_id, user_id=self.user.id, message=message, timestamp=timezone.now())
+
+    def test_poll_returns_missed_notifications(self):
+        first, _, last = self.notifications
+        response = self.client.get(self.url, {'last_event_id': first.id, 'timeout': 0, 'expand': 'user'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['message'] for row in response.data['results']], ['Message 1', 'Message 2'])
+        self.assertEqual(response.data['results'][0]['user']['username'], 'doctor_user')
+        self.assertEqual(response.data['last_event_id'], last.id)
+
+        response = self.client.get(self.url, {'timeout': 0, 'fields': 'id'}, HTTP_LAST_EVENT_ID=str(last.id))
+        self.assertEqual(response.data, {'results': [], 'last_event_id': last.id})
+
+    def test_poll_starts_from_the_latest_notification(self):
+        response = self.client.get(self.url, {'timeout': 0})
+        self.assertEqual(response.data, {'results': [], 'last_event_id': self.notifications[-1].id})
+
+    def test_waiting_poll_is_woken_by_the_broker(self):
+        timer = threading.Timer(0.1, broker.publish, [[self.pushed(100, 'Pushed')]])
+        timer.start()
+        try:
+            response = self.client.get(self.url, {'timeout': 10})
+        finally:
+            timer.cancel()
+        self.assertEqual([row['message'] for row in response.data['results']], ['Pushed'])
+        self.assertEqual(response.data['last_event_id'], 100)
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(self.url, {'last_event_id': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'timeout': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'timeout': 0, 'fields': 'nope'}).status_code, 400)
+
+    def test_written_notifications_are_published(self):
+        subscription = broker.subscribe(self.user.id)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                dispatcher.enqueue(self.user.id, 'Written')
+            dispatcher.drain()
+            entries, stale = subscription.take()
+        finally:
+            broker.unsubscribe(subscription)
+        notification = Notification.objects.get(message='Written')
+        self.assertFalse(stale)
+        self.assertEqual(entries, [(notification.id, 'Written', notification.timestamp, False)])
+
+    def test_slow_subscriptions_fall_back_to_the_database(self):
+        subscription = Subscription(self.user.id, max_pending=1)
+        subscription.push([(1, 'One', None), (2, 'Two', None)])
+        self.assertEqual(subscription.take(), ([], True))
+        self.assertEqual(subscription.take(), ([], False))
+
+    def test_event_stream(self):
+        factory = APIRequestFactory()
+        request = factory.get(self.url, HTTP_ACCEPT='text/event-stream')
+        force_authenticate(request, user=self.user)
+        response = async_to_sync(async_views.AsyncNotificationStreamView.as_view())(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        async def read():
+            stream = async_views.AsyncNotificationStreamView.stream(self.user, self.notifications[0].id, {})
+            frames = [await anext(stream) for _ in range(3)]
+            broker.publish([self.pushed(self.notifications[-1].id, 'Message 2'), self.pushed(100, 'Pushed')])
+            frames.append(await anext(stream))
+            await stream.aclose()
+            return frames
+
+        retry, first, second, pushed = async_to_sync(read)()
+        self.assertEqual(retry, b'retry: 5000\n\n')
+        self.assertTrue(first.startswith(b'id: %d\nevent: notification\ndata: {' % self.notifications[1].id))
+        self.assertIn(b'"message":"Message 2"', second)
+        # Already sent notifications are not repeated
+        self.assertTrue(pushed.startswith(b'id: 100\n'))
+        self.assertEqual(broker.subscriber_count(), 0)
+
+
+class PatientSearchTests(MedTrackTestCase):
+    def setUp(self):
+        self.admin = create_user('admin_user', 'Admin')
+        self.client.force_authenticate(self.admin)
+        Patient.objects.bulk_create([
+            build_patient(1, first_name='Meera', last_name='Joshi', city='Nashik'),
+            build_patient(2, first_name='Joshua', last_name='Dsouza', city='Pune'),
+            build_patient(3, first_name='Anil', last_name='Kumar', mobile_number='9000012345', city='Pune'),
+            build_patient(4, first_name='Sunita', last_name='Rao', email='joshi.family@example.com', city='Goa'),
+        ])
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('list_create_patient'), {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_search_covers_name_phone_email_and_city(self):
+        self.assertEqual([p['first_name'] for p in self.search('Joshi')['results']], ['Meera', 'Sunita'])
+        self.assertEqual([p['first_name'] for p in self.search('00012345')['results']], ['Anil'])
+        self.assertEqual({p['first_name'] for p in self.search('pune')['results']}, {'Joshua', 'Anil'})
+
+    def test_results_are_ranked_and_paginated(self):
+        # The exact last name match ranks above the prefix and substring matches
+        first = self.search('josh', page_size=1)
+        second = self.client.get(first['next']).data
+        third = self.client.get(second['next']).data
+        names = [page['results'][0]['first_name'] for page in (first, second, third)]
+        self.assertEqual(sorted(names), ['Joshua', 'Meera', 'Sunita'])
+        self.assertIsNone(third['next'])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual([p['first_name'] for p in self.search('anil pune')['results']], ['Anil'])
+        self.assertEqual(self.search('anil goa')['results'], [])
+
+    def test_admin_uses_search_backend(self):
+        self.admin.is_staff = self.admin.is_superuser = True
+        self.admin.save()
+        self.client.force_login(self.admin)
+        response = self.client.get('/admin/medtrack_app/patient/', {'q': '00012345'})
+        self.assertEqual(list(response.context['cl'].queryset.values_list('first_name', flat=True)), ['Anil'])
+        # Results are ordered by rank rather than by name
+        build_patient(5, first_name='Aarav', last_name='Joshiwala').save()
+        response = self.client.get('/admin/medtrack_app/patient/', {'q': 'joshi'})
+        names = list(response.context['cl'].queryset.values_list('first_name', flat=True))
+        self.assertEqual(names[0], 'Meera')
+
+    def test_cursor_keeps_the_exact_rank(self):
+        # Fractional ranks survive the round trip through the cursor: every row shows up once
+        with patch.object(FallbackPatientSearchBackend, 'rank', lambda self, query, terms: Value(1 / 3)):
+            pages = [self.search('o', page_size=1)]
+            while pages[-1]['next']:
+                pages.append(self.client.get(pages[-1]['next']).data)
+        names = [page['results'][0]['first_name'] for page in pages]
+        self.assertEqual(sorted(names), sorted(Patient.objects.values_list('first_name', flat=True)))
+
+
+class ListQueryIndexTests(MedTrackTestCase):
+    def test_list_queries_use_indexes(self):
+        out = StringIO()
+        call_command('explain_list_queries', '--check', stdout=out)
+        for index in ('patient_name_order_idx', 'patient_city_idx', 'procedure_datetime_idx',
+                      'procedure_patient_dt_idx', 'notification_user_ts_idx', 'archived_procedure_dt_idx',
+                      'archived_procedure_patient_idx'):
+            self.assertIn(index, out.getvalue())
+
+    def test_full_index_scans_are_detected(self):
+        # SQLite plan lines start with their id, parent and notused numbers
+        self.assertTrue(explain_list_queries.is_sequential_scan('2 0 0 SCAN medtrack_app_patient'))
+        self.assertFalse(explain_list_queries.is_full_index_scan('2 0 0 SCAN medtrack_app_patient'))
+
+        # SQLite walks an index from one end with SCAN, and seeks into it with SEARCH
+        self.assertTrue(explain_list_queries.is_full_index_scan(
+            '7 0 0 SCAN medtrack_app_procedure USING INDEX procedure_datetime_idx'
+        ))
+        self.assertTrue(explain_list_queries.is_full_index_scan(
+            '5 0 0 SCAN medtrack_app_notification USING COVERING INDEX notification_user_ts_idx'
+        ))
+        self.assertFalse(explain_list_queries.is_full_index_scan(
+            '7 0 0 SEARCH medtrack_app_procedure USING INDEX procedure_datetime_idx (procedure_datetime<?)\n'
+            '16 0 0 SEARCH medtrack_app_patient USING INTEGER PRIMARY KEY (rowid=?)'
+        ))
+
+        # PostgreSQL index scans without an Index Cond read the index from one end
+        self.assertTrue(explain_list_queries.is_full_index_scan(
+            'Limit  (cost=0.29..3.41 rows=51 width=8)\n'
+            '  ->  Index Scan using procedure_datetime_idx on medtrack_app_procedure  (cost=0.29..1808.29 rows=30000 width=8)\n'
+            '        Filter: ((procedure_datetime < \'2024-01-01 00:00:00+00\'::timestamp with time zone) OR '
+            '((procedure_datetime = \'2024-01-01 00:00:00+00\'::timestamp with time zone) AND (id > 1)))'
+        ))
+        self.assertFalse(explain_list_queries.is_full_index_scan(
+            'Limit  (cost=0.29..3.41 rows=51 width=8)\n'
+            '  ->  Index Scan using procedure_datetime_idx on medtrack_app_procedure  (cost=0.29..904.29 rows=15000 width=8)\n'
+            '        Index Cond: (procedure_datetime <= \'2024-01-01 00:00:00+00\'::timestamp with time zone)\n'
+            '  ->  Index Scan using medtrack_app_patient_pkey on medtrack_app_patient  (cost=0.15..0.17 rows=1 width=8)\n'
+            '        Index Cond: (id = medtrack_app_procedure.patient_id)'
+        ))
+
+    def test_check_fails_on_a_deep_page_full_index_scan(self):
+        # Without the leading column bound (the first half of the filter) a deep page walks
+        # the whole index
+        keyset_filter = KeysetPagination._keyset_filter
+        unbounded = lambda self, position: keyset_filter(self, position).children[-1]
+        with patch.object(KeysetPagination, '_keyset_filter', unbounded):
+            with self.assertRaisesMessage(CommandError, '(deep page)'):
+                call_command('explain_list_queries', '--check', stdout=StringIO())
+
+
+@override_settings(MEDTRACK_AUTH_CACHE='default')
+class RoleResolutionTests(MedTrackTestCase):
+    def setUp(self):
+        self.doctor = create_user('doctor_user', 'Doctor')
+
+    def login(self):
+        credentials = base64.b64encode(b'doctor_user:Passw0rd!').decode()
+        response = self.client.post(reverse('token_obtain_pair'), HTTP_AUTHORIZATION=credentials)
+        self.assertEqual(response.data['role'], 'Doctor')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+    def test_token_roles_claim_skips_group_queries(self):
+        self.login()
+        self.client.get(reverse('list_create_procedure'))
+        # With the user cached and the page in the response cache, only the table versions
+        # are read: neither the user, their groups nor their auth version
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('list_create_procedure'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_group_change_invalidates_token_roles(self):
+        self.login()
+        self.doctor.groups.clear()
+        self.assertEqual(self.client.get(reverse('list_create_procedure')).status_code, 403)
+
+    def test_evicted_versions_do_not_trust_old_claims(self):
+        self.login()
+        self.doctor.groups.clear()
+        # The version keys are gone (evicted, or the cache restarted)
+        cache.clear()
+        self.assertEqual(self.client.get(reverse('list_create_procedure')).status_code, 403)
+
+    @override_settings(MEDTRACK_AUTH_CACHE=None)
+    def test_claims_are_not_trusted_without_a_shared_cache(self):
+        self.login()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('list_create_procedure')).status_code, 200)
+        self.assertTrue([q for q in queries.captured_queries if 'auth_group' in q['sql']])
+        self.doctor.groups.clear()
+        self.assertEqual(self.client.get(reverse('list_create_procedure')).status_code, 403)
+
+    def test_roles_are_loaded_once_per_user_object(self):
+        self.client.force_authenticate(self.doctor)
+        with self.assertNumQueries(3):
+            # Admin | Doctor is checked with a single group lookup, then the table versions
+            # and the page query
+            self.client.get(reverse('list_create_procedure'))
+
+
+@override_settings(MEDTRACK_AUTH_CACHE='default')
+class CachedUserAuthenticationTests(MedTrackTestCase):
+    def setUp(self):
+        self.doctor = create_user('doctor_user', 'Doctor')
+        credentials = base64.b64encode(b'doctor_user:Passw0rd!').decode()
+        access = self.client.post(reverse('token_obtain_pair'), HTTP_AUTHORIZATION=credentials).data['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        user_cache.discard()
+
+    def get_user_info(self, queries):
+        # user_info for a doctor only renders the request user, so every query is auth
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse('user_info'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_is_loaded_once(self):
+        hits = user_cache.hits
+        self.get_user_info(1)
+        self.get_user_info(0)
+        self.assertEqual(user_cache.hits, hits + 1)
+
+    @override_settings(MEDTRACK_AUTH_CACHE=None)
+    def test_user_is_loaded_every_time_without_a_shared_cache(self):
+        # The user and the groups behind the token's roles claim
+        self.get_user_info(2)
+        self.get_user_info(2)
+
+    def test_deactivation_invalidates_cached_user(self):
+        self.get_user_info(1)
+        self.doctor.is_active = False
+        self.doctor.save()
+        self.assertEqual(self.client.get(reverse('user_info')).status_code, 401)
+
+    def test_group_change_invalidates_cached_user(self):
+        self.get_user_info(1)
+        self.doctor.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        # The user and, as the roles claim is out of date, their groups
+        self.get_user_info(2)
+
+    def test_evicted_versions_do_not_trust_cached_users(self):
+        self.get_user_info(1)
+        User.objects.filter(pk=self.doctor.pk).update(is_active=False)
+        cache.clear()
+        self.assertEqual(self.client.get(reverse('user_info')).status_code, 401)
+
+    def test_changes_made_by_other_processes_are_seen(self):
+        # Another process deactivates the user: only the shared cache tells this one
+        self.get_user_info(1)
+        User.objects.filter(pk=self.doctor.pk).update(is_active=False)
+        with patch.object(user_cache, 'discard'):
+            invalidate_users([self.doctor.pk])
+        self.assertEqual(self.client.get(reverse('user_info')).status_code, 401)
+
+    def test_per_process_auth_cache_is_reported(self):
+        self.assertEqual([warning.id for warning in check_auth_cache(None)], ['medtrack_app.W001'])
+        with override_settings(MEDTRACK_AUTH_CACHE=None):
+            self.assertEqual(check_auth_cache(None), [])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(check_auth_cache(None), [])
+
+
+class PatientImportTests(MedTrackTestCase):
+    def setUp(self):
+        self.front_desk = create_user('front_desk_user', 'Front_Desk')
+        self.client.force_authenticate(self.front_desk)
+        self.columns = [
+            'first_name', 'last_name', 'mobile_number', 'address', 'gender', 'birthdate', 'email', 'city',
+            'state', 'pincode', 'emergency_contact_name', 'emergency_contact_mobile_number', 'language',
+        ]
+
+    def row(self, index, **kwargs):
+        row = {
+            'first_name': f'First{index}', 'last_name': 'Patil', 'mobile_number': '9876543210',
+            'address': '12 MG Road', 'gender': 'f', 'birthdate': '1990-01-01',
+            'email': f'patient{index}@example.com', 'city': 'Pune', 'state': 'Maharashtra', 'pincode': '411001',
+            'emergency_contact_name': 'Ravi', 'emergency_contact_mobile_number': '9123456780',
+            'language': 'Marathi',
+        }
+        row.update(kwargs)
+        return row
+
+    def upload(self, name, content, **params):
+        upload = SimpleUploadedFile(name, content if isinstance(content, bytes) else content.encode())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('import_patients'), {'file': upload, **params}, format='multipart')
+        dispatcher.drain()
+        return response
+
+    def test_csv_import_reports_bad_rows(self):
+        rows = [self.row(1), self.row(2, gender='x'), self.row(3, mobile_number='123'), self.row(4)]
+        lines = [','.join(self.columns)] + [','.join(row[column] for column in self.columns) for row in rows]
+        response = self.upload('patients.csv', '\n'.join(lines))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual([error['line'] for error in response.data['errors']], [3, 4])
+        self.assertIn('gender', response.data['errors'][0]['errors'])
+        self.assertEqual(Patient.objects.get(first_name='First1').gender, 'Female')
+        self.assertEqual(counters.read_counters()[0]['total_patients'], 2)
+        self.assertEqual(Notification.objects.get().message, '2 patient records have been imported.')
+
+    def test_unreadable_csv_is_reported(self):
+        lines = [','.join(self.columns)] + [','.join(self.row(i)[column] for column in self.columns) for i in range(2)]
+        # A field over the csv module's size limit breaks the parser after two good rows
+        content = '\n'.join(lines + ['"' + 'x' * 200000 + '"']).encode()
+        response = self.upload('patients.csv', content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'][0]['line'], 4)
+        self.assertIn('Malformed CSV', response.data['errors'][0]['errors']['file'][0])
+        self.assertEqual(Patient.objects.count(), 2)
+
+        response = self.upload('patients.csv', ','.join(self.columns).encode() + b'\nJos\xe9,Patil\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 0)
+        self.assertIn('not valid UTF-8', response.data['errors'][0]['errors']['file'][0])
+
+    def test_ndjson_import_in_chunks(self):
+        lines = [json.dumps(self.row(i)) for i in range(5)] + ['not json']
+        with patch.object(PatientImporter, 'chunk_size', 2):
+            response = self.upload('patients.txt', '\n'.join(lines), format='ndjson')
+
+        self.assertEqual(response.data['created'], 5)
+        self.assertEqual(response.data['errors'][0]['line'], 6)
+        self.assertEqual(Patient.objects.count(), 5)
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_ndjson_errors_are_reported_and_capped(self):
+        # A non-string gender is a row error, not a crash
+        lines = [json.dumps(self.row(1, gender=1))] + [json.dumps(self.row(i, gender='x')) for i in range(2, 5)]
+        with patch.object(PatientImporter, 'max_errors', 2):
+            response = self.upload('patients.ndjson', '\n'.join(lines))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['failed']), (0, 4))
+        self.assertEqual([error['line'] for error in response.data['errors']], [1, 2])
+        self.assertIn('gender', response.data['errors'][0]['errors'])
+        self.assertEqual(response.data['errors_omitted'], 2)
+
+    def test_management_command(self):
+        rows = [self.row(1), self.row(2, email='not-an-email')]
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as file:
+            file.write('\n'.join(json.dumps(row) for row in rows))
+        stdout, stderr = StringIO(), StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_patients', file.name, user=self.front_desk.username, stdout=stdout, stderr=stderr)
+        os.remove(file.name)
+
+        self.assertIn('Imported 1 patients, 1 rows failed.', stdout.getvalue())
+        self.assertIn('Line 2:', stderr.getvalue())
+        self.assertEqual(Patient.objects.count(), 1)
+
+    def test_doctor_cannot_import(self):
+        self.client.force_authenticate(create_user('doctor_user', 'Doctor'))
+        response = self.upload('patients.csv', ','.join(self.columns))
+        self.assertEqual(response.status_code, 403)
+
+
+class ExportTests(MedTrackTestCase):
+    def setUp(self):
+        self.admin = create_user('admin_user', 'Admin')
+        self.client.force_authenticate(self.admin)
+        patients = Patient.objects.bulk_create(build_patient(i) for i in range(3))
+        Procedure.objects.bulk_create([
+            build_procedure(patients[0], self.admin, 1, status='completed', procedure_datetime=timezone.now() - timedelta(days=10)),
+            build_procedure(patients[1], self.admin, 2, status='on-hold', category='surgical'),
+            build_procedure(patients[2], self.admin, 3, status='completed', notes='Line one,\nline two'),
+        ])
+
+    def download(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content), response
+
+    def test_csv_export_streams_every_row(self):
+        content, response = self.download('export_patients')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(StringIO(content.decode())))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['email'], 'patient0@example.com')
+
+    def test_export_streams_under_asgi(self):
+        # Served from an async iterator, not collected into a list before sending
+        with patch('medtrack_app.exporters.BUFFER_SIZE', 1):
+            response, content = asgi_get(self.admin, reverse('export_procedures'), {'format': 'ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(len(content.decode().splitlines()), 3)
+
+    def test_ndjson_export_with_filters(self):
+        content, _ = self.download('export_procedures', format='ndjson', status='Completed')
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([row['procedure_name'] for row in rows], ['Procedure 1', 'Procedure 3'])
+        self.assertEqual(rows[1]['notes'], 'Line one,\nline two')
+
+        start = (timezone.localdate() - timedelta(days=1)).isoformat()
+        content, _ = self.download('export_procedures', format='ndjson', start_date=start, category='surgical')
+        self.assertEqual([json.loads(line)['procedure_name'] for line in content.decode().splitlines()], ['Procedure 2'])
+
+    def test_gzip_export(self):
+        content, response = self.download('export_procedures', gzip='true')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('procedures.csv.gz', response['Content-Disposition'])
+        rows = list(csv.DictReader(StringIO(gzip.decompress(content).decode())))
+        self.assertEqual(len(rows), 3)
+
+    def test_invalid_filters(self):
+        self.assertEqual(self.client.get(reverse('export_procedures'), {'status': 'done'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_procedures'), {'end_date': '01/02/2024'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_procedures'), {'format': 'xml'}).status_code, 400)
+
+    def test_management_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'patients.ndjson.gz')
+            call_command('export_data', 'patients', output=path, format='ndjson', gzip=True, chunk_size=2)
+            with gzip.open(path, 'rt') as file:
+                self.assertEqual(len(file.readlines()), 3)
+
+
+@override_settings(MEDTRACK_SYNC_OVERLAP=0)
+class DeltaSyncTests(MedTrackTestCase):
+    def setUp(self):
+        self.admin = create_user('admin_user', 'Admin')
+        self.client.force_authenticate(self.admin)
+        self.patients = [build_patient(i) for i in range(3)]
+        for patient in self.patients:
+            patient.save()
+
+    def sync(self, name, watermark=None, **params):
+        if watermark:
+            params['watermark'] = watermark
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_initial_sync_is_paged(self):
+        first = self.sync('sync_patients', page_size=2)
+        self.assertEqual(len(first['results']), 2)
+        self.assertTrue(first['has_more'])
+
+        second = self.sync('sync_patients', first['watermark'], page_size=2)
+        self.assertEqual([row['id'] for row in second['results']], [self.patients[2].id])
+        self.assertFalse(second['has_more'])
+
+        self.assertEqual(self.sync('sync_patients', second['watermark'])['results'], [])
+
+    def test_changes_and_deletions_since_watermark(self):
+        watermark = self.sync('sync_patients')['watermark']
+        procedure = build_procedure(self.patients[1], self.admin, 1)
+        procedure.save()
+        procedure_watermark = self.sync('sync_procedures')['watermark']
+
+        deleted_id, procedure_id = self.patients[1].id, procedure.id
+        self.patients[0].city = 'Nashik'
+        self.patients[0].save()
+        self.patients[1].delete()
+
+        data = self.sync('sync_patients', watermark)
+        self.assertEqual([row['city'] for row in data['results']], ['Nashik'])
+        self.assertEqual(data['deleted'], [deleted_id])
+        # The procedure went with its patient
+        self.assertEqual(self.sync('sync_procedures', procedure_watermark)['deleted'], [procedure_id])
+
+    @override_settings(MEDTRACK_SYNC_OVERLAP=60)
+    def test_recent_changes_are_sent_again(self):
+        watermark = self.sync('sync_patients')['watermark']
+        self.assertEqual(len(self.sync('sync_patients', watermark)['results']), 3)
+
+    def test_invalid_watermark(self):
+        response = self.client.get(reverse('sync_patients'), {'watermark': 'not-a-watermark'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncViewTests(MedTrackTestCase):
+    def setUp(self):
+        self.admin = create_user('admin_user', 'Admin')
+        self.factory = APIRequestFactory()
+        patients = Patient.objects.bulk_create(build_patient(i) for i in range(3))
+        report = SimpleUploadedFile('report.pdf', b'%PDF-1.4 report')
+        self.media = tempfile.TemporaryDirectory()
+        with self.settings(MEDIA_ROOT=self.media.name):
+            build_procedure(patients[0], self.admin, 1, report=report).save()
+        build_procedure(patients[1], self.admin, 2).save()
+        Notification.objects.create(user=self.admin, message='Hello')
+        counters.increment('total_patients', 3)
+
+    def tearDown(self):
+        super().tearDown()
+        self.media.cleanup()
+
+    def call(self, view_class, method='get', path='/', data=None):
+        request = getattr(self.factory, method)(path, data)
+        force_authenticate(request, user=User.objects.get(pk=self.admin.pk))
+        view = view_class.as_view()
+        response = async_to_sync(view)(request) if view_class.view_is_async else view(request)
+        return response.render() if hasattr(response, 'render') else response
+
+    def assertSameAsSync(self, async_view, sync_view, path='/', data=None):
+        async_response = self.call(async_view, path=path, data=data)
+        sync_response = self.call(sync_view, path=path, data=data)
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response.content, sync_response.content)
+
+    def test_async_views_match_sync_views(self):
+        self.assertSameAsSync(async_views.AsyncNotificationView, views.NotificationView)
+        self.assertSameAsSync(async_views.AsyncAdminStatView, views.AdminStatView)
+        self.assertSameAsSync(async_views.AsyncPatientView, views.PatientView, data={'page_size': 2})
+        self.assertSameAsSync(async_views.AsyncPatientView, views.PatientView, data={'search': 'First00001'})
+        with self.settings(MEDIA_ROOT=self.media.name):
+            self.assertSameAsSync(async_views.AsyncProcedureView, views.ProcedureView, data={'report_base64': 'true'})
+        self.assertSameAsSync(async_views.AsyncProcedureView, views.ProcedureView,
+                              data={'fields': 'id,patient.city', 'expand': 'created_by'})
+        self.assertSameAsSync(async_views.AsyncNotificationView, views.NotificationView, data={'fields': 'id,message'})
+
+    def test_writes_fall_back_to_sync_view(self):
+        response = self.call(async_views.AsyncPatientView, method='post', data={'gender': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('gender', response.data)
+
+
+class SyntheticDataBenchmarkTests(MedTrackTestCase):
+    def generate(self, seed, reports=False):
+        SyntheticDataGenerator(seed=seed, batch_size=7).generate(
+            patients=10, procedures_per_patient=3, users_per_role=1, notifications_per_user=2, reports=reports,
+        )
+        return (
+            list(Patient.objects.order_by('id').values_list('first_name', 'last_name', 'city', 'birthdate')),
+            list(Procedure.objects.order_by('id').values_list('patient__email', 'status', 'category', 'procedure_datetime')),
+        )
+
+    def test_generator_is_deterministic(self):
+        first = self.generate(seed=1)
+        Patient.objects.all().delete()
+        self.assertEqual(self.generate(seed=1), first)
+        self.assertEqual(len(first[1]), 30)
+        self.assertEqual(counters.read_counters()[0]['total_procedures'], 30)
+
+    def test_benchmark_covers_every_endpoint(self):
+        stdout = StringIO()
+        hits = caching.response_cache.stats()['hits']
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            self.generate(seed=0, reports=True)
+            call_command('benchmark_endpoints', iterations=2, warmup=0, stdout=stdout)
+        results = json.loads(stdout.getvalue())
+        # Repeated list requests were measured against the database, not the response cache
+        self.assertFalse(results['environment']['response_cache'])
+        self.assertEqual(caching.response_cache.stats()['hits'], hits)
+        self.assertIsNotNone(caching.response_cache)
+
+        self.assertEqual(results['not_benchmarked'], [])
+        for label, result in results['endpoints'].items():
+            self.assertLess(result['status'], 400, label)
+            self.assertGreater(result['queries'], 0, label)
+        # The rolled back writes left the data set untouched
+        self.assertEqual(Patient.objects.count(), 10)
+
+
+@override_settings(MEDTRACK_INSTRUMENTATION=True)
+class InstrumentationTests(MedTrackTestCase):
+    def setUp(self):
+        instrumentation.registry.reset()
+        self.admin = create_user('admin_user', 'Admin')
+        self.client.force_authenticate(self.admin)
+        patients = Patient.objects.bulk_create(build_patient(i) for i in range(3))
+        Procedure.objects.bulk_create(build_procedure(patient, self.admin, i) for i, patient in enumerate(patients))
+
+    def test_metrics_are_recorded_per_url_name(self):
+        response = self.client.get(reverse('list_create_procedure'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="3 queries"', response['Server-Timing'])
+
+        stats = instrumentation.registry.snapshot()['list_create_procedure']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['sql']['queries_max'], 3)
+        self.assertGreater(stats['serializer_ms_mean'], 0)
+        self.assertEqual(stats['response_bytes_mean'], len(response.content))
+        self.assertEqual(sum(stats['latency_ms']['histogram'].values()), 1)
+
+    def test_streamed_responses_are_recorded_once_sent(self):
+        response = self.client.get(reverse('export_patients'))
+        self.assertNotIn('export_patients', instrumentation.registry.snapshot())
+        content = b''.join(response.streaming_content)
+
+        stats = instrumentation.registry.snapshot()['export_patients']
+        self.assertEqual(stats['response_bytes_mean'], len(content))
+        # The role lookup and the export query, run while streaming
+        self.assertEqual(stats['sql']['queries_max'], 2)
+
+    def test_diagnostics_endpoint_is_admin_only(self):
+        self.client.get(reverse('list_create_patient'))
+        response = self.client.get(reverse('admin-instrumentation'))
+        self.assertTrue(response.data['enabled'])
+        self.assertIn('list_create_patient', response.data['endpoints'])
+        self.assertIn('hit_ratio', response.data['user_cache'])
+
+        self.client.delete(reverse('admin-instrumentation'))
+        self.assertEqual(list(instrumentation.registry.snapshot()), ['admin-instrumentation'])
+
+        self.client.force_authenticate(create_user('doctor_user', 'Doctor'))
+        self.assertEqual(self.client.get(reverse('admin-instrumentation')).status_code, 403)
+
+    @override_settings(MEDTRACK_INSTRUMENTATION=False)
+    def test_disabled_by_default(self):
+        self.client = self.client_class()
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('list_create_procedure'))
+        self.assertFalse(response.has_header('Server-Timing'))
@@ -1,13 +1,44 @@
+from django.conf import settings
 from django.urls import path
 from . import views
+
+# List endpoints with an async variant, used when running under ASGI
+if settings.MEDTRACK_ASYNC_VIEWS:
+    from . import async_views
+    NotificationView = async_views.AsyncNotificationView
+    NotificationStreamView = async_views.AsyncNotificationStreamView
+    NotificationUnreadCountView = async_views.AsyncNotificationUnreadCountView
+    AdminStatView = async_views.AsyncAdminStatView
+    PatientView = async_views.AsyncPatientView
+    ProcedureView = async_views.AsyncProcedureView
+else:
+    NotificationView = views.NotificationView
+    NotificationStreamView = views.NotificationStreamView
+    NotificationUnreadCountView = views.NotificationUnreadCountView
+    AdminStatView = views.AdminStatView
+    PatientView = views.PatientView
+    ProcedureView = views.ProcedureView
+
 urlpatterns = [
     path('register/', views.RegisterView.as_view(), name='register'),
     path('login/', views.CustomLoginView.as_view(), name='token_obtain_pair'),
     path('logout/', views.LogoutView.as_view(), name='logout'),
     path('user/', views.UserInfoView.as_view(), name='user_info'),
-    path('notifications/', views.NotificationView.as_view(), name='list_notifications'),
-    path('admin-stat/', views.AdminStatView.as_view(), name='admin-stats'),
-    path('patients/', views.PatientView.as_view(), name='list_create_patient'),
-    path('procedures/', views.ProcedureView.as_view(), name='list_create_procedure'),
+    path('notifications/', NotificationView.as_view(), name='list_notifications'),
+    path('notifications/stream/', NotificationStreamView.as_view(), name='stream_notifications'),
+    path('notifications/unread-count/', NotificationUnreadCountView.as_view(), name='notification_unread_count'),
+    path('notifications/bulk/', views.NotificationBulkView.as_view(), name='bulk_notifications'),
+    path('admin-stat/', AdminStatView.as_view(), name='admin-stats'),
+    path('admin-stat/instrumentation/', views.InstrumentationView.as_view(), name='admin-instrumentation'),
+    path('patients/', PatientView.as_view(), name='list_create_patient'),
+    path('patients/import/', views.PatientImportView.as_view(), name='import_patients'),
+    path('patients/export/', views.PatientExportView.as_view(), name='export_patients'),
+    path('patients/sync/', views.PatientSyncView.as_view(), name='sync_patients'),
+    path('procedures/', ProcedureView.as_view(), name='list_create_procedure'),
+    path('procedures/bulk/', views.ProcedureBulkCreateView.as_view(), name='bulk_create_procedures'),
+    path('procedures/bulk-status/', views.ProcedureBulkStatusView.as_view(), name='bulk_update_procedure_status'),
+    path('procedures/export/', views.ProcedureExportView.as_view(), name='export_procedures'),
+    path('procedures/sync/', views.ProcedureSyncView.as_view(), name='sync_procedures'),
     path('procedures/<int:pk>/', views.ProcedureView.as_view(), name='update_procedure'),
+    path('procedures/<int:pk>/report/', views.ProcedureReportView.as_view(), name='procedure_report'),
 ]
@@ -1,15 +1,160 @@
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import UploadedFile
+from django.http import StreamingHttpResponse
+from django.utils.http import content_disposition_header
 from rest_framework import status, permissions
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 import base64
-from .models import Notification, AdminStat, Patient, Procedure
+import os
+from .models import ArchivedProcedure, Notification, Patient, Procedure
 from .serializers import NotificationSerializer, AdminStatSerializer, PatientSerializer, ProcedureSerializer, UserSerializer
+from .serializers import GENDER_MAPPING, GENDER_ERROR, NotificationBulkActionSerializer, parse_field_selection
+from .fast_serializers import PatientValuesSerializer, ProcedureValuesSerializer
+from .renderers import FastJSONRenderer
 from .signals import patient_created
+from .notifications import broker
+from . import caching, counters, instrumentation
+from .pagination import KeysetPagination
+from .search import search_patients
+from .importers import IMPORT_FORMATS, PatientImporter, guess_format, iter_rows
+from .bulk import ProcedureBulkCreator, ProcedureStatusUpdater
+from .exporters import CONTENT_TYPES, EXPORT_FORMATS, EXPORTS, iter_export
+from .sync import DeltaSync, InvalidWatermark
 from .permissions import IsAdmin, IsDoctor, IsFrontDesk
+from .roles import add_role_claims, get_request_roles, get_role
+from .streaming import ranged_file_response, stream_for
+from .authentication import user_cache
+
+
+def get_field_selection(request):
+    # Keyword arguments selecting the fields a list renders, from ?fields= and ?expand=
+    return parse_field_selection(request.query_params)
+
+
+def get_procedure_context(request):
+    # Report files are only inlined as base64 when the caller asks for them with
+    # ?report_base64=true or by selecting the field
+    include = request.query_params.get('report_base64', '').lower() in ('1', 'true', 'yes')
+    include = include or 'report_base64' in get_field_selection(request).get('fields', {})
+    return {'include_report_base64': include}
+
+
+def get_patient_queryset(request):
+    # Patients matching the list filters, and the ordering to page them in (None for the default)
+    name = request.query_params.get('name', None)
+    patient_city = request.query_params.get('city', None)
+    search = request.query_params.get('search', None)
+
+    # Filter patients by name and city if provided
+    if name and patient_city:
+        patients = Patient.objects.filter(first_name__icontains=name, city=patient_city)
+    elif name:
+        patients = Patient.objects.filter(first_name__icontains=name)
+    elif patient_city:
+        patients = Patient.objects.filter(city=patient_city)
+    else:
+        patients = Patient.objects.all()
+
+    # Rank patients matching the search terms in their name, phone, email or city
+    if search:
+        return search_patients(patients, search), ['-rank', 'id']
+    return patients, None
+
+
+def get_procedure_queryset(request):
+    # Procedures matching the list filters, from the archive with ?archived=true
+    archived = request.query_params.get('archived', '').lower() in ('1', 'true', 'yes')
+    model = ArchivedProcedure if archived else Procedure
+    patient_id = request.query_params.get('patient_id')
+    if patient_id:
+        # Filter procedures by patient ID
+        procedures = model.objects.filter(patient_id=patient_id)
+    else:
+        # Retrieve all procedures if no patient ID is provided
+        procedures = model.objects.all()
+    return procedures
+
+
+def get_ordering_columns(ordering):
+    # Columns a page has to be read with to build the cursors of a custom ordering
+    return [name.lstrip('-') for name in ordering or []]
+
+
+def get_notification_selection(request):
+    # Every notification listed belongs to the caller, so the user is rendered as its id
+    # unless asked for with ?expand=user or ?fields=user.<field>
+    selection = get_field_selection(request)
+    selection.setdefault('expand', set())
+    return selection
+
+
+def get_notification_queryset(request):
+    # The caller's notifications, only the read or unread ones with ?is_read=
+    notifications = Notification.objects.filter(user=request.user)
+    is_read = request.query_params.get('is_read', '').lower()
+    if is_read in ('1', 'true', 'yes'):
+        notifications = notifications.filter(is_read=True)
+    elif is_read in ('0', 'false', 'no'):
+        notifications = notifications.filter(is_read=False)
+    return notifications
+
+
+# Most notifications a stream or poll response catches up on at once
+NOTIFICATION_STREAM_BATCH_SIZE = 100
+
+
+def get_stream_position(request):
+    # The id of the last notification the client has seen, from the Last-Event-ID header
+    # (sent by EventSource when it reconnects) or ?last_event_id=, and how long (seconds)
+    # a poll may wait for new ones, from ?timeout=. Raises ValueError for invalid values.
+    last_event_id = request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id')
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            raise ValueError("Invalid last event id.") from None
+    max_timeout = getattr(settings, 'MEDTRACK_NOTIFICATION_POLL_TIMEOUT', 25)
+    try:
+        timeout = float(request.query_params.get('timeout', max_timeout))
+    except ValueError:
+        raise ValueError("Invalid timeout.") from None
+    return last_event_id, min(max(timeout, 0), max_timeout)
+
+
+def get_latest_notification_id(user):
+    # Clients that have not seen any notification are streamed the ones written from now on
+    return Notification.objects.filter(user=user).order_by('-id').values_list('id', flat=True)
+
+
+def get_missed_notifications(user, last_event_id):
+    # The user's notifications after `last_event_id`, as (id, message, timestamp, is_read)
+    # entries
+    return (
+        Notification.objects.filter(user=user, id__gt=last_event_id).order_by('id')
+        .values_list('id', 'message', 'timestamp', 'is_read')[:NOTIFICATION_STREAM_BATCH_SIZE]
+    )
+
+
+def render_notifications(user, entries, selection):
+    # Serialize (id, message, timestamp, is_read) entries of the user's notifications
+    notifications = [
+        Notification(id=notification_id, user=user, message=message, timestamp=timestamp, is_read=is_read)
+        for notification_id, message, timestamp, is_read in entries
+    ]
+    return NotificationSerializer(notifications, many=True, **selection).data
+
+
+def get_poll_data(user, entries, last_event_id, selection):
+    # Long-poll response: the new notifications and the id to poll from next
+    return {
+        'results': render_notifications(user, entries, selection),
+        'last_event_id': max([last_event_id, *(entry[0] for entry in entries)]),
+    }
 
 
 class CustomLoginView(APIView):
@@ -31,13 +176,13 @@ class CustomLoginView(APIView):
         if user is None:
             return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
 
-        # Generate JWT tokens
-        refresh = RefreshToken.for_user(user)
+        # Generate JWT tokens carrying the user's roles, so permission checks need no queries
+        refresh = add_role_claims(RefreshToken.for_user(user), user)
         access_token = str(refresh.access_token)
         refresh_token = str(refresh)
 
         # Get the user's role from their group
-        role = user.groups.first().name
+        role = get_role(user)
 
         # Return user details along with the generated tokens
         return Response({
@@ -87,15 +232,15 @@ class UserInfoView(APIView):
     def get(self, request):
         # Retrieve the current user and their role
         user = request.user
-        role = user.groups.first().name
+        roles = get_request_roles(request)
+        role = roles[0] if roles else None
         
         if role == "Admin":
             # If the user is an Admin, return a list of all users
-            users = User.objects.all()
+            users = User.objects.prefetch_related('groups')
             users_data = []
             for usr in users:
-                user_group = usr.groups.first()
-                user_role = user_group.name
+                user_role = get_role(usr)
                 users_data.append({
                     'id': usr.id,
                     'username': usr.username,
@@ -117,73 +262,165 @@ class NotificationView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        # Retrieve notifications for the authenticated user
-        user = request.user
-        notifications = Notification.objects.filter(user=user)
-
-        if not notifications:
+        # Retrieve a page of notifications for the authenticated user, newest first, loading
+        # only the selected fields
+        selection = get_notification_selection(request)
+        notifications = NotificationSerializer(**selection).setup_eager_loading(
+            get_notification_queryset(request), 'timestamp', 'id',
+        )
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(notifications, request)
+
+        if not page and paginator.position is None:
             return Response({"detail": "No notifications available."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Serialize and return the notifications
-        serializer = NotificationSerializer(notifications, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # Serialize and return the page
+        serializer = NotificationSerializer(page, many=True, **selection)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class NotificationUnreadCountView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        # Counted from the partial index on unread notifications, without touching the rows
+        unread = Notification.objects.filter(user=request.user, is_read=False).count()
+        return Response({"unread": unread}, status=status.HTTP_200_OK)
+
+
+class NotificationBulkView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        # Mark the selected notifications of the caller read or unread, or delete them, with
+        # a single UPDATE or DELETE statement
+        serializer = NotificationBulkActionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        action = serializer.validated_data['action']
+        notifications = serializer.filter(Notification.objects.filter(user=request.user))
+        if action == 'delete':
+            count, _ = notifications.delete()
+        else:
+            # Only rows that change are written
+            is_read = action == 'read'
+            count = notifications.filter(is_read=not is_read).update(is_read=is_read)
+        return Response({"action": action, "count": count}, status=status.HTTP_200_OK)
+
+
+class NotificationStreamView(APIView):
+    # Long-poll for new notifications: answers right away with the notifications after
+    # Last-Event-ID (or ?last_event_id=) if there are any, else waits up to ?timeout=
+    # seconds for the next ones to be written. Waiting clients are woken by the notification
+    # broker instead of querying the database. Under ASGI the async variant also serves
+    # them as a server-sent event stream.
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            last_event_id, timeout = get_stream_position(request)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        # Reject unknown fields before waiting
+        selection = get_notification_selection(request)
+        NotificationSerializer(**selection)
+
+        # Subscribe before reading the database, so nothing written in between is missed
+        subscription = broker.subscribe(request.user.id)
+        try:
+            if last_event_id is None:
+                last_event_id = get_latest_notification_id(request.user).first() or 0
+                entries = []
+            else:
+                entries = list(get_missed_notifications(request.user, last_event_id))
+
+            if not entries and timeout and subscription.wait(timeout):
+                entries, stale = subscription.take()
+                if stale:
+                    entries = list(get_missed_notifications(request.user, last_event_id))
+        finally:
+            broker.unsubscribe(subscription)
+
+        data = get_poll_data(request.user, entries, last_event_id, selection)
+        return Response(data, status=status.HTTP_200_OK)
 
 
 class AdminStatView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsAdmin]
 
     def get(self, request):
-        try:
-            # Retrieve the AdminStat object
-            admin_stat = AdminStat.objects.get()
-        except AdminStat.DoesNotExist:
+        # Sum the sharded counters into an AdminStat object
+        admin_stat = counters.get_admin_stat()
+        if admin_stat is None:
             return Response({"detail": "No admin stats available."}, status=status.HTTP_404_NOT_FOUND)
 
+        # Answer conditional requests without serializing
+        etag, last_updated = caching.get_admin_stat_validators(request, admin_stat)
+        response = caching.not_modified(request, etag, last_updated)
+        if response is not None:
+            return response
+
         # Serialize and return the AdminStat data
         serializer = AdminStatSerializer(admin_stat)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return caching.set_validators(Response(serializer.data, status=status.HTTP_200_OK), etag, last_updated)
     
 
+class InstrumentationView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        # Per endpoint request metrics collected by InstrumentationMiddleware in this process,
+        # and the hit ratios of the list response cache and of the authenticated user cache
+        cache = caching.response_cache
+        return Response({
+            'enabled': settings.MEDTRACK_INSTRUMENTATION,
+            'endpoints': instrumentation.registry.snapshot(),
+            'response_cache': cache.stats() if cache is not None else None,
+            'user_cache': user_cache.stats(),
+        }, status=status.HTTP_200_OK)
+
+    def delete(self, request):
+        # Start collecting from scratch
+        instrumentation.registry.reset()
+        if caching.response_cache is not None:
+            caching.response_cache.reset_stats()
+        user_cache.reset_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class PatientView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsAdmin | IsFrontDesk]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    # Tables the list is rendered from, for its ETag and cache entries
+    version_tables = ['patient']
 
     def get(self, request):
-        # Handle GET requests to list patients
-        name = request.query_params.get('name', None)
-        patient_city = request.query_params.get('city', None)
-
-        # Filter patients by name and city if provided
-        if name and patient_city:
-            patients = Patient.objects.filter(first_name__icontains=name, city=patient_city)
-        elif name:
-            patients = Patient.objects.filter(first_name__icontains=name)
-        elif patient_city:
-            patients = Patient.objects.filter(city=patient_city)
-        else:
-            patients = Patient.objects.all()
-
-        # Serialize and return the list of patients
-        serializer = PatientSerializer(patients, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # Handle GET requests to list patients, answering conditional requests and repeated
+        # queries without running the list query
+        return caching.cached_list_response(request, self.version_tables, lambda: self.get_page_data(request))
+
+    def get_page_data(self, request):
+        patients, ordering = get_patient_queryset(request)
+
+        # Serialize a single page of patients, read as .values() rows
+        serializer = PatientValuesSerializer(**get_field_selection(request))
+        rows = serializer.values(patients, *get_ordering_columns(ordering))
+        paginator = KeysetPagination(ordering=ordering)
+        page = paginator.paginate_queryset(rows, request, view=self)
+        with instrumentation.timed_serializer():
+            data = serializer.many(page)
+        return paginator.get_paginated_data(data)
 
     def post(self, request):
         # Handle POST requests to create a new patient
-        gender_mapping = {
-            'M': 'Male',
-            'F': 'Female',
-            'O': 'Other',
-            'Male': 'Male',
-            'Female': 'Female',
-            'Other': 'Other'
-        }
-
         # Handle full name and abbreviated case insentive genders inputs
         data = request.data.copy()
         gender = data.get('gender').capitalize()
         if gender:
-            if gender not in gender_mapping:
-                return Response({"gender": "Gender must be one of the following: Male, Female, Others or M, F, O"}, status=status.HTTP_400_BAD_REQUEST)
-            data['gender'] = gender_mapping[gender]
+            if gender not in GENDER_MAPPING:
+                return Response({"gender": GENDER_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+            data['gender'] = GENDER_MAPPING[gender]
 
         serializer = PatientSerializer(data=data)
         if serializer.is_valid():
@@ -196,25 +433,133 @@ class PatientView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class PatientImportView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin | IsFrontDesk]
+
+    def post(self, request):
+        # Handle POST requests to import patients from an uploaded CSV or NDJSON file
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"file": "A CSV or NDJSON file is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = request.data.get('format') or guess_format(upload.name)
+        if file_format not in IMPORT_FORMATS:
+            return Response({"format": "Format must be one of: csv, ndjson."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Stream the rows from the upload, which Django spools to disk when it is large
+        importer = PatientImporter(created_by=request.user)
+        report = importer.run(iter_rows(upload.file, file_format))
+        return Response(report, status=status.HTTP_200_OK)
+
+
+class ExportView(APIView):
+    # Streams every row of a model as CSV or NDJSON, optionally gzipped. Subclasses pick
+    # the export from exporters.EXPORTS.
+    export = None
+
+    def perform_content_negotiation(self, request, force=False):
+        # `format` selects the export format rather than a renderer
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request):
+        # Handle GET requests to download a filtered export
+        file_format = request.query_params.get('format', 'csv')
+        if file_format not in EXPORT_FORMATS:
+            return Response({"detail": "Format must be one of: csv, ndjson."}, status=status.HTTP_400_BAD_REQUEST)
+
+        build_queryset, fields = EXPORTS[self.export]
+        try:
+            queryset = build_queryset(request.query_params)
+        except ValueError as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        compress = request.query_params.get('gzip', '').lower() == 'true'
+        filename = f'{self.export}.{file_format}'
+        response = StreamingHttpResponse(
+            iter_export(queryset, fields, file_format, compress=compress),
+            content_type='application/gzip' if compress else CONTENT_TYPES[file_format],
+        )
+        response['Content-Disposition'] = content_disposition_header(True, filename + ('.gz' if compress else ''))
+        return stream_for(request, response)
+
+
+class PatientExportView(ExportView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin | IsFrontDesk]
+    export = 'patients'
+
+
+class SyncView(APIView):
+    # Delta sync: rows changed and ids deleted since the client's watermark. Clients pass
+    # the returned watermark back on their next call and keep calling while has_more.
+    # Subclasses set the model and the serializer its rows are rendered with.
+    model = None
+    serializer_class = None
+
+    def get_serializer_context(self):
+        return {}
+
+    def get_serializer(self, *args, **kwargs):
+        return self.serializer_class(*args, context=self.get_serializer_context(), **kwargs)
+
+    def get(self, request):
+        # Handle GET requests for the changes since a watermark
+        try:
+            page_size = int(request.query_params.get('page_size', 0))
+        except ValueError:
+            page_size = 0
+
+        # Load the selected fields, and the timestamp the watermark is built from
+        selection = get_field_selection(request)
+        queryset = self.get_serializer(**selection).setup_eager_loading(self.model.objects.all(), 'updated_date')
+
+        sync = DeltaSync(self.model._meta.model_name, queryset, timestamp_field='updated_date')
+        try:
+            rows, deleted, watermark, has_more = sync.get_changes(request.query_params.get('watermark'), page_size)
+        except InvalidWatermark as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'results': self.get_serializer(rows, many=True, **selection).data,
+            'deleted': deleted,
+            'watermark': watermark,
+            'has_more': has_more,
+        }, status=status.HTTP_200_OK)
+
+
+class PatientSyncView(SyncView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin | IsFrontDesk]
+    model = Patient
+    serializer_class = PatientSerializer
+
+
 class ProcedureView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsAdmin | IsDoctor]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    # Tables the list is rendered from (the patient and creator are nested), for its ETag
+    # and cache entries
+    version_tables = ['procedure', 'patient', 'user']
 
     def get(self, request):
-        # Handle GET requests to list procedures
-        patient_id = request.query_params.get('patient_id')
-        if patient_id:
-            try:
-                # Filter procedures by patient ID
-                procedures = Procedure.objects.filter(patient_id=patient_id)
-            except Procedure.DoesNotExist:
-                return Response({"error": "No procedures found for the given patient ID."}, status=status.HTTP_404_NOT_FOUND)
-        else:
-            # Retrieve all procedures if no patient ID is provided
-            procedures = Procedure.objects.all()
-
-        # Serialize and return the list of procedures
-        serializer = ProcedureSerializer(procedures, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)    
+        # Handle GET requests to list procedures, answering conditional requests and repeated
+        # queries without running the list query. Pages with inlined reports are too large
+        # to keep in the cache.
+        context = get_procedure_context(request)
+        return caching.cached_list_response(
+            request, self.version_tables, lambda: self.get_page_data(request, context),
+            cache=not context['include_report_base64'],
+        )
+
+    def get_page_data(self, request, context):
+        procedures = get_procedure_queryset(request)
+
+        # Serialize a single page of procedures, read as .values() rows
+        serializer = ProcedureValuesSerializer(context=context, **get_field_selection(request))
+        paginator = KeysetPagination()
+        rows = serializer.values(procedures, *get_ordering_columns(Procedure._meta.ordering))
+        page = paginator.paginate_queryset(rows, request, view=self)
+        with instrumentation.timed_serializer():
+            data = serializer.many(page)
+        return paginator.get_paginated_data(data)
     
     def post(self, request):
         # Handle POST requests to create a new procedure
@@ -237,14 +582,14 @@ class ProcedureView(APIView):
         if serializer.is_valid():
             # Save the procedure and associate it with the patient and user
             procedure = serializer.save(patient=patient, created_by=request.user)
-            return Response(ProcedureSerializer(procedure).data, status=status.HTTP_201_CREATED)
+            return Response(ProcedureSerializer(procedure, context=get_procedure_context(request)).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     def put(self, request, pk):
         # Handle PUT requests to update a procedure
         try:
             # Retrieve the procedure by its primary key
-            procedure = Procedure.objects.get(pk=pk)
+            procedure = Procedure.objects.select_related('patient', 'created_by').get(pk=pk)
         except Procedure.DoesNotExist:
             return Response({"detail": "Procedure not found."}, status=status.HTTP_404_NOT_FOUND)
         
@@ -256,9 +601,91 @@ class ProcedureView(APIView):
             data['category'] = data['category'].lower()
 
         # Serialize and validate the update data
-        serializer = ProcedureSerializer(procedure, data=data, partial=True)
+        serializer = ProcedureSerializer(procedure, data=data, partial=True, context=get_procedure_context(request))
         if serializer.is_valid():
             # Save the updated procedure data
             serializer.save()
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ProcedureBulkView(APIView):
+    # Base of the bulk procedure endpoints: the body holds a list of items under
+    # `items_key`, which the `bulk_class` processes in one transaction
+    permission_classes = [permissions.IsAuthenticated, IsAdmin | IsDoctor]
+    items_key = None
+    bulk_class = None
+
+    def get_items(self, request):
+        items = request.data.get(self.items_key) if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not items:
+            return None, Response({self.items_key: "A non-empty list is required."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.bulk_class.max_items:
+            return None, Response(
+                {self.items_key: f"At most {self.bulk_class.max_items} items are accepted."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return items, None
+
+
+class ProcedureBulkCreateView(ProcedureBulkView):
+    items_key = 'procedures'
+    bulk_class = ProcedureBulkCreator
+
+    def post(self, request):
+        # Handle POST requests to create many procedures for existing patients at once
+        items, error = self.get_items(request)
+        if error is not None:
+            return error
+        report = ProcedureBulkCreator(created_by=request.user).run(items)
+        return Response(report, status=status.HTTP_201_CREATED if report['created'] else status.HTTP_400_BAD_REQUEST)
+
+
+class ProcedureBulkStatusView(ProcedureBulkView):
+    items_key = 'updates'
+    bulk_class = ProcedureStatusUpdater
+
+    def post(self, request):
+        # Handle POST requests to change the status of many procedures at once
+        items, error = self.get_items(request)
+        if error is not None:
+            return error
+        report = ProcedureStatusUpdater().run(items)
+        return Response(report, status=status.HTTP_200_OK)
+
+
+class ProcedureExportView(ExportView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin | IsDoctor]
+    export = 'procedures'
+
+
+class ProcedureSyncView(SyncView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin | IsDoctor]
+    model = Procedure
+    serializer_class = ProcedureSerializer
+
+    def get_serializer_context(self):
+        return get_procedure_context(self.request)
+
+
+class ProcedureReportView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdmin | IsDoctor]
+
+    def perform_content_negotiation(self, request, force=False):
+        # The report is returned as a raw file, so any Accept header is fine
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, pk):
+        # Handle GET requests to download the report of a procedure
+        try:
+            procedure = Procedure.objects.only('id', 'report', 'report_filename').get(pk=pk)
+        except Procedure.DoesNotExist:
+            return Response({"detail": "Procedure not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        if not procedure.report or not os.path.isfile(procedure.report.path):
+            return Response({"detail": "No report available."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Stream the file from MEDIA_ROOT in chunks, honouring Range and conditional headers
+        path = procedure.report.path
+        filename = procedure.report_filename or os.path.basename(path)
+        return ranged_file_response(request, path, content_type='application/pdf', filename=filename)